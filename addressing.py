@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+from typing import Iterable, NamedTuple
+
+
+# IPv4 subnet masks for all 33 prefix lengths, as integers and dotted, and the reverse lookup
+IPV4_MASK_VALUES: tuple[int, ...] = tuple(
+    (0xffffffff << (32 - prefix)) & 0xffffffff for prefix in range(33)
+)
+IPV4_MASKS: tuple[str, ...] = tuple(
+    '.'.join(str(mask >> shift & 0xff) for shift in (24, 16, 8, 0)) for mask in IPV4_MASK_VALUES
+)
+MASK_TO_PREFIX: dict[str, int] = {mask: prefix for prefix, mask in enumerate(IPV4_MASKS)}
+# Octet and prefix strings mapped to their values. Looking a string up here validates it
+# and converts it in one go. Zero-padded octets are accepted too, like the old regex did,
+# but are kept in a separate table, so that the common case doesn't need to be normalized.
+_OCTETS: dict[str, int] = {str(value): value for value in range(256)}
+_PADDED_OCTETS: dict[str, int] = {
+    text: value for value in range(256) for text in (str(value), f"{value:02}", f"{value:03}")
+}
+_IPV4_PREFIXES: dict[str, int] = {
+    text: value for value in range(33) for text in (str(value), f"{value:02}")
+}
+
+
+def get_mask(prefix: int) -> str:
+    if not (0 <= prefix <= 32):
+        raise ValueError("Network mask can only range between 0 and 32")
+    return IPV4_MASKS[prefix]
+
+
+def mask_to_prefix(mask: str) -> int | None:
+    """
+    Convert a subnet, as found in `IPSubnet`, to a prefix length.
+    IPv4 subnets are dotted masks, while IPv6 ones are already prefix lengths ('64').
+    Returns `None` for an invalid, or non-contiguous mask.
+    """
+    if (prefix := MASK_TO_PREFIX.get(mask)) is not None:
+        return prefix
+    if mask.isdigit() and len(mask) <= 3 and int(mask) <= 128:
+        return int(mask)
+    return None
+
+
+def ipv4_to_int(text: str) -> int | None:
+    parts = text.split('.')
+    if len(parts) != 4:
+        return None
+    octets = _PADDED_OCTETS
+    try:
+        return (
+            octets[parts[0]] << 24 | octets[parts[1]] << 16 | octets[parts[2]] << 8
+            | octets[parts[3]]
+        )
+    except KeyError:
+        return None
+
+
+def int_to_ipv4(value: int) -> str:
+    return f"{value >> 24 & 0xff}.{value >> 16 & 0xff}.{value >> 8 & 0xff}.{value & 0xff}"
+
+
+class Network(NamedTuple):
+    """
+    A parsed "address/prefix" entry. `value` is the address as an integer,
+    and `address` is its normalized text form.
+    """
+    version: int
+    value: int
+    prefix: int
+    address: str
+
+    @property
+    def bits(self) -> int:
+        return 32 if self.version == 4 else 128
+
+    @property
+    def mask(self) -> str:
+        """
+        The subnet in the form used by `IPSubnet` - a dotted mask for IPv4,
+        and the prefix length for IPv6.
+        """
+        if self.version == 4:
+            return IPV4_MASKS[self.prefix]
+        return str(self.prefix)
+
+    @property
+    def network_value(self) -> int:
+        host_bits = self.bits - self.prefix
+        return self.value >> host_bits << host_bits
+
+    @property
+    def broadcast_value(self) -> int:
+        return self.network_value | ((1 << (self.bits - self.prefix)) - 1)
+
+    @property
+    def size(self) -> int:
+        return 1 << (self.bits - self.prefix)
+
+    def __str__(self) -> str:
+        return f"{self.address}/{self.prefix}"
+
+
+def _parse_ipv6(text: str, default_prefix: int) -> Network | None:
+    import ipaddress
+    address, slash, raw_prefix = text.partition('/')
+    if slash:
+        if not raw_prefix.isdigit() or len(raw_prefix) > 3 or int(raw_prefix) > 128:
+            return None
+        prefix = int(raw_prefix)
+    else:
+        prefix = default_prefix
+    try:
+        parsed = ipaddress.IPv6Address(address)
+    except ValueError:
+        return None
+    return Network(6, int(parsed), prefix, str(parsed))
+
+
+def _parse_ipv4(text: str, default_prefix: int) -> Network | None:
+    address, slash, raw_prefix = text.partition('/')
+    if slash:
+        if (prefix := _IPV4_PREFIXES.get(raw_prefix)) is None:
+            return None
+    else:
+        prefix = default_prefix
+    if (value := ipv4_to_int(address)) is None:
+        return None
+    return Network(4, value, prefix, int_to_ipv4(value))
+
+
+def parse_cidr(
+    text: str, *, default_prefix: int = 24, default_prefix6: int = 64
+) -> Network | None:
+    """
+    Parse an IPv4 or IPv6 "address[/prefix]" entry. The prefix defaults to `default_prefix`
+    for IPv4 and `default_prefix6` for IPv6. Returns `None` if the entry isn't valid.
+    """
+    return parse_many(
+        (text,), default_prefix=default_prefix, default_prefix6=default_prefix6
+    )[0]
+
+
+def parse_many(
+    entries: Iterable[str], *, default_prefix: int = 24, default_prefix6: int = 64
+) -> list[Network | None]:
+    """
+    Parse a batch of entries at once, like the lines of an imported file.
+    Returns a list with the parsed entry or `None` for each input entry, in order.
+    """
+    # everything the common IPv4 path needs is bound to locals, since this runs in a tight loop
+    octets = _OCTETS
+    prefixes = _IPV4_PREFIXES
+    new = tuple.__new__
+    results: list[Network | None] = []
+    append = results.append
+    for text in entries:
+        text = text.strip()
+        if ':' in text:
+            append(_parse_ipv6(text, default_prefix6))
+            continue
+        address, slash, raw_prefix = text.partition('/')
+        prefix = prefixes.get(raw_prefix) if slash else default_prefix
+        parts = address.split('.')
+        if prefix is None or len(parts) != 4:
+            append(None)
+            continue
+        try:
+            value = (
+                octets[parts[0]] << 24 | octets[parts[1]] << 16 | octets[parts[2]] << 8
+                | octets[parts[3]]
+            )
+        except KeyError:
+            # not in the canonical form, which needs normalizing if valid at all
+            append(_parse_ipv4(text, default_prefix))
+            continue
+        append(new(Network, (4, value, prefix, address)))
+    return results
+
+
+def validate_many(
+    entries: Iterable[str], *, default_prefix: int = 24, default_prefix6: int = 64
+) -> tuple[list[Network], list[tuple[int, str]]]:
+    """
+    Validate a batch of entries, returning the parsed valid ones,
+    and the (position, entry) pairs of the invalid ones.
+    """
+    entries = list(entries)
+    valid: list[Network] = []
+    invalid: list[tuple[int, str]] = []
+    parsed = parse_many(entries, default_prefix=default_prefix, default_prefix6=default_prefix6)
+    for position, (entry, network) in enumerate(zip(entries, parsed)):
+        if network is None:
+            invalid.append((position, entry))
+        else:
+            valid.append(network)
+    return valid, invalid
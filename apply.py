@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+from functools import partial
+from typing import Any, Callable, Mapping, NamedTuple, TYPE_CHECKING
+
+from backend import com_apartment
+from addressing import parse_cidr
+
+if TYPE_CHECKING:
+    from backend import Backend
+    from journal import Journal
+    from cache import AdapterSnapshot
+
+
+# Return codes of the InterfaceType methods, as documented there
+RETURN_CODES: dict[int, str] = {
+    0: "Successful completion, no reboot required.",
+    1: "Successful completion, reboot required.",
+    64: "Method not supported on this platform.",
+    65: "Unknown failure.",
+    66: "Invalid subnet mask.",
+    67: "An error occurred while processing an instance that was returned.",
+    68: "Invalid input parameter.",
+    69: "More than five gateways specified.",
+    70: "Invalid IP address.",
+    71: "Invalid gateway IP address.",
+    72: "An error occurred while accessing the registry for the requested information.",
+    73: "Invalid domain name.",
+    74: "Invalid host name.",
+    75: "No primary or secondary WINS server defined.",
+    76: "Invalid file.",
+    77: "Invalid system path.",
+    78: "File copy failed.",
+    79: "Invalid security parameter.",
+    80: "Unable to configure TCP/IP service.",
+    81: "Unable to configure DHCP service.",
+    82: "Unable to renew DHCP lease.",
+    83: "Unable to release DHCP lease.",
+    84: "IP not enabled on adapter.",
+    85: "IPX not enabled on adapter.",
+    86: "Frame or network number bounds error.",
+    87: "Invalid frame type.",
+    88: "Invalid network number.",
+    89: "Duplicate network number.",
+    90: "Parameter out of bounds.",
+    91: "Access denied.",
+    92: "Out of memory.",
+    93: "Already exists.",
+    94: "Path, file, or object not found.",
+    95: "Unable to notify service.",
+    96: "Unable to notify DNS service.",
+    97: "Interface not configurable.",
+    98: "Not all DHCP leases could be released or renewed.",
+    100: "DHCP not enabled on the adapter.",
+}
+
+
+def describe_return_code(return_code: int) -> str:
+    return f"{return_code}: {RETURN_CODES.get(return_code, 'Unknown return code.')}"
+
+
+def succeeded(return_codes: list[int]) -> bool:
+    return all(return_code in (0, 1) for return_code in return_codes)
+
+
+def parse_ipmask(ipmask: str, default_prefix: int = 24) -> tuple[str, str] | None:
+    """
+    Parse an IPv4 "address[/prefix]" string into an (address, subnet mask) pair.
+    Returns `None` if the string isn't a valid IPv4 address.
+    """
+    if (network := parse_cidr(ipmask, default_prefix=default_prefix)) is None:
+        return None
+    if network.version != 4:
+        return None
+    return (network.address, network.mask)
+
+
+class MethodCall(NamedTuple):
+    """
+    A single `InterfaceType` method call, yet to be made.
+    """
+    method: str
+    params: dict[str, Any]
+
+    def __str__(self) -> str:
+        params = ', '.join(f"{name}={value!r}" for name, value in self.params.items())
+        return f"{self.method}({params})"
+
+
+def static_calls(ip: str, subnetmask: str, gateway: str) -> list[MethodCall]:
+    """
+    The calls needed to switch an adapter to the given static address and gateway,
+    regardless of its current configuration. See `plan_changes` for the minimal version.
+    """
+    return [
+        MethodCall("EnableStatic", {"IPAddress": [ip], "SubnetMask": [subnetmask]}),
+        MethodCall("SetGateways", {"DefaultIPGateway": [gateway]}),
+    ]
+
+
+class DesiredConfig(NamedTuple):
+    """
+    The configuration an adapter should end up with.
+    Fields left as `None` are left as they currently are on the adapter.
+    With `dhcp` enabled, the addresses, subnets and gateways are ignored.
+    """
+    dhcp: bool = False
+    addresses: tuple[str, ...] = ()
+    subnets: tuple[str, ...] = ()
+    gateways: tuple[str, ...] | None = None
+    gateway_metrics: tuple[int, ...] | None = None
+    dns: tuple[str, ...] | None = None
+    metric: int | None = None
+
+
+def current_config(snapshot: AdapterSnapshot) -> DesiredConfig:
+    """
+    A desired configuration the adapter already has, to `_replace` the fields
+    that should change in. Keeps DHCP enabled, if it is.
+    """
+    return DesiredConfig(
+        dhcp=snapshot.DHCPEnabled,
+        addresses=tuple(a for a in snapshot.IPAddress if ':' not in a),
+        subnets=tuple(
+            s for a, s in zip(snapshot.IPAddress, snapshot.IPSubnet) if ':' not in a
+        ),
+    )
+
+
+def dns_only(snapshot: AdapterSnapshot, servers: tuple[str, ...]) -> DesiredConfig:
+    """
+    A desired configuration that only changes the DNS servers of the adapter.
+    """
+    return current_config(snapshot)._replace(dns=servers)
+
+
+def _ipv4(values: tuple[Any, ...], keys: tuple[str, ...]) -> tuple[Any, ...]:
+    # IPv6 entries are managed by the system, so only the IPv4 ones are ever compared
+    return tuple(value for value, key in zip(values, keys) if ':' not in key)
+
+
+def plan_changes(snapshot: AdapterSnapshot, desired: DesiredConfig) -> list[MethodCall]:
+    """
+    Compare the desired configuration against the adapter's current state,
+    and return the smallest ordered list of calls needed to get there.
+    An empty list means there's nothing to change.
+    """
+    calls: list[MethodCall] = []
+    if desired.dhcp:
+        if not snapshot.DHCPEnabled:
+            calls.append(MethodCall("EnableDHCP", {}))
+    else:
+        addresses = _ipv4(snapshot.IPAddress, snapshot.IPAddress)
+        subnets = _ipv4(snapshot.IPSubnet, snapshot.IPAddress)
+        if (
+            snapshot.DHCPEnabled
+            or addresses != desired.addresses
+            or subnets != desired.subnets
+        ):
+            calls.append(
+                MethodCall(
+                    "EnableStatic",
+                    {"IPAddress": list(desired.addresses), "SubnetMask": list(desired.subnets)},
+                )
+            )
+        if desired.gateways is not None:
+            current = snapshot.DefaultIPGateway
+            gateways = _ipv4(current, current)
+            metrics = _ipv4(snapshot.GatewayCostMetric, current)
+            # switching from DHCP drops the gateways it handed out, even the same ones
+            if snapshot.DHCPEnabled or gateways != desired.gateways or (
+                desired.gateway_metrics is not None and metrics != desired.gateway_metrics
+            ):
+                params: dict[str, Any] = {"DefaultIPGateway": list(desired.gateways)}
+                if desired.gateway_metrics is not None:
+                    params["GatewayCostMetric"] = list(desired.gateway_metrics)
+                calls.append(MethodCall("SetGateways", params))
+    if desired.dns is not None and snapshot.DNSServerSearchOrder != desired.dns:
+        calls.append(
+            MethodCall("SetDNSServerSearchOrder", {"DNSServerSearchOrder": list(desired.dns)})
+        )
+    if desired.metric is not None and snapshot.IPConnectionMetric != desired.metric:
+        calls.append(MethodCall("SetIPConnectionMetric", {"IPConnectionMetric": desired.metric}))
+    return calls
+
+
+def run_calls(
+    backend: Backend,
+    nic: AdapterSnapshot,
+    calls: list[MethodCall],
+    progress: Callable[[int, MethodCall, int], None] | None = None,
+) -> list[int]:
+    """
+    Make the calls in order, returning their return codes.
+    Stops at the first call that fails, so the returned list can be shorter than `calls`.
+    After each call, `progress` is called with its position, the call and the return code.
+    """
+    return_codes: list[int] = []
+    bound = backend.bind(nic)
+    for step, call in enumerate(calls):
+        return_code = bound(call.method, **call.params)
+        return_codes.append(return_code)
+        if progress is not None:
+            progress(step, call, return_code)
+        if return_code not in (0, 1):
+            break
+    return return_codes
+
+
+def apply_static(
+    backend: Backend, nic: AdapterSnapshot, ip: str, subnetmask: str, gateway: str
+) -> list[int]:
+    """
+    Switch the adapter to the given static address and gateway.
+    Returns the return codes of the EnableStatic and SetGateways calls.
+    """
+    return run_calls(backend, nic, static_calls(ip, subnetmask, gateway))
+
+
+def _run_in_apartment(
+    backend: Backend,
+    nic: AdapterSnapshot,
+    calls: list[MethodCall],
+    progress: Callable[[AdapterSnapshot, int, MethodCall, int], None] | None,
+    journal: Journal | None,
+    host: str | None,
+) -> list[int]:
+    report = None if progress is None else partial(progress, nic)
+    with com_apartment():
+        if journal is None:
+            return run_calls(backend, nic, calls, report)
+        from journal import run_journaled
+        return run_journaled(journal, backend, nic, calls, report, host=host)
+
+
+def apply_many(
+    backend: Backend,
+    plans: Mapping[AdapterSnapshot, list[MethodCall]],
+    *,
+    max_workers: int = 4,
+    progress: Callable[[AdapterSnapshot, int, MethodCall, int], None] | None = None,
+    journal: Journal | None = None,
+    host: str | None = None,
+) -> dict[str, list[int] | Exception]:
+    """
+    Make the calls for multiple adapters at once, using a pool of up to `max_workers` threads.
+    Calls for a single adapter are still made in order. Each thread joins the COM apartment
+    for the duration of its task. `progress` receives the adapter along with the usual
+    `run_calls` arguments, and is called from the pool threads.
+    With a `journal`, every adapter's apply is recorded in it, along with the `host`
+    the backend is connected to, if it's a remote one.
+
+    Returns the return codes of each adapter keyed by its SettingID,
+    or the exception raised while configuring it.
+    """
+    # imported here, since it's fairly heavy and only needed for multiple adapters
+    from concurrent.futures import ThreadPoolExecutor
+
+    results: dict[str, list[int] | Exception] = {}
+    if not plans:
+        return results
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(plans)), thread_name_prefix="apply"
+    ) as pool:
+        futures = {
+            nic.SettingID: pool.submit(
+                _run_in_apartment, backend, nic, calls, progress, journal, host
+            )
+            for nic, calls in plans.items()
+        }
+        for setting_id, future in futures.items():
+            try:
+                results[setting_id] = future.result()
+            except Exception as exc:
+                results[setting_id] = exc
+    return results
+
+
+# The per-adapter DHCP lease operations, by the name used in the GUI and CLI
+DHCP_METHODS: dict[str, str] = {
+    "renew": "RenewDHCPLease",
+    "release": "ReleaseDHCPLease",
+}
+
+
+def dhcp_many(
+    backend: Backend,
+    nics: list[AdapterSnapshot],
+    operation: str,
+    *,
+    max_workers: int = 16,
+    progress: Callable[[AdapterSnapshot, int, MethodCall, int], None] | None = None,
+    journal: Journal | None = None,
+) -> dict[str, list[int] | Exception]:
+    """
+    Renew or release the DHCP leases of multiple adapters at once, see `apply_many`.
+    Waiting for a DHCP server can take seconds per adapter, so the pool is larger by default,
+    making the total time closer to that of the slowest adapter, rather than the sum of them.
+    Adapters without DHCP enabled fail with return code 100.
+    """
+    if (method := DHCP_METHODS.get(operation)) is None:
+        raise ValueError(f"Unknown DHCP operation: {operation!r}")
+    plans = {nic: [MethodCall(method, {})] for nic in nics}
+    return apply_many(
+        backend, plans, max_workers=max_workers, progress=progress, journal=journal
+    )
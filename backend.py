@@ -0,0 +1,594 @@
+from __future__ import annotations
+
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Sequence, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cache import AdapterSnapshot
+    from dispatch import ClassDispatch, FakeCOM
+    from element_types import InterfaceType
+
+
+@contextmanager
+def com_apartment() -> Iterator[None]:
+    """
+    Initialize COM for the current thread, for the duration of the context.
+
+    The multithreaded apartment is used, so that objects created in it can be used
+    from the GUI thread as well, which never initializes COM on its own.
+    Does nothing when pywin32 isn't available, like with the fake backend on Linux.
+    """
+    if "pythoncom" not in sys.modules:
+        # pythoncom initializes COM for the importing thread - make sure it uses the MTA too
+        sys.coinit_flags = 0  # type: ignore[attr-defined]
+    try:
+        import pythoncom
+    except ImportError:
+        yield
+        return
+    pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+    try:
+        yield
+    finally:
+        pythoncom.CoUninitialize()
+
+
+class Backend:
+    """
+    Common interface for everything that can enumerate network adapters and configure them.
+
+    Subclasses need to implement `interfaces`, `interface` and `bind` - the named helpers
+    all funnel into `call`, and from there into `bind`, using the method and parameter names
+    of `InterfaceType`.
+    Methods are called with adapter snapshots, and the live adapter object is only looked up
+    (by its Index) when it's actually needed.
+    """
+
+    def interfaces(self, fields: Sequence[str] | None = None) -> list[InterfaceType]:
+        """
+        Return the list of IP-enabled network adapters.
+
+        If `fields` are specified, the returned objects are only guaranteed to have
+        those properties available, and can't be used to call methods.
+        """
+        raise NotImplementedError
+
+    def iter_interfaces(self, fields: Sequence[str] | None = None) -> Iterator[InterfaceType]:
+        """
+        Like `interfaces`, but yields the adapters one by one, as they're received,
+        instead of waiting for all of them first. Use it to process many adapters
+        without holding all of them in memory.
+        """
+        yield from self.interfaces(fields)
+
+    def interface(self, index: int) -> InterfaceType | None:
+        """
+        Return the live adapter object with the given Index, or `None` if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def read(self, nic: InterfaceType, fields: Sequence[str]) -> list[Any]:
+        """
+        Read the given properties of an adapter returned by `interfaces` or `interface`.
+        """
+        return [getattr(nic, name) for name in fields]
+
+    def call(self, nic: AdapterSnapshot, method: str, **params: Any) -> int:
+        """
+        Call the given `InterfaceType` method on the adapter, and return its return code.
+        """
+        return self.bind(nic)(method, **params)
+
+    def bind(self, nic: AdapterSnapshot) -> Callable[..., int]:
+        """
+        Return a function calling the given method with the keyword parameters on the adapter,
+        like `call` does. The live adapter is only looked up once, on the first call,
+        so use it to make several calls in a row.
+        """
+        raise NotImplementedError
+
+    def enable_static(self, nic: AdapterSnapshot, addresses: list[str], masks: list[str]) -> int:
+        return self.call(nic, "EnableStatic", IPAddress=addresses, SubnetMask=masks)
+
+    def set_gateways(
+        self, nic: AdapterSnapshot, gateways: list[str], metrics: list[int] | None = None
+    ) -> int:
+        if metrics is None:
+            return self.call(nic, "SetGateways", DefaultIPGateway=gateways)
+        return self.call(nic, "SetGateways", DefaultIPGateway=gateways, GatewayCostMetric=metrics)
+
+    def enable_dhcp(self, nic: AdapterSnapshot) -> int:
+        return self.call(nic, "EnableDHCP")
+
+    def set_dns_servers(self, nic: AdapterSnapshot, servers: list[str]) -> int:
+        return self.call(nic, "SetDNSServerSearchOrder", DNSServerSearchOrder=servers)
+
+    def set_dns_domain(self, nic: AdapterSnapshot, domain: str) -> int:
+        return self.call(nic, "SetDNSDomain", DNSDomain=domain)
+
+    def set_dns_suffixes(self, nic: AdapterSnapshot, suffixes: list[str]) -> int:
+        return self.call(nic, "SetDNSSuffixSearchOrder", DNSDomainSuffixSearchOrder=suffixes)
+
+    def set_connection_metric(self, nic: AdapterSnapshot, metric: int) -> int:
+        return self.call(nic, "SetIPConnectionMetric", IPConnectionMetric=metric)
+
+    def renew_dhcp(self, nic: AdapterSnapshot) -> int:
+        return self.call(nic, "RenewDHCPLease")
+
+    def release_dhcp(self, nic: AdapterSnapshot) -> int:
+        return self.call(nic, "ReleaseDHCPLease")
+
+
+class WMIBackend(Backend):
+    """
+    The real backend, talking to the Win32_NetworkAdapterConfiguration WMI class.
+    Keyword arguments are passed on to `wmi.WMI` when the connection is made.
+    """
+
+    def __init__(self, **connect_kwargs: Any):
+        self._connect_kwargs: dict[str, Any] = connect_kwargs
+        self._connection: Any = None
+        self._connection_lock = threading.Lock()
+        # the connection the dispatch was resolved through, and the dispatch itself
+        self._dispatch: tuple[Any, ClassDispatch] | None = None
+
+    @property
+    def connection(self) -> Any:
+        """
+        The WMI connection, made lazily on first use, since it can take a while.
+        """
+        if self._connection is None:
+            with self._connection_lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+        return self._connection
+
+    def _connect(self) -> Any:
+        import wmi
+        return wmi.WMI(**self._connect_kwargs)
+
+    @property
+    def dispatch(self) -> ClassDispatch:
+        """
+        Early-bound calls to the adapters' methods, resolved once per connection.
+        """
+        connection = self.connection
+        if self._dispatch is None or self._dispatch[0] is not connection:
+            # resolving it twice from two threads at once is harmless
+            self._dispatch = (connection, self._class_dispatch(connection))
+        return self._dispatch[1]
+
+    def _class_dispatch(self, connection: Any) -> ClassDispatch:
+        from dispatch import ClassDispatch
+        return ClassDispatch(
+            connection._namespace.Get("Win32_NetworkAdapterConfiguration")._oleobj_
+        )
+
+    def _raw_object(self, nic: InterfaceType) -> Any:
+        # the IDispatch of the SWbemObject behind the wmi module's wrapper
+        return nic.ole_object._oleobj_
+
+    def interfaces(self, fields: Sequence[str] | None = None) -> list[InterfaceType]:
+        if not fields:
+            return self.connection.Win32_NetworkAdapterConfiguration(IPEnabled=True)
+        # only marshal the properties that are actually needed
+        return self.connection.query(
+            f"SELECT {', '.join(fields)} FROM Win32_NetworkAdapterConfiguration"
+            " WHERE IPEnabled = TRUE"
+        )
+
+    def iter_interfaces(self, fields: Sequence[str] | None = None) -> Iterator[InterfaceType]:
+        # the wmi module always collects the results into a list, so go through
+        # the underlying SWbemServices with a semisynchronous, forward-only query instead
+        # (wbemFlagReturnImmediately | wbemFlagForwardOnly), which doesn't keep them around.
+        # The raw SWbemObjects it yields have the properties, but not the wmi module's methods.
+        wql = (
+            f"SELECT {', '.join(fields) if fields else '*'} FROM Win32_NetworkAdapterConfiguration"
+            " WHERE IPEnabled = TRUE"
+        )
+        yield from self.connection._namespace.ExecQuery(wql, "WQL", 0x10 | 0x20)
+
+    def interface(self, index: int) -> InterfaceType | None:
+        found = self.connection.Win32_NetworkAdapterConfiguration(Index=index)
+        return found[0] if found else None
+
+    def read(self, nic: InterfaceType, fields: Sequence[str]) -> list[Any]:
+        dispatch = self.dispatch
+        instance = self._raw_object(nic)
+        return [dispatch.get(instance, name) for name in fields]
+
+    def bind(self, nic: AdapterSnapshot) -> Callable[..., int]:
+        # the methods are executed through the instance's path, which is keyed by the Index,
+        # so the instance stays usable no matter what the earlier calls have changed
+        instance: Any = None
+
+        def call(method: str, **params: Any) -> int:
+            nonlocal instance
+            if instance is None:
+                if (live := self.interface(nic.Index)) is None:
+                    # 94: Path, file, or object not found.
+                    return 94
+                instance = self._raw_object(live)
+            return self.dispatch.call(instance, method, **params)
+
+        return call
+
+
+# Property values every fake adapter starts with, before the per-adapter ones are applied
+_FAKE_DEFAULTS: dict[str, Any] = {
+    "ArpAlwaysSourceRoute": None,
+    "ArpUseEtherSNAP": None,
+    "DHCPEnabled": False,
+    "DHCPLeaseExpires": None,
+    "DHCPLeaseObtained": None,
+    "DHCPServer": None,
+    "DNSDomain": None,
+    "DNSDomainSuffixSearchOrder": (),
+    "DNSEnabledForWINSResolution": False,
+    "DNSHostName": "FAKEHOST",
+    "DNSServerSearchOrder": (),
+    "DatabasePath": "%SystemRoot%\\System32\\drivers\\etc",
+    "DeadGWDetectEnabled": None,
+    "DefaultIPGateway": (),
+    "DefaultTOS": None,
+    "DefaultTTL": None,
+    "DomainDNSRegistrationEnabled": False,
+    "ForwardBufferMemory": None,
+    "FullDNSRegistrationEnabled": True,
+    "GatewayCostMetric": (),
+    "IGMPLevel": None,
+    "IPConnectionMetric": 25,
+    "IPEnabled": True,
+    "IPFilterSecurityEnabled": False,
+    "IPPortSecurityEnabled": None,
+    "IPSecPermitIPProtocols": (),
+    "IPSecPermitTCPPorts": (),
+    "IPSecPermitUDPPorts": (),
+    "IPUseZeroBroadcast": None,
+    "IPXAddress": None,
+    "IPXEnabled": None,
+    "IPXFrameType": None,
+    "IPXMediaType": None,
+    "IPXNetworkNumber": None,
+    "IPXVirtualNetNumber": None,
+    "KeepAliveInterval": None,
+    "KeepAliveTime": None,
+    "MTU": None,
+    "NumForwardPackets": None,
+    "PMTUBHDetectEnabled": None,
+    "PMTUDiscoveryEnabled": None,
+    "ServiceName": "fakenet",
+    "TcpMaxConnectRetransmissions": None,
+    "TcpMaxDataRetransmissions": None,
+    "TcpNumConnections": None,
+    "TcpUseRFC1122UrgentPointer": None,
+    "TcpWindowSize": None,
+    "TcpipNetbiosOptions": 0,
+    "WINSEnableLMHostsLookup": True,
+    "WINSHostLookupFile": None,
+    "WINSPrimaryServer": None,
+    "WINSScopeID": "",
+    "WINSSecondaryServer": None,
+}
+
+
+def fake_adapter_properties(index: int) -> dict[str, Any]:
+    """
+    Generate a believable set of properties for the fake adapter with the given index.
+    """
+    description = f"Fake Ethernet Adapter #{index}"
+    high, low = index >> 8 & 0xff, index & 0xff
+    return {
+        "Caption": f"[{index:08}] {description}",
+        "Description": description,
+        "Index": index,
+        "SettingID": f"{{00000000-0000-0000-0000-{index:012X}}}",
+        "MACAddress": ':'.join(f"{b:02X}" for b in (0x02, 0, 0, 0, high, low)),
+        "IPAddress": (f"10.{high}.{low}.10", f"fe80::{index:x}:10"),
+        "IPSubnet": ("255.255.255.0", "64"),
+        "DefaultIPGateway": (f"10.{high}.{low}.1",),
+        "GatewayCostMetric": (0,),
+        "DNSServerSearchOrder": (f"10.{high}.{low}.1",),
+    }
+
+
+# How long the leases handed out to the fake adapters last, in seconds
+FAKE_LEASE_TIME = 24 * 60 * 60
+
+
+def cim_datetime(timestamp: float) -> str:
+    """
+    Format a UNIX timestamp the way WMI formats datetimes, in local time:
+    '20220816124219.000000+120', where the last part is the UTC offset in minutes.
+    """
+    local = time.localtime(timestamp)
+    offset = (local.tm_gmtoff or 0) // 60
+    sign = '-' if offset < 0 else '+'
+    return f"{time.strftime('%Y%m%d%H%M%S', local)}.000000{sign}{abs(offset):03}"
+
+
+def marshalled_size(value: Any) -> int:
+    """
+    Estimate how many bytes a property value takes up when marshalled as a COM VARIANT:
+    16 bytes for the VARIANT itself, plus the BSTR or SAFEARRAY payload, if any.
+    """
+    if isinstance(value, str):
+        # length prefix, UTF-16 characters and the null terminator
+        return 16 + 4 + 2 * len(value) + 2
+    if isinstance(value, (list, tuple)):
+        # SAFEARRAY descriptor plus the elements
+        return 16 + 24 + sum(marshalled_size(v) for v in value)
+    return 16
+
+
+class FakeProjection:
+    """
+    Result of a projected query - only carries the selected properties, and has no methods.
+    """
+
+    def __init__(self, **properties: Any):
+        self.__dict__.update(properties)
+
+    def __repr__(self) -> str:
+        return f"<FakeProjection {', '.join(self.__dict__)}>"
+
+
+class FakeInterface:
+    """
+    In-memory stand-in for a single Win32_NetworkAdapterConfiguration instance.
+
+    Methods mimic the wmi module, returning a tuple of out parameters,
+    and only change the adapter's state if the simulated return code indicates a success.
+    """
+
+    def __init__(self, backend: FakeBackend, **properties: Any):
+        self._backend: FakeBackend = backend
+        self.__dict__.update(_FAKE_DEFAULTS)
+        self.__dict__.update(properties)
+
+    def __repr__(self) -> str:
+        return f"<FakeInterface {self.Index}: {self.Description!r}>"
+
+    def _properties(self) -> dict[str, Any]:
+        return {name: value for name, value in self.__dict__.items() if name[0] != '_'}
+
+    def _invoke(self, method: str, **changes: Any) -> tuple[int]:
+        return_code = self._backend.simulate(self, method)
+        if return_code in (0, 1):
+            self.__dict__.update(changes)
+            self._backend.notify("modification", self)
+        return (return_code,)
+
+    def EnableStatic(self, *, IPAddress: list[str], SubnetMask: list[str]) -> tuple[int]:
+        # static addressing only replaces the IPv4 entries, IPv6 ones stay in place
+        ipv6 = [
+            (address, subnet)
+            for address, subnet in zip(self.IPAddress, self.IPSubnet)
+            if ':' in address
+        ]
+        changes: dict[str, Any] = {}
+        if self.DHCPEnabled:
+            # the gateways handed out by DHCP go away along with the lease
+            changes.update(DefaultIPGateway=None, GatewayCostMetric=None)
+        return self._invoke(
+            "EnableStatic",
+            DHCPEnabled=False,
+            IPAddress=(*IPAddress, *(address for address, _ in ipv6)),
+            IPSubnet=(*SubnetMask, *(subnet for _, subnet in ipv6)),
+            **changes,
+        )
+
+    def SetGateways(
+        self, *, DefaultIPGateway: list[str], GatewayCostMetric: list[int] | None = None
+    ) -> tuple[int]:
+        if GatewayCostMetric is None:
+            GatewayCostMetric = [1] * len(DefaultIPGateway)
+        return self._invoke(
+            "SetGateways",
+            DefaultIPGateway=tuple(DefaultIPGateway),
+            GatewayCostMetric=tuple(GatewayCostMetric),
+        )
+
+    def EnableDHCP(self) -> tuple[int]:
+        return self._invoke("EnableDHCP", DHCPEnabled=True)
+
+    def _lease_changes(self) -> dict[str, Any]:
+        # the fake DHCP server hands out the address the adapter already has,
+        # or the one it was generated with, if it's been released
+        ipv4 = [a for a in self.IPAddress if ':' not in a]
+        ipv6 = [(a, s) for a, s in zip(self.IPAddress, self.IPSubnet) if ':' in a]
+        generated = fake_adapter_properties(self.Index)
+        address = ipv4[0] if ipv4 else generated["IPAddress"][0]
+        now = time.time()
+        return {
+            "IPAddress": (address, *(a for a, _ in ipv6)),
+            "IPSubnet": ("255.255.255.0", *(s for _, s in ipv6)),
+            "DefaultIPGateway": self.DefaultIPGateway or generated["DefaultIPGateway"],
+            "DHCPServer": generated["DefaultIPGateway"][0],
+            "DHCPLeaseObtained": cim_datetime(now),
+            "DHCPLeaseExpires": cim_datetime(now + FAKE_LEASE_TIME),
+        }
+
+    def RenewDHCPLease(self) -> tuple[int]:
+        if not self.DHCPEnabled:
+            return self._backend.reject(self, "RenewDHCPLease", 100)
+        return self._invoke("RenewDHCPLease", **self._lease_changes())
+
+    def ReleaseDHCPLease(self) -> tuple[int]:
+        if not self.DHCPEnabled:
+            return self._backend.reject(self, "ReleaseDHCPLease", 100)
+        ipv6 = [(a, s) for a, s in zip(self.IPAddress, self.IPSubnet) if ':' in a]
+        return self._invoke(
+            "ReleaseDHCPLease",
+            IPAddress=tuple(a for a, _ in ipv6),
+            IPSubnet=tuple(s for _, s in ipv6),
+            DefaultIPGateway=(),
+            DHCPLeaseObtained=None,
+            DHCPLeaseExpires=None,
+        )
+
+    def SetDNSServerSearchOrder(self, *, DNSServerSearchOrder: list[str]) -> tuple[int]:
+        return self._invoke(
+            "SetDNSServerSearchOrder", DNSServerSearchOrder=tuple(DNSServerSearchOrder)
+        )
+
+    def SetIPConnectionMetric(self, *, IPConnectionMetric: int) -> tuple[int]:
+        return self._invoke("SetIPConnectionMetric", IPConnectionMetric=IPConnectionMetric)
+
+    def SetDNSDomain(self, *, DNSDomain: str) -> tuple[int]:
+        return self._invoke("SetDNSDomain", DNSDomain=DNSDomain)
+
+    def SetWINSServer(self, *, WINSPrimaryServer: str, WINSSecondaryServer: str) -> tuple[int]:
+        return self._invoke(
+            "SetWINSServer",
+            WINSPrimaryServer=WINSPrimaryServer or None,
+            WINSSecondaryServer=WINSSecondaryServer or None,
+        )
+
+    def SetTcpipNetbios(self, *, TcpipNetbiosOptions: int) -> tuple[int]:
+        return self._invoke("SetTcpipNetbios", TcpipNetbiosOptions=TcpipNetbiosOptions)
+
+    def SetDynamicDNSRegistration(
+        self, *, FullDNSRegistrationEnabled: bool, DomainDNSRegistrationEnabled: bool
+    ) -> tuple[int]:
+        return self._invoke(
+            "SetDynamicDNSRegistration",
+            FullDNSRegistrationEnabled=FullDNSRegistrationEnabled,
+            DomainDNSRegistrationEnabled=DomainDNSRegistrationEnabled,
+        )
+
+    def SetDNSSuffixSearchOrder(self, *, DNSDomainSuffixSearchOrder: list[str]) -> tuple[int]:
+        return self._invoke(
+            "SetDNSSuffixSearchOrder",
+            DNSDomainSuffixSearchOrder=tuple(DNSDomainSuffixSearchOrder),
+        )
+
+
+class FakeBackend(WMIBackend):
+    """
+    In-memory backend that behaves like the WMI one, without needing Windows.
+
+    Parameters:
+    -----------
+    adapters: int | list[dict[str, Any]]
+        Either the number of adapters to generate, or a list of their property dicts.
+    latency: dict[str, float]
+        Seconds to sleep for, keyed by the method name. A few special keys are also recognized:
+        "connect" is spent once when the connection is made,
+        "enumerate" is spent for every adapter returned from a query,
+        and "property" is spent for every property of every adapter returned from a query.
+    return_codes: dict[str, int]
+        Return code to report, keyed by the method name. Methods not listed here succeed.
+    """
+
+    def __init__(
+        self,
+        adapters: int | list[dict[str, Any]] = 1,
+        *,
+        latency: dict[str, float] | None = None,
+        return_codes: dict[str, int] | None = None,
+    ):
+        super().__init__()
+        if isinstance(adapters, int):
+            adapters = [fake_adapter_properties(i) for i in range(adapters)]
+        self.latency: dict[str, float] = latency or {}
+        self.return_codes: dict[str, int] = return_codes or {}
+        # (adapter index, method name, return code) of every method called so far
+        self.calls: list[tuple[int, str, int]] = []
+        # estimated amount of data returned by all queries so far
+        self.bytes_marshalled: int = 0
+        # callables receiving the (kind, adapter) of every change, see FakeEventSource
+        self.event_sinks: list[Callable[[str, FakeInterface], None]] = []
+        self._adapters: list[FakeInterface] = [FakeInterface(self, **a) for a in adapters]
+        # made along with the dispatch, the first time a method is called
+        self._com: FakeCOM | None = None
+
+    def _connect(self) -> FakeBackend:
+        self._sleep("connect")
+        return self
+
+    def _class_dispatch(self, connection: Any) -> ClassDispatch:
+        # calls go through the same dispatch as with WMI, over a fake COM layer
+        from dispatch import ClassDispatch, FakeCOM, FakeWMIClass
+        self._com = FakeCOM()
+        return ClassDispatch(self._com.wrap(FakeWMIClass()))
+
+    def _raw_object(self, nic: InterfaceType) -> Any:
+        from dispatch import FakeWMIObject
+        assert self._com is not None
+        return self._com.wrap(FakeWMIObject(nic))
+
+    def _sleep(self, key: str, times: int = 1) -> None:
+        if (delay := self.latency.get(key, 0)) > 0:
+            time.sleep(delay * times)
+
+    def simulate(self, nic: FakeInterface, method: str) -> int:
+        self._sleep(method)
+        return_code = self.return_codes.get(method, 0)
+        self.calls.append((nic.Index, method, return_code))
+        return return_code
+
+    def reject(self, nic: FakeInterface, method: str, return_code: int) -> tuple[int]:
+        """
+        Fail a method call the adapter's state doesn't allow, like renewing without DHCP.
+        """
+        self._sleep(method)
+        self.calls.append((nic.Index, method, return_code))
+        return (return_code,)
+
+    def notify(self, kind: str, nic: FakeInterface) -> None:
+        for sink in self.event_sinks:
+            sink(kind, nic)
+
+    def add_adapter(self, **properties: Any) -> FakeInterface:
+        """
+        Plug in a new adapter. Properties not specified are generated from the Index.
+        """
+        index = properties.get("Index", max((a.Index for a in self._adapters), default=-1) + 1)
+        adapter = FakeInterface(self, **{**fake_adapter_properties(index), **properties})
+        self._adapters.append(adapter)
+        self.notify("creation", adapter)
+        return adapter
+
+    def remove_adapter(self, index: int) -> None:
+        """
+        Unplug the adapter with the given Index.
+        """
+        for adapter in self._adapters:
+            if adapter.Index == index:
+                self._adapters.remove(adapter)
+                self.notify("deletion", adapter)
+                return
+
+    def _marshal(self, properties: dict[str, Any]) -> None:
+        self.bytes_marshalled += sum(marshalled_size(v) for v in properties.values())
+        self._sleep("enumerate")
+        self._sleep("property", len(properties))
+
+    def interfaces(self, fields: Sequence[str] | None = None) -> list[InterfaceType]:
+        return list(self.iter_interfaces(fields))
+
+    def iter_interfaces(self, fields: Sequence[str] | None = None) -> Iterator[InterfaceType]:
+        self.connection
+        for adapter in list(self._adapters):
+            if not adapter.IPEnabled:
+                continue
+            properties = adapter._properties()
+            if fields:
+                projection = FakeProjection(**{name: properties[name] for name in fields})
+                self._marshal(projection.__dict__)
+                yield projection  # type: ignore[misc]
+            else:
+                self._marshal(properties)
+                yield adapter  # type: ignore[misc]
+
+    def interface(self, index: int) -> InterfaceType | None:
+        self.connection
+        for adapter in self._adapters:
+            if adapter.Index == index:
+                self._marshal(adapter._properties())
+                return adapter  # type: ignore[return-value]
+        return None
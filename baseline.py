@@ -0,0 +1,328 @@
+"""
+Export and import of the full configuration of all adapters, as JSON lines.
+
+Exports are written one adapter at a time, as they're received from WMI, and imports are read,
+validated, planned and applied in batches, so memory use doesn't depend on the file's size.
+"""
+from __future__ import annotations
+
+import json
+from itertools import chain, islice
+from typing import Any, IO, Iterable, Iterator, NamedTuple, Sequence, TYPE_CHECKING
+
+from cache import AdapterSnapshot
+from addressing import MASK_TO_PREFIX, parse_many
+from apply import MethodCall, DesiredConfig, apply_many, plan_changes
+
+if TYPE_CHECKING:
+    from backend import Backend
+    from journal import Journal
+    from element_types import InterfaceType
+
+
+# Properties identifying an adapter - the MAC address is used when the SettingID changes,
+# like after reinstalling the system or the driver
+IDENTITY_FIELDS: tuple[str, ...] = ("SettingID", "Index", "Description", "MACAddress")
+# The per-adapter properties that can be set through InterfaceType methods.
+# The static methods, like SetDNSSuffixSearchOrder, configure all adapters at once,
+# and so aren't part of any single adapter's configuration.
+CONFIG_FIELDS: tuple[str, ...] = (
+    "DHCPEnabled",
+    "IPAddress",
+    "IPSubnet",
+    "DefaultIPGateway",
+    "GatewayCostMetric",
+    "DNSServerSearchOrder",
+    "DNSDomain",
+    "FullDNSRegistrationEnabled",
+    "DomainDNSRegistrationEnabled",
+    "WINSPrimaryServer",
+    "WINSSecondaryServer",
+    "TcpipNetbiosOptions",
+    "IPConnectionMetric",
+)
+EXPORT_FIELDS: tuple[str, ...] = IDENTITY_FIELDS + CONFIG_FIELDS
+_ARRAY_FIELDS = frozenset((
+    "IPAddress", "IPSubnet", "DefaultIPGateway", "GatewayCostMetric", "DNSServerSearchOrder"
+))
+
+
+def config_record(nic: InterfaceType) -> dict[str, Any]:
+    """
+    The exported properties of the adapter, with WMI's `None` for empty arrays
+    normalized to empty lists.
+    """
+    record: dict[str, Any] = {}
+    for name in EXPORT_FIELDS:
+        value = getattr(nic, name)
+        if name in _ARRAY_FIELDS:
+            value = [] if value is None else list(value)
+        record[name] = value
+    return record
+
+
+def export_configs(backend: Backend, file: IO[str]) -> int:
+    """
+    Write the configuration of every IP-enabled adapter to the file, one JSON line each,
+    as soon as it's received. Returns the number of adapters written.
+    """
+    written = 0
+    for nic in backend.iter_interfaces(EXPORT_FIELDS):
+        file.write(json.dumps(config_record(nic), separators=(',', ':')))
+        file.write('\n')
+        written += 1
+    file.flush()
+    return written
+
+
+class RestoreResult(NamedTuple):
+    """
+    The outcome of restoring a single line of an import.
+    `return_codes` is `None` for a dry run, or when the calls couldn't be made at all,
+    in which case `error` says why.
+    """
+    line: int
+    setting_id: str | None
+    description: str | None
+    calls: list[MethodCall]
+    return_codes: list[int] | None = None
+    error: str | None = None
+
+
+def _check_shape(record: Any) -> str | None:
+    # everything validate_record checks before the addresses
+    if not isinstance(record, dict):
+        return "not a JSON object"
+    if not isinstance(record.get("SettingID"), str) and not isinstance(
+        record.get("MACAddress"), str
+    ):
+        return "neither a SettingID nor a MACAddress to find the adapter by"
+    if missing := [name for name in CONFIG_FIELDS if name not in record]:
+        return f"missing {', '.join(missing)}"
+    for name in _ARRAY_FIELDS:
+        if not isinstance(record[name], list) or not all(
+            isinstance(v, int if name == "GatewayCostMetric" else str) for v in record[name]
+        ):
+            return f"{name} isn't a list of the right type"
+    if len(record["IPAddress"]) != len(record["IPSubnet"]):
+        return "IPAddress and IPSubnet differ in length"
+    if not record["DHCPEnabled"] and not any(':' not in a for a in record["IPAddress"]):
+        return "static configuration without an IPv4 address"
+    return None
+
+
+def _addresses(record: dict[str, Any]) -> list[str]:
+    return [
+        *record["IPAddress"],
+        *record["DefaultIPGateway"],
+        *record["DNSServerSearchOrder"],
+        *(server for server in (
+            record["WINSPrimaryServer"], record["WINSSecondaryServer"]
+        ) if server),
+    ]
+
+
+def _check_values(record: dict[str, Any]) -> str | None:
+    # everything validate_record checks after the addresses
+    for address, subnet in zip(record["IPAddress"], record["IPSubnet"]):
+        if ':' not in address and subnet not in MASK_TO_PREFIX:
+            return f"invalid subnet mask {subnet!r}"
+    if record["TcpipNetbiosOptions"] not in (None, 0, 1, 2):
+        return f"invalid TcpipNetbiosOptions {record['TcpipNetbiosOptions']!r}"
+    metric = record["IPConnectionMetric"]
+    if metric is not None and not (isinstance(metric, int) and 1 <= metric <= 9999):
+        return f"invalid IPConnectionMetric {metric!r}"
+    return None
+
+
+def validate_records(records: Sequence[Any]) -> list[str | None]:
+    """
+    Check a batch of records read from an import, returning what's wrong with each of them,
+    or `None` for the ones that are fine. The addresses of the whole batch are parsed at once.
+    """
+    errors = [_check_shape(record) for record in records]
+    addresses = [
+        [] if error is not None else _addresses(record)
+        for record, error in zip(records, errors)
+    ]
+    parsed = iter(parse_many(chain.from_iterable(addresses)))
+    for position, entries in enumerate(addresses):
+        networks = list(islice(parsed, len(entries)))
+        if errors[position] is not None:
+            continue
+        for address, network in zip(entries, networks):
+            if network is None or '/' in address:
+                errors[position] = f"invalid address {address!r}"
+                break
+        else:
+            errors[position] = _check_values(records[position])
+    return errors
+
+
+def validate_record(record: Any) -> str | None:
+    """
+    Check a record read from an import, returning what's wrong with it, or `None` if it's fine.
+    """
+    return validate_records([record])[0]
+
+
+def plan_restore(current: dict[str, Any], saved: dict[str, Any]) -> list[MethodCall]:
+    """
+    The calls needed to bring the adapter from its current configuration to the saved one.
+    Both are records as returned by `config_record`.
+
+    On a DHCP adapter, the record doesn't tell the DNS servers, gateways and metrics
+    handed out by the lease apart from ones set by hand, so they're treated as automatic.
+    Restoring them would pin whatever the lease gave out at the time of the export.
+    """
+    snapshot = AdapterSnapshot(**current)
+    if saved["DHCPEnabled"]:
+        calls = plan_changes(
+            snapshot,
+            DesiredConfig(
+                dhcp=True,
+                # DNS servers set by hand stay when enabling DHCP, unless they're cleared
+                dns=None if current["DHCPEnabled"] else (),
+            ),
+        )
+        return calls + _plan_other(current, saved)
+    ipv4 = [(a, s) for a, s in zip(saved["IPAddress"], saved["IPSubnet"]) if ':' not in a]
+    gateways = [
+        (g, m)
+        for g, m in zip(
+            saved["DefaultIPGateway"],
+            saved["GatewayCostMetric"] or [1] * len(saved["DefaultIPGateway"]),
+        )
+        if ':' not in g
+    ]
+    calls = plan_changes(
+        snapshot,
+        DesiredConfig(
+            dhcp=saved["DHCPEnabled"],
+            addresses=tuple(a for a, _ in ipv4),
+            subnets=tuple(s for _, s in ipv4),
+            gateways=tuple(g for g, _ in gateways),
+            gateway_metrics=tuple(m for _, m in gateways),
+            dns=tuple(saved["DNSServerSearchOrder"]),
+            metric=saved["IPConnectionMetric"],
+        ),
+    )
+    return calls + _plan_other(current, saved)
+
+
+def _plan_other(current: dict[str, Any], saved: dict[str, Any]) -> list[MethodCall]:
+    # the settings outside of DesiredConfig, which are the same for DHCP and static adapters
+    calls: list[MethodCall] = []
+    if (current["DNSDomain"] or '') != (saved["DNSDomain"] or ''):
+        calls.append(MethodCall("SetDNSDomain", {"DNSDomain": saved["DNSDomain"] or ''}))
+    registration = ("FullDNSRegistrationEnabled", "DomainDNSRegistrationEnabled")
+    if any(current[name] != saved[name] for name in registration) and all(
+        saved[name] is not None for name in registration
+    ):
+        calls.append(
+            MethodCall("SetDynamicDNSRegistration", {name: saved[name] for name in registration})
+        )
+    wins = ("WINSPrimaryServer", "WINSSecondaryServer")
+    if any((current[name] or '') != (saved[name] or '') for name in wins):
+        calls.append(MethodCall("SetWINSServer", {name: saved[name] or '' for name in wins}))
+    if (
+        saved["TcpipNetbiosOptions"] is not None
+        and current["TcpipNetbiosOptions"] != saved["TcpipNetbiosOptions"]
+    ):
+        calls.append(
+            MethodCall("SetTcpipNetbios", {"TcpipNetbiosOptions": saved["TcpipNetbiosOptions"]})
+        )
+    return calls
+
+
+def _read_records(lines: Iterable[str]) -> Iterator[tuple[int, Any]]:
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as exc:
+            yield number, exc
+
+
+def import_configs(
+    backend: Backend,
+    lines: Iterable[str],
+    *,
+    batch_size: int = 64,
+    dry_run: bool = False,
+    max_workers: int = 4,
+    journal: Journal | None = None,
+) -> Iterator[RestoreResult]:
+    """
+    Restore the configurations from an export, yielding the result of each line.
+
+    The lines are processed `batch_size` at a time: the batch is validated, matched with
+    the current adapters by SettingID, or by MAC address if there's no such SettingID anymore,
+    planned, and then applied with `apply_many`, before the next batch is read.
+    Lines matching an adapter an earlier line was already restored to are rejected.
+    Only the current adapters are kept in memory besides the batch, and only their
+    identifying properties at that - the full configuration is fetched per batch.
+    With a `journal`, every adapter's restore is recorded in it.
+    """
+    by_setting_id: dict[str, int] = {}
+    by_mac: dict[str, int] = {}
+    for nic in backend.iter_interfaces(IDENTITY_FIELDS):
+        by_setting_id[nic.SettingID] = nic.Index
+        if nic.MACAddress:
+            by_mac.setdefault(nic.MACAddress.upper(), nic.Index)
+    # the line each adapter was restored from, to reject the same adapter coming up again
+    lines_of: dict[str, int] = {}
+    records = _read_records(lines)
+    while batch := list(islice(records, batch_size)):
+        results: dict[int, RestoreResult] = {}
+        plans: dict[AdapterSnapshot, list[MethodCall]] = {}
+        errors = iter(validate_records([r for _, r in batch if not isinstance(r, Exception)]))
+        for number, record in batch:
+            if isinstance(record, Exception):
+                results[number] = RestoreResult(number, None, None, [], error=str(record))
+                continue
+            if (error := next(errors)) is not None:
+                results[number] = RestoreResult(
+                    number, record.get("SettingID"), record.get("Description"), [], error=error
+                )
+                continue
+            index = by_setting_id.get(record.get("SettingID") or '')
+            if index is None and record.get("MACAddress"):
+                index = by_mac.get(record["MACAddress"].upper())
+            live = None if index is None else backend.interface(index)
+            if live is None:
+                results[number] = RestoreResult(
+                    number,
+                    record.get("SettingID"),
+                    record.get("Description"),
+                    [],
+                    error="no matching adapter",
+                )
+                continue
+            current = config_record(live)
+            calls = plan_restore(current, record)
+            snapshot = AdapterSnapshot(**current)
+            if snapshot.SettingID in lines_of:
+                results[number] = RestoreResult(
+                    number,
+                    snapshot.SettingID,
+                    snapshot.Description,
+                    [],
+                    error=f"same adapter as line {lines_of[snapshot.SettingID]}",
+                )
+                continue
+            lines_of[snapshot.SettingID] = number
+            results[number] = RestoreResult(number, snapshot.SettingID, snapshot.Description, calls)
+            if calls and not dry_run:
+                plans[snapshot] = calls
+        for setting_id, outcome in apply_many(
+            backend, plans, max_workers=max_workers, journal=journal
+        ).items():
+            number = lines_of[setting_id]
+            if isinstance(outcome, Exception):
+                results[number] = results[number]._replace(error=repr(outcome))
+            else:
+                results[number] = results[number]._replace(return_codes=outcome)
+        for number, _ in batch:
+            yield results[number]
@@ -0,0 +1,695 @@
+"""
+Benchmarks for the parts of the application that don't need a GUI, or Windows.
+Everything runs against the in-memory `FakeBackend`, with latencies modelled after real hardware.
+
+Usage:
+
+    python benchmark.py [name ...]
+
+Running it without arguments runs all of the benchmarks.
+Benchmarks can also check a budget, in which case exceeding it makes the run exit with 1.
+"""
+from __future__ import annotations
+
+import os
+import datetime
+import asyncio
+import re
+import sys
+import time
+import subprocess
+import argparse
+import statistics
+from typing import Any, Callable
+
+from backend import FakeBackend, cim_datetime, fake_adapter_properties
+from addressing import get_mask, parse_cidr, parse_many
+from cache import AdapterCache, SNAPSHOT_FIELDS
+from instrumentation import InstrumentedBackend
+from baseline import export_configs, import_configs
+from fleet import ConnectionPool, FakeFleet, Fleet, HostChange, apply_plan
+from dispatch import (
+    LOCALE_USER_DEFAULT,
+    DISPATCH_METHOD,
+    DISPATCH_PROPERTYGET,
+    DISPATCH_PROPERTYPUT,
+    ClassDispatch,
+    FakeCOM,
+    FakeOleObject,
+    FakeWMIClass,
+    FakeWMIObject,
+)
+from journal import Journal, plan_replay
+from leases import LeaseTracker, parse_cim_datetime
+from resolvers import FakeTransport, rank_servers, time_server
+from apply import (
+    DesiredConfig,
+    apply_many,
+    apply_static,
+    dhcp_many,
+    parse_ipmask,
+    plan_changes,
+    run_calls,
+    static_calls,
+)
+
+
+# Benchmarks return False when they exceed their budget
+BENCHMARKS: dict[str, Callable[[], bool | None]] = {}
+
+
+def benchmark(func: Callable[[], bool | None]) -> Callable[[], bool | None]:
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(func: Callable[[], Any], *, repeat: int = 5) -> list[float]:
+    """
+    Run the function `repeat` times, returning the wall time of each run in seconds.
+    """
+    samples: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label: str, samples: list[float], *, extra: str = '') -> None:
+    print(
+        f"  {label:<40}"
+        f" min {min(samples) * 1000:9.3f} ms"
+        f"  median {statistics.median(samples) * 1000:9.3f} ms"
+        f"  max {max(samples) * 1000:9.3f} ms"
+        f"{'  ' + extra if extra else ''}"
+    )
+
+
+@benchmark
+def enumeration() -> None:
+    for count in (1, 8, 64, 256):
+        backend = FakeBackend(count, latency={"connect": 0.05, "enumerate": 0.0005})
+        report(f"connect + enumerate {count} adapters", measure(backend.interfaces, repeat=1))
+        report(f"enumerate {count} adapters", measure(backend.interfaces))
+
+
+@benchmark
+def projection() -> None:
+    latency = {"enumerate": 0.0002, "property": 0.00001}
+    for count in (8, 64, 256):
+        for label, fields in (("full", None), ("projected", SNAPSHOT_FIELDS)):
+            backend = FakeBackend(count, latency=latency)
+            backend.connection
+            samples = measure(lambda: backend.interfaces(fields))
+            marshalled = backend.bytes_marshalled // len(samples)
+            report(f"{label} query, {count} adapters", samples, extra=f"{marshalled:>9} bytes")
+
+
+@benchmark
+def apply() -> None:
+    backend = FakeBackend(4, latency={"EnableStatic": 0.02, "SetGateways": 0.005})
+    cache = AdapterCache(backend)
+    nic = cache.snapshots()[2]
+
+    def ipset() -> None:
+        parsed = parse_ipmask("192.168.1.20/24")
+        assert parsed is not None
+        ip, subnetmask = parsed
+        apply_static(backend, nic, ip, subnetmask, "192.168.1.1")
+        cache.invalidate(nic.SettingID)
+
+    report("ipset (EnableStatic + SetGateways)", measure(ipset, repeat=10))
+
+    def planned_ipset() -> None:
+        parsed = parse_ipmask("192.168.1.20/24")
+        assert parsed is not None
+        ip, subnetmask = parsed
+        desired = DesiredConfig(addresses=(ip,), subnets=(subnetmask,), gateways=("192.168.1.1",))
+        snapshot = cache.get(nic.SettingID)
+        assert snapshot is not None
+        run_calls(backend, snapshot, plan_changes(snapshot, desired))
+        cache.invalidate(nic.SettingID)
+
+    # the adapter is already configured by the runs above, so this shouldn't call anything
+    report("planned ipset, nothing changed", measure(planned_ipset, repeat=10))
+
+
+@benchmark
+def multi_apply() -> None:
+    # EnableStatic blocks for a while on real hardware, as the adapter resets
+    latency = {"EnableStatic": 0.1, "SetGateways": 0.01}
+    for count in (4, 8):
+        backend = FakeBackend(count, latency=latency)
+        nics = AdapterCache(backend).snapshots()
+        plans = {
+            nic: static_calls(f"192.168.{nic.Index}.20", "255.255.255.0", f"192.168.{nic.Index}.1")
+            for nic in nics
+        }
+
+        def sequential() -> None:
+            for nic, calls in plans.items():
+                run_calls(backend, nic, calls)
+
+        report(f"{count} adapters, one by one", measure(sequential, repeat=3))
+        report(
+            f"{count} adapters, apply_many(max_workers={count})",
+            measure(lambda: apply_many(backend, plans, max_workers=count), repeat=3),
+        )
+
+
+@benchmark
+def status_refresh() -> None:
+    for count in (8, 64, 512):
+        backend = FakeBackend(count)
+        cache = AdapterCache(backend)
+        cache.snapshots()
+        version, _, _ = cache.changes_since(0)
+        nic = cache.snapshots()[count // 2]
+        metric = 1
+
+        def one_change() -> None:
+            nonlocal version, metric
+            metric += 1
+            cache.update(nic.replace(IPConnectionMetric=metric))
+            version, changed, _ = cache.changes_since(version)
+            assert len(changed) == 1
+
+        def full_compare() -> None:
+            # what refreshing without the change tracking would have to do
+            old = {s.SettingID: s for s in cache.cached()}
+            changed = [s for s in cache.cached() if old[s.SettingID] != s]
+            assert not changed
+
+        report(f"{count} adapters, changes_since", measure(one_change, repeat=20))
+        report(f"{count} adapters, compare everything", measure(full_compare, repeat=20))
+
+
+@benchmark
+def instrumentation() -> None:
+    # no latency at all, so that only the overhead of the timing layer is measured
+    plain = FakeBackend(4)
+    instrumented = InstrumentedBackend(FakeBackend(4))
+    for label, backend in (("plain", plain), ("instrumented", instrumented)):
+        nic = AdapterCache(backend).snapshots()[0]
+
+        def calls() -> None:
+            for _ in range(1000):
+                backend.set_connection_metric(nic, 10)
+
+        report(f"1000 calls, {label}", measure(calls))
+    stats = instrumented.recorder.report()["operations"]["SetIPConnectionMetric"]
+    print(f"  recorded {stats['count']} calls, p95 {stats['p95'] * 1000:.3f} ms")
+
+
+@benchmark
+def dhcp() -> None:
+    # renewing waits on the DHCP server, which can take a good while
+    for count in (4, 16):
+        backend = FakeBackend(
+            [{**fake_adapter_properties(i), "DHCPEnabled": True} for i in range(count)],
+            latency={"RenewDHCPLease": 0.2},
+        )
+        nics = AdapterCache(backend).snapshots()
+
+        def sequential() -> None:
+            for nic in nics:
+                backend.renew_dhcp(nic)
+
+        report(f"renew {count} adapters, one by one", measure(sequential, repeat=1))
+        report(
+            f"renew {count} adapters, dhcp_many",
+            measure(lambda: dhcp_many(backend, nics, "renew"), repeat=3),
+        )
+
+
+@benchmark
+def dns_ranking() -> None:
+    delays = {f"10.0.0.{i}": 0.01 * (i + 1) for i in range(8)}
+    transport = FakeTransport(delays)
+
+    async def one_by_one() -> None:
+        for server in delays:
+            await time_server(server, transport, samples=5)
+
+    report(
+        "8 servers x 5 samples, one by one",
+        measure(lambda: asyncio.run(one_by_one()), repeat=1),
+    )
+    report(
+        "8 servers x 5 samples, rank_servers",
+        measure(lambda: rank_servers(list(delays), transport, samples=5), repeat=3),
+    )
+
+
+def strptime_cim_datetime(text: str) -> float:
+    # the obvious way, kept as the baseline
+    parsed = datetime.datetime.strptime(text[:21], "%Y%m%d%H%M%S.%f")
+    offset = datetime.timedelta(minutes=int(text[21:]))
+    return parsed.replace(tzinfo=datetime.timezone(offset)).timestamp()
+
+
+@benchmark
+def lease_tracking() -> None:
+    now = time.time()
+    # a few hundred adapters share a handful of lease times, like when renewed together
+    values = [cim_datetime(now + 3600 * (i % 8)) for i in range(10000)]
+    assert parse_cim_datetime(values[0]) == strptime_cim_datetime(values[0])
+    report(
+        "10k CIM datetimes, strptime",
+        measure(lambda: [strptime_cim_datetime(v) for v in values]),
+    )
+    report(
+        "10k CIM datetimes, uncached",
+        measure(lambda: [parse_cim_datetime.__wrapped__(v) for v in values]),
+    )
+    report("10k CIM datetimes, cached", measure(lambda: [parse_cim_datetime(v) for v in values]))
+
+    count = 500
+    backend = FakeBackend(
+        [
+            {
+                **fake_adapter_properties(i),
+                "DHCPEnabled": True,
+                # all but the last few leases are far away
+                "DHCPLeaseExpires": cim_datetime(
+                    # CIM datetimes only have whole seconds here
+                    now + (11 + i - count if i >= count - 5 else 3600)
+                ),
+            }
+            for i in range(count)
+        ]
+    )
+    nics = AdapterCache(backend).snapshots()
+    renewed: list[int] = []
+    tracker = LeaseTracker(
+        backend, renew=True, renew_before=5, on_renew=lambda nic, code: renewed.append(code)
+    )
+    tracker.start()
+    report(f"track {count} leases", measure(lambda: [tracker.track(n) for n in nics], repeat=1))
+    time.sleep(6)
+    tracker.stop()
+    print(f"  renewed {len(renewed)} leases in 6 s, with {tracker.wakeups} wake ups")
+
+
+@benchmark
+def baseline() -> None:
+    import io
+    import tracemalloc
+    for count in (100, 1000):
+        backend = FakeBackend(count)
+        with open(os.devnull, 'w') as devnull:
+            tracemalloc.start()
+            report(
+                f"export {count} adapters",
+                measure(lambda: export_configs(backend, devnull), repeat=1),
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print(f"  {'':<40} peak memory {peak / 1024:9.1f} KiB")
+        file = io.StringIO()
+        export_configs(backend, file)
+        lines = file.getvalue().splitlines()
+        for label, dry_run in (("dry run", True), ("nothing to change", False)):
+            tracemalloc.start()
+            report(
+                f"import {count} adapters, {label}",
+                measure(
+                    lambda: sum(1 for _ in import_configs(backend, lines, dry_run=dry_run)),
+                    repeat=1,
+                ),
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {'':<40} peak memory {peak / 1024:9.1f} KiB")
+
+
+@benchmark
+def fleet() -> None:
+    # remote connections take a while to set up, and every query crosses the network
+    latency = {"connect": 0.05, "enumerate": 0.005, "EnableStatic": 0.05}
+    hosts = [f"host{i}" for i in range(32)]
+    changes = [
+        HostChange(host, "0", DesiredConfig(addresses=(f"10.1.{i}.5",), subnets=("255.0.0.0",)))
+        for i, host in enumerate(hosts)
+    ]
+    for concurrency in (1, 16):
+        connect = FakeFleet(dict.fromkeys(hosts, 4), latency=latency)
+        pool = ConnectionPool(connect)
+        runner = Fleet(pool, concurrency=concurrency)
+        report(
+            f"enumerate {len(hosts)} hosts, concurrency {concurrency}",
+            measure(lambda: runner.snapshots(hosts), repeat=1),
+            extra="connecting",
+        )
+        report(
+            f"enumerate {len(hosts)} hosts, concurrency {concurrency}",
+            measure(lambda: runner.snapshots(hosts), repeat=3),
+            extra="pooled",
+        )
+        report(
+            f"apply to {len(hosts)} hosts, concurrency {concurrency}",
+            # only the first run has anything to change
+            measure(lambda: apply_plan(runner, changes), repeat=1),
+            extra=f"{sum(connect.connects.values())} connects",
+        )
+
+
+@benchmark
+def journal() -> None:
+    import json
+    import tempfile
+    backend = FakeBackend(16, latency={"EnableStatic": 0.005, "SetGateways": 0.005})
+    nics = AdapterCache(backend).snapshots()
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (1000, 10000):
+            path = os.path.join(directory, f"journal{count}.jsonl")
+            journal = Journal(path)
+            start = time.perf_counter()
+            for i in range(count):
+                nic = nics[i % len(nics)]
+                desired = DesiredConfig(
+                    addresses=(f"10.{i % 250}.{i // 250 % 250}.5",),
+                    subnets=("255.255.0.0",),
+                    gateways=(f"10.{i % 250}.0.1",),
+                )
+                calls = plan_changes(nic, desired)
+                journal.record(nic, calls, [0] * len(calls), [0.005] * len(calls))
+            print(
+                f"  recorded {count} entries in {time.perf_counter() - start:.2f} s,"
+                f" {os.path.getsize(path) / 1024:.0f} KiB"
+            )
+            report(f"open {count} entries", measure(lambda: Journal(path)))
+            setting_id = nics[0].SettingID
+
+            def full_scan() -> dict[str, Any] | None:
+                latest = None
+                with open(path, encoding="utf8") as file:
+                    for line in file:
+                        record = json.loads(line)
+                        if record["before"]["SettingID"] == setting_id:
+                            latest = record
+                return latest
+
+            report(f"latest of an adapter, {count} entries", measure(full_scan), extra="scan")
+            report(
+                f"latest of an adapter, {count} entries",
+                measure(lambda: journal.latest(setting_id)),
+                extra="indexed",
+            )
+            # replaying one by one takes every call's latency, so the range is kept short
+            since = journal.entry(count - 200).time
+            entries = list(journal.between(since))
+            report(
+                f"replay {len(entries)} entries",
+                measure(
+                    lambda: [
+                        run_calls(backend, entry.before, entry.made_calls())
+                        for entry in entries
+                    ],
+                    repeat=1,
+                ),
+                extra=f"{sum(len(entry.calls) for entry in entries)} calls, one by one",
+            )
+
+            made: list[int] = []
+
+            def folded() -> None:
+                plans, _ = plan_replay(journal.between(since), nics)
+                apply_many(backend, plans)
+                made.append(sum(len(calls) for calls in plans.values()))
+
+            report(
+                f"replay {len(entries)} entries",
+                measure(folded, repeat=1),
+                extra=f"{made[0]} calls, folded",
+            )
+
+
+class LateBound:
+    """
+    Minimal version of win32com's dynamic dispatch wrappers, which the wmi module goes through.
+    Names are resolved the first time they're used on each wrapper, and every object
+    returned gets a new wrapper, with nothing resolved yet.
+    """
+
+    def __init__(self, oleobj: Any):
+        self._oleobj = oleobj
+        self._dispids: dict[str, int] = {}
+
+    def _invoke(self, name: str, flags: int, *args: Any) -> Any:
+        if (dispid := self._dispids.get(name)) is None:
+            dispid = self._dispids[name] = self._oleobj.GetIDsOfNames(name)
+        args = tuple(arg._oleobj if isinstance(arg, LateBound) else arg for arg in args)
+        result = self._oleobj.Invoke(dispid, LOCALE_USER_DEFAULT, flags, True, *args)
+        return LateBound(result) if isinstance(result, FakeOleObject) else result
+
+    def get(self, name: str) -> Any:
+        return self._invoke(name, DISPATCH_PROPERTYGET)
+
+    def put(self, name: str, value: Any) -> None:
+        self._invoke(name, DISPATCH_PROPERTYPUT, value)
+
+    def call(self, name: str, *args: Any) -> Any:
+        return self._invoke(name, DISPATCH_METHOD, *args)
+
+
+def late_bound_call(instance: LateBound, method: str, **params: Any) -> int:
+    # what `getattr(nic, method)(**params)` does in the wmi module, for every call
+    definition = instance.get("Methods_").call("Item", method)
+    in_parameters = definition.get("InParameters")
+    definition.get("OutParameters")
+    if in_parameters is None:
+        result = instance.call("ExecMethod_", method)
+    else:
+        parameters = in_parameters.call("SpawnInstance_")
+        for name, value in params.items():
+            parameters.get("Properties_").call("Item", name).put("Value", value)
+        result = instance.call("ExecMethod_", method, parameters)
+    return int(result.get("Properties_").call("Item", "ReturnValue").get("Value"))
+
+
+@benchmark
+def com_dispatch() -> None:
+    nic = FakeBackend(1)._adapters[0]
+    params = {"IPAddress": ["192.168.0.20"], "SubnetMask": ["255.255.255.0"]}
+    # a local WMI call crosses into the WMI service process, which costs tens of microseconds
+    for latency in (0.0, 0.00005):
+        com = FakeCOM(latency)
+        instance = com.wrap(FakeWMIObject(nic))
+        dispatch = ClassDispatch(com.wrap(FakeWMIClass()))
+        dispatch.call(instance, "EnableStatic", **params)
+        calls = 200 if latency else 2000
+        for label, func in (
+            # a new wrapper every time, like the adapter fetched anew for every call
+            (
+                "late bound",
+                lambda: late_bound_call(LateBound(instance), "EnableStatic", **params),
+            ),
+            ("ClassDispatch", lambda: dispatch.call(instance, "EnableStatic", **params)),
+        ):
+            com.round_trips = 0
+            report(
+                f"{calls} EnableStatic, {label}, {latency * 1e6:.0f} us",
+                measure(lambda: [func() for _ in range(calls)], repeat=3),
+                extra=f"{com.round_trips / (3 * calls):.0f} round trips per call",
+            )
+        for label, read in (
+            (
+                "late bound",
+                lambda: [
+                    LateBound(instance).get("Properties_").call("Item", name).get("Value")
+                    for name in SNAPSHOT_FIELDS
+                ],
+            ),
+            ("ClassDispatch", lambda: [dispatch.get(instance, name) for name in SNAPSHOT_FIELDS]),
+        ):
+            com.round_trips = 0
+            report(
+                f"{calls // 10} snapshot reads, {label}, {latency * 1e6:.0f} us",
+                measure(lambda: [read() for _ in range(calls // 10)], repeat=3),
+                extra=f"{com.round_trips / (3 * calls // 10):.0f} round trips per read",
+            )
+
+
+# The address validation used before the addressing module, kept as the baseline
+LEGACY_IP_PATTERN = re.compile(
+    r'\b('
+    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))\.'
+    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))\.'
+    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))\.'
+    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))'
+    r')(?:/([1-2]?[0-9]|3[0-2]))?'
+    r'\b$'
+)
+
+
+def legacy_get_mask(value: int) -> str:
+    parts = []
+    m, n = divmod(value, 8)
+    for i in range(m):
+        parts.append('255')
+    if n > 0:
+        parts.append(str((1 << 8) - (1 << 8-n)))
+    while len(parts) < 4:
+        parts.append('0')
+    return '.'.join(parts)
+
+
+def legacy_parse(entry: str) -> tuple[str, str] | None:
+    if (match := LEGACY_IP_PATTERN.match(entry)) is None:
+        return None
+    raw_mask = match.group(2)
+    return (match.group(1), legacy_get_mask(24 if raw_mask is None else int(raw_mask)))
+
+
+@benchmark
+def address_parsing() -> None:
+    entries = [
+        f"{10 + i % 200}.{i >> 8 & 0xff}.{i & 0xff}.{i % 250 + 1}/{8 + i % 25}"
+        for i in range(10000)
+    ]
+    # sprinkle in some invalid entries
+    entries[::10] = [f"300.1.1.{i}" for i in range(len(entries[::10]))]
+
+    report("get_mask x 33, legacy loop", measure(lambda: [legacy_get_mask(p) for p in range(33)]))
+    report("get_mask x 33, table", measure(lambda: [get_mask(p) for p in range(33)]))
+    report(
+        "10k IPv4 entries, legacy regex",
+        measure(lambda: [legacy_parse(entry) for entry in entries]),
+    )
+    report("10k IPv4 entries, parse_cidr", measure(lambda: [parse_cidr(e) for e in entries]))
+    report("10k IPv4 entries, parse_many", measure(lambda: parse_many(entries)))
+    mixed = [f"fe80::{i:x}:1/64" if i % 4 == 0 else entry for i, entry in enumerate(entries)]
+    report("10k entries with 25% IPv6, parse_many", measure(lambda: parse_many(mixed)))
+
+
+def run_python(*args: str) -> None:
+    subprocess.run(
+        [sys.executable, *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+@benchmark
+def cold_start() -> None:
+    report("interpreter alone", measure(lambda: run_python("-c", "pass")))
+    # the window itself can't be created without a display, so the GUI runs headless
+    report("GUI start up, 8 fake adapters", measure(lambda: run_python("headless.py", "8")))
+    report(
+        "CLI list, 8 fake adapters",
+        measure(lambda: run_python("-m", "ipchanger", "--fake", "8", "--json", "list")),
+    )
+    report(
+        "CLI set --dry-run, 8 fake adapters",
+        measure(
+            lambda: run_python(
+                "-m", "ipchanger", "--fake", "8", "set", "3", "10.0.3.5", "--dry-run", "--force"
+            )
+        ),
+    )
+
+
+def import_times(*args: str) -> dict[str, int]:
+    """
+    Run Python with `-X importtime` and the arguments, returning the cumulative import time
+    of every module, in microseconds. Only the modules imported by the interpreter itself
+    show up twice, which doesn't matter for the top-level ones this is used for.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    times: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            # nested imports are indented, and included in the cumulative time of their parent
+            times[name[1:].rstrip()] = int(cumulative)
+    return times
+
+
+# Import time budgets, as multiples of the time it takes to import a fixed set of standard
+# library modules, measured in the same run - that scales them with the speed of the machine
+# and how busy it is. The modules listed mustn't be imported on the way, which catches
+# the regressions that matter most, like asyncio sneaking back into the start up.
+IMPORT_BUDGETS: dict[str, tuple[float, tuple[str, ...]]] = {
+    "GUI start up": (2.5, ("asyncio", "concurrent.futures", "wmi", "win32com")),
+    "CLI list": (1.25, ("tkinter", "asyncio", "json", "wmi", "win32com")),
+}
+IMPORT_REFERENCE = "import tkinter, tkinter.ttk, ipaddress, typing, argparse, threading"
+IMPORT_RUNS = 7
+
+
+def total_import_time(times: dict[str, int], baseline: dict[str, int]) -> float:
+    """
+    The time spent on the top-level imports, in milliseconds,
+    leaving out the ones the interpreter makes on its own.
+    """
+    return sum(
+        time for name, time in times.items() if not name.startswith(' ') and name not in baseline
+    ) / 1000
+
+
+@benchmark
+def import_budget() -> bool:
+    baseline = import_times("-c", "pass")
+    references = [
+        total_import_time(import_times("-c", IMPORT_REFERENCE), baseline)
+        for _ in range(IMPORT_RUNS)
+    ]
+    reference = statistics.median(references)
+    report("reference imports", [total / 1000 for total in references])
+    commands = {
+        # runs main.py all the way to mainloop, so a start up that crashes fails the budget
+        "GUI start up": ("headless.py", "8"),
+        "CLI list": ("-m", "ipchanger", "--fake", "8", "list"),
+    }
+    within_budget = True
+    for label, command in commands.items():
+        ratio, forbidden = IMPORT_BUDGETS[label]
+        try:
+            runs = [import_times(*command) for _ in range(IMPORT_RUNS)]
+        except subprocess.CalledProcessError as exc:
+            print(f"  {label} failed:\n{exc.stderr}")
+            within_budget = False
+            continue
+        totals = [total_import_time(times, baseline) for times in runs]
+        # the median isn't thrown off by the odd run disturbed by everything else going on
+        budget = reference * ratio
+        imported = [name for name in forbidden if name in {n.strip() for n in runs[0]}]
+        ok = statistics.median(totals) <= budget and not imported
+        report(
+            f"{label} imports",
+            [total / 1000 for total in totals],
+            extra=f"budget {budget:.0f} ms ({ratio:g}x reference){'' if ok else ', EXCEEDED'}",
+        )
+        if imported:
+            print(f"  {'':<40} imports {', '.join(imported)}")
+        within_budget = within_budget and ok
+    return within_budget
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name", help=', '.join(BENCHMARKS))
+    args = parser.parse_args(argv)
+    if unknown := set(args.names).difference(BENCHMARKS):
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    within_budget = True
+    for name in args.names or BENCHMARKS:
+        print(f"{name}:")
+        if BENCHMARKS[name]() is False:
+            within_budget = False
+    return 0 if within_budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import time
+import threading
+from typing import Any, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backend import Backend
+    from element_types import InterfaceType
+
+
+# The subset of InterfaceType properties the application actually uses
+SNAPSHOT_FIELDS: tuple[str, ...] = (
+    "SettingID",
+    "Index",
+    "Description",
+    "MACAddress",
+    "DHCPEnabled",
+    "DHCPServer",
+    "DHCPLeaseObtained",
+    "DHCPLeaseExpires",
+    "IPAddress",
+    "IPSubnet",
+    "DefaultIPGateway",
+    "GatewayCostMetric",
+    "DNSServerSearchOrder",
+    "IPConnectionMetric",
+)
+
+
+_ARRAY_FIELDS = frozenset((
+    "IPAddress",
+    "IPSubnet",
+    "DefaultIPGateway",
+    "GatewayCostMetric",
+    "DNSServerSearchOrder",
+))
+
+
+class AdapterSnapshot:
+    """
+    Immutable copy of the interesting properties of a single adapter,
+    captured at one point in time. Array properties are stored as tuples,
+    with WMI's `None` for an empty array normalized to an empty tuple.
+    """
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    SettingID: str
+    Index: int
+    Description: str
+    MACAddress: str | None
+    DHCPEnabled: bool
+    DHCPServer: str | None
+    DHCPLeaseObtained: str | None
+    DHCPLeaseExpires: str | None
+    IPAddress: tuple[str, ...]
+    IPSubnet: tuple[str, ...]
+    DefaultIPGateway: tuple[str, ...]
+    GatewayCostMetric: tuple[int, ...]
+    DNSServerSearchOrder: tuple[str, ...]
+    IPConnectionMetric: int | None
+
+    def __init__(self, **values: Any):
+        for name in SNAPSHOT_FIELDS:
+            value = values.get(name)
+            if isinstance(value, (list, tuple)):
+                value = tuple(value)
+            elif value is None and name in _ARRAY_FIELDS:
+                value = ()
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_interface(cls, nic: InterfaceType, backend: Backend | None = None) -> AdapterSnapshot:
+        """
+        Capture the adapter's properties. Pass the backend the adapter came from,
+        to read them the way it reads them best.
+        """
+        if backend is None:
+            return cls(**{name: getattr(nic, name) for name in SNAPSHOT_FIELDS})
+        return cls(**dict(zip(SNAPSHOT_FIELDS, backend.read(nic, SNAPSHOT_FIELDS))))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self) -> str:
+        return f"<AdapterSnapshot {self.Index}: {self.Description!r}>"
+
+    def _values(self) -> tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in SNAPSHOT_FIELDS)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, AdapterSnapshot):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self) -> int:
+        return hash(self._values())
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            name: list(value) if isinstance(value, tuple) else value
+            for name, value in zip(SNAPSHOT_FIELDS, self._values())
+        }
+
+    def replace(self, **changes: Any) -> AdapterSnapshot:
+        """
+        Return a copy of this snapshot, with the given fields changed.
+        """
+        values = {name: getattr(self, name) for name in SNAPSHOT_FIELDS}
+        values.update(changes)
+        return AdapterSnapshot(**values)
+
+
+def find_snapshot(
+    snapshots: Iterable[AdapterSnapshot], selector: str
+) -> AdapterSnapshot | None:
+    """
+    Find an adapter by its Index, SettingID or Description. The SettingID can also be given
+    case-insensitively, and without the braces.
+    """
+    snapshots = list(snapshots)
+    for nic in snapshots:
+        if selector in (str(nic.Index), nic.SettingID, nic.Description):
+            return nic
+    setting_id = selector.strip("{}").lower()
+    for nic in snapshots:
+        if nic.SettingID.strip("{}").lower() == setting_id:
+            return nic
+    return None
+
+
+class AdapterCache:
+    """
+    Cache of adapter snapshots, keyed by their SettingID.
+
+    The whole cache is refreshed from the backend once it's older than `ttl` seconds.
+    Single adapters can be invalidated explicitly, after changing their configuration,
+    in which case only that adapter is fetched again, the next time it's requested.
+    The cache is thread-safe, so it can be refreshed from a worker thread.
+
+    Every change to the cached snapshots bumps `version`, which lets consumers ask for
+    just the adapters that changed since the version they've last seen, via `changes_since`.
+    """
+
+    def __init__(self, backend: Backend, *, ttl: float = 30.0):
+        self._backend: Backend = backend
+        self.ttl: float = ttl
+        self._lock = threading.RLock()
+        self._snapshots: dict[str, AdapterSnapshot] = {}
+        self._by_index: dict[int, str] = {}
+        self._stale: set[str] = set()
+        self._refreshed: float | None = None
+        self.version: int = 0
+        # SettingID -> version it last changed at, ordered from the oldest change
+        self._changes: dict[str, int] = {}
+
+    @property
+    def expired(self) -> bool:
+        return self._refreshed is None or time.monotonic() - self._refreshed > self.ttl
+
+    def refresh(self) -> list[AdapterSnapshot]:
+        """
+        Unconditionally replace the cache contents with a fresh enumeration.
+        """
+        snapshots = [
+            AdapterSnapshot.from_interface(nic, self._backend)
+            for nic in self._backend.interfaces(SNAPSHOT_FIELDS)
+        ]
+        with self._lock:
+            old = self._snapshots
+            self._snapshots = {s.SettingID: s for s in snapshots}
+            for setting_id, snapshot in self._snapshots.items():
+                if old.get(setting_id) != snapshot:
+                    self._record(setting_id)
+            for setting_id in old.keys() - self._snapshots.keys():
+                self._record(setting_id)
+            self._by_index = {s.Index: s.SettingID for s in snapshots}
+            self._stale.clear()
+            self._refreshed = time.monotonic()
+        return snapshots
+
+    def _record(self, setting_id: str) -> None:
+        # called with the lock held
+        self.version += 1
+        self._changes.pop(setting_id, None)
+        self._changes[setting_id] = self.version
+
+    def changes_since(self, version: int) -> tuple[int, list[AdapterSnapshot], list[str]]:
+        """
+        Return the current version, along with the snapshots changed and the SettingIDs
+        removed after the given version. Pass 0 to get everything currently cached.
+        The cost depends only on the number of changes, not on the number of adapters.
+        """
+        changed: list[AdapterSnapshot] = []
+        removed: list[str] = []
+        with self._lock:
+            for setting_id, changed_at in reversed(self._changes.items()):
+                if changed_at <= version:
+                    break
+                if (snapshot := self._snapshots.get(setting_id)) is None:
+                    removed.append(setting_id)
+                else:
+                    changed.append(snapshot)
+            return (self.version, changed, removed)
+
+    def _refetch(self, setting_id: str) -> AdapterSnapshot | None:
+        old = self._snapshots.get(setting_id)
+        nic = None if old is None else self._backend.interface(old.Index)
+        if nic is None:
+            self.remove(setting_id)
+            return None
+        snapshot = AdapterSnapshot.from_interface(nic, self._backend)
+        self.update(snapshot)
+        return snapshot
+
+    def snapshots(self) -> list[AdapterSnapshot]:
+        """
+        Return snapshots of all adapters, refreshing the cache if needed.
+        """
+        if self.expired:
+            return self.refresh()
+        for setting_id in list(self._stale):
+            self._refetch(setting_id)
+        with self._lock:
+            return list(self._snapshots.values())
+
+    def get(self, setting_id: str) -> AdapterSnapshot | None:
+        if self.expired:
+            self.refresh()
+        elif setting_id in self._stale:
+            return self._refetch(setting_id)
+        return self._snapshots.get(setting_id)
+
+    def by_index(self, index: int) -> AdapterSnapshot | None:
+        if self.expired:
+            self.refresh()
+        if (setting_id := self._by_index.get(index)) is None:
+            return None
+        return self.get(setting_id)
+
+    def invalidate(self, setting_id: str | None = None) -> None:
+        """
+        Mark a single adapter as outdated, or the whole cache if no SettingID is given.
+        """
+        with self._lock:
+            if setting_id is None:
+                self._refreshed = None
+            elif setting_id in self._snapshots:
+                self._stale.add(setting_id)
+
+    def cached(self) -> list[AdapterSnapshot]:
+        """
+        Return the snapshots currently held, without refreshing anything.
+        """
+        with self._lock:
+            return list(self._snapshots.values())
+
+    def update(self, snapshot: AdapterSnapshot) -> bool:
+        """
+        Store a snapshot received from elsewhere, like a change notification.
+        Returns `True` if it differs from the one already cached.
+        """
+        with self._lock:
+            self._stale.discard(snapshot.SettingID)
+            if self._snapshots.get(snapshot.SettingID) == snapshot:
+                return False
+            self._snapshots[snapshot.SettingID] = snapshot
+            self._by_index[snapshot.Index] = snapshot.SettingID
+            self._record(snapshot.SettingID)
+            return True
+
+    def remove(self, setting_id: str) -> AdapterSnapshot | None:
+        """
+        Drop an adapter that no longer exists, returning its last snapshot.
+        """
+        with self._lock:
+            self._stale.discard(setting_id)
+            if (snapshot := self._snapshots.pop(setting_id, None)) is not None:
+                self._by_index.pop(snapshot.Index, None)
+                self._record(setting_id)
+            return snapshot
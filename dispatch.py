@@ -0,0 +1,301 @@
+"""
+Early-bound calls to WMI methods, resolving everything once per WMI class.
+
+Going through the wmi module, every `nic.EnableStatic(...)` looks the method up with `Methods_`,
+fetches its parameter definitions, and resolves every name it touches with `GetIDsOfNames`,
+on every call, since each call works with new objects. All instances of a class share
+the methods, parameter definitions and DISPIDs, so `ClassDispatch` resolves them on first use,
+and only makes the `Invoke`s that actually do the work after that.
+
+Everything here works with the raw `PyIDispatch` interfaces (the `_oleobj_` of the win32com
+wrappers), to skip the wrappers' own name resolution as well.
+"""
+from __future__ import annotations
+
+import time
+import threading
+from itertools import count
+from typing import Any, NamedTuple
+
+
+# wFlags of IDispatch::Invoke
+DISPATCH_METHOD = 1
+DISPATCH_PROPERTYGET = 2
+DISPATCH_PROPERTYPUT = 4
+# The locale IDispatch names are resolved and invoked in
+LOCALE_USER_DEFAULT = 0x400
+
+
+def late_invoke(oleobj: Any, name: str, flags: int, *args: Any) -> Any:
+    """
+    Resolve the name and invoke it, the way every call is made without a `ClassDispatch`.
+    """
+    return oleobj.Invoke(oleobj.GetIDsOfNames(name), LOCALE_USER_DEFAULT, flags, True, *args)
+
+
+class DispatchCache:
+    """
+    DISPIDs of the members of one kind of object, resolved on first use.
+    Only objects that share their members, like the instances of a single WMI class,
+    can share a cache.
+    """
+
+    def __init__(self):
+        self._dispids: dict[str, int] = {}
+        # how many names had to be resolved
+        self.lookups: int = 0
+
+    def dispid(self, oleobj: Any, name: str) -> int:
+        if (dispid := self._dispids.get(name)) is None:
+            self.lookups += 1
+            dispid = self._dispids[name] = oleobj.GetIDsOfNames(name)
+        return dispid
+
+    def get(self, oleobj: Any, name: str) -> Any:
+        return oleobj.Invoke(
+            self.dispid(oleobj, name), LOCALE_USER_DEFAULT, DISPATCH_PROPERTYGET, True
+        )
+
+    def put(self, oleobj: Any, name: str, value: Any) -> None:
+        oleobj.Invoke(
+            self.dispid(oleobj, name), LOCALE_USER_DEFAULT, DISPATCH_PROPERTYPUT, False, value
+        )
+
+    def invoke(self, oleobj: Any, name: str, *args: Any) -> Any:
+        return oleobj.Invoke(
+            self.dispid(oleobj, name), LOCALE_USER_DEFAULT, DISPATCH_METHOD, True, *args
+        )
+
+
+class MethodDispatch(NamedTuple):
+    """
+    A resolved WMI method. The in parameters are spawned from `in_parameters`,
+    which is `None` for methods without any.
+    """
+    name: str
+    in_parameters: Any
+    in_members: DispatchCache
+    out_members: DispatchCache
+
+
+class ClassDispatch:
+    """
+    Early-bound calls to the instances of a single WMI class.
+    `class_object` is the raw interface of the class definition, as returned by
+    `SWbemServices.Get` with the class name.
+
+    The methods of Win32_NetworkAdapterConfiguration only return their ReturnValue,
+    so that's all `call` returns.
+    """
+
+    def __init__(self, class_object: Any):
+        self._class = class_object
+        self._lock = threading.Lock()
+        self._methods: dict[str, MethodDispatch] = {}
+        self.members: DispatchCache = DispatchCache()
+
+    def method(self, name: str) -> MethodDispatch:
+        if (method := self._methods.get(name)) is not None:
+            return method
+        with self._lock:
+            if (method := self._methods.get(name)) is None:
+                methods = late_invoke(self._class, "Methods_", DISPATCH_PROPERTYGET)
+                definition = late_invoke(methods, "Item", DISPATCH_METHOD, name)
+                method = self._methods[name] = MethodDispatch(
+                    name,
+                    late_invoke(definition, "InParameters", DISPATCH_PROPERTYGET),
+                    DispatchCache(),
+                    DispatchCache(),
+                )
+        return method
+
+    def get(self, instance: Any, name: str) -> Any:
+        """
+        Read a property of an instance.
+        """
+        return self.members.get(instance, name)
+
+    def call(self, instance: Any, name: str, **params: Any) -> int:
+        """
+        Call the method on an instance, returning its ReturnValue.
+        """
+        method = self.method(name)
+        if method.in_parameters is None:
+            if params:
+                raise TypeError(f"{name} takes no parameters")
+            result = self.members.invoke(instance, "ExecMethod_", name)
+        else:
+            in_parameters = method.in_members.invoke(method.in_parameters, "SpawnInstance_")
+            for param, value in params.items():
+                method.in_members.put(in_parameters, param, value)
+            result = self.members.invoke(instance, "ExecMethod_", name, in_parameters)
+        return int(method.out_members.get(result, "ReturnValue"))
+
+    @property
+    def lookups(self) -> int:
+        """
+        How many names had to be resolved so far, across the instances and all parameters.
+        """
+        return self.members.lookups + sum(
+            method.in_members.lookups + method.out_members.lookups
+            for method in self._methods.values()
+        )
+
+
+class FakeCOM:
+    """
+    Stand-in for COM itself, exposing Python objects as raw `IDispatch` interfaces.
+    Every `GetIDsOfNames` and `Invoke` is counted in `round_trips`, and takes `latency` seconds,
+    like a call into the WMI service would.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency: float = latency
+        self.round_trips: int = 0
+        self._dispids: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+        self._next_dispid = count(1)
+
+    def _round_trip(self) -> None:
+        self.round_trips += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def wrap(self, value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, float, str, tuple, list)):
+            return value
+        return FakeOleObject(self, value)
+
+
+class FakeOleObject:
+    """
+    A Python object exposed through a fake `IDispatch`. Names map to the same DISPIDs
+    on every object, which is true of the objects of a single class in real COM as well.
+    """
+
+    def __init__(self, com: FakeCOM, target: Any):
+        self._com = com
+        self._target = target
+
+    def GetIDsOfNames(self, name: str) -> int:
+        self._com._round_trip()
+        if not hasattr(self._target, name):
+            raise AttributeError(f"Unknown name: {name}")
+        if (dispid := self._com._dispids.get(name)) is None:
+            dispid = self._com._dispids[name] = next(self._com._next_dispid)
+            self._com._names[dispid] = name
+        return dispid
+
+    def Invoke(self, dispid: int, lcid: int, flags: int, result_wanted: bool, *args: Any) -> Any:
+        self._com._round_trip()
+        name = self._com._names[dispid]
+        args = tuple(arg._target if isinstance(arg, FakeOleObject) else arg for arg in args)
+        if flags & DISPATCH_PROPERTYPUT:
+            setattr(self._target, name, *args)
+            return None
+        value = getattr(self._target, name)
+        if flags & DISPATCH_METHOD:
+            value = value(*args)
+        return self._com.wrap(value)
+
+
+class FakeParameters:
+    """
+    The __PARAMETERS instances holding the in or out parameters of a method call.
+    """
+
+    def __init__(self, **values: Any):
+        self.__dict__.update(values)
+        self.Properties_ = FakeProperties(self)
+
+    def __getattr__(self, name: str) -> Any:
+        # parameters that weren't set are null
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return None
+
+    def SpawnInstance_(self) -> FakeParameters:
+        return FakeParameters()
+
+
+class FakeProperty:
+    def __init__(self, owner: Any, name: str):
+        self._owner = owner
+        self.Name: str = name
+
+    @property
+    def Value(self) -> Any:
+        return getattr(self._owner, self.Name)
+
+    @Value.setter
+    def Value(self, value: Any) -> None:
+        setattr(self._owner, self.Name, value)
+
+
+class FakeProperties:
+    """
+    The `Properties_` collection, as the wmi module uses it.
+    """
+
+    def __init__(self, owner: Any):
+        self._owner = owner
+
+    def Item(self, name: str) -> FakeProperty:
+        return FakeProperty(self._owner, name)
+
+
+_NO_PARAMETERS = frozenset((
+    "EnableDHCP",
+    "RenewDHCPLease",
+    "RenewDHCPLeaseAll",
+    "ReleaseDHCPLease",
+    "ReleaseDHCPLeaseAll",
+    "DisableIPSec",
+))
+
+
+class FakeMethod:
+    def __init__(self, name: str):
+        self.Name: str = name
+        self.InParameters: FakeParameters | None = (
+            None if name in _NO_PARAMETERS else FakeParameters()
+        )
+        self.OutParameters: FakeParameters = FakeParameters(ReturnValue=0)
+
+
+class FakeMethods:
+    def Item(self, name: str) -> FakeMethod:
+        return FakeMethod(name)
+
+
+class FakeWMIClass:
+    """
+    The class definition, with the `Methods_` collection.
+    """
+
+    def __init__(self):
+        self.Methods_ = FakeMethods()
+
+
+class FakeWMIObject:
+    """
+    A WMI instance backed by a `backend.FakeInterface`, with the methods and properties
+    of an `SWbemObject` the calls are made through.
+    """
+
+    def __init__(self, nic: Any):
+        self._nic = nic
+        self.Methods_ = FakeMethods()
+        self.Properties_ = FakeProperties(nic)
+
+    def __getattr__(self, name: str) -> Any:
+        # the adapter's properties
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._nic, name)
+
+    def ExecMethod_(self, name: str, in_parameters: FakeParameters | None = None) -> Any:
+        params = {} if in_parameters is None else {
+            name: value for name, value in vars(in_parameters).items() if name != "Properties_"
+        }
+        return FakeParameters(ReturnValue=getattr(self._nic, name)(**params)[0])
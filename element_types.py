@@ -1,12 +1,19 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, TYPE_CHECKING
 
-import wmi
-import win32com
+# The types only describe the objects the wmi module returns, for the type checker and editors.
+# At runtime they're never instantiated, so the module can be imported without pywin32.
+if TYPE_CHECKING:
+    import wmi
+    import win32com.client
 
+    _WMIObject = wmi._wmi_object
+else:
+    _WMIObject = object
 
-class WMIObjectType(wmi._wmi_object):
+
+class WMIObjectType(_WMIObject):
     id: str
     keys: list[str]
     methods: list[str]
@@ -0,0 +1,270 @@
+"""
+Fleet mode - enumerating and configuring the adapters of many hosts at once.
+"""
+from __future__ import annotations
+
+import time
+import threading
+from typing import Any, Callable, Iterable, Mapping, NamedTuple, TypeVar, TYPE_CHECKING
+
+from cache import AdapterSnapshot, SNAPSHOT_FIELDS, find_snapshot
+from backend import FakeBackend, WMIBackend, com_apartment
+from apply import DesiredConfig, MethodCall, plan_changes, run_calls
+
+if TYPE_CHECKING:
+    from backend import Backend
+    from journal import Journal
+
+
+_T = TypeVar("_T")
+
+
+def wmi_connector(**credentials: Any) -> Callable[[str], Backend]:
+    """
+    A connection factory for the pool, connecting to the hosts' WMI with the credentials
+    (`user` and `password`, passed on to `wmi.WMI`). The connection itself is made lazily.
+    """
+    def connect(host: str) -> Backend:
+        return WMIBackend(computer=host, **credentials)
+    return connect
+
+
+class ConnectionPool:
+    """
+    Keeps a backend per host, creating them through `connect` when first needed.
+
+    Backends unused for `idle_timeout` seconds are dropped by `evict_idle`, and a host's backend
+    can be dropped explicitly with `discard` after it fails, so that the next use reconnects.
+    """
+
+    def __init__(self, connect: Callable[[str], Backend], *, idle_timeout: float = 300.0):
+        self._connect = connect
+        self.idle_timeout: float = idle_timeout
+        self._lock = threading.Lock()
+        # host -> (backend, last used)
+        self._backends: dict[str, tuple[Backend, float]] = {}
+
+    def get(self, host: str) -> Backend:
+        with self._lock:
+            if (entry := self._backends.get(host)) is not None:
+                backend = entry[0]
+            else:
+                backend = self._connect(host)
+            self._backends[host] = (backend, time.monotonic())
+            return backend
+
+    def discard(self, host: str) -> None:
+        with self._lock:
+            self._backends.pop(host, None)
+
+    def evict_idle(self) -> list[str]:
+        """
+        Drop the backends idle for longer than `idle_timeout`, returning their hosts.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [host for host, (_, used) in self._backends.items() if used < cutoff]
+            for host in idle:
+                del self._backends[host]
+        return idle
+
+    @property
+    def hosts(self) -> list[str]:
+        with self._lock:
+            return list(self._backends)
+
+
+class Fleet:
+    """
+    Runs functions against many hosts at once, with at most `concurrency` of them in flight.
+
+    A host taking longer than `timeout` seconds (not counting the time spent waiting for a free
+    slot) is reported with a `TimeoutError`, and its connection is dropped. The call itself
+    can't be interrupted, so it keeps its slot until it finishes. A host whose function raises
+    also gets its connection dropped, to reconnect the next time.
+    """
+
+    def __init__(self, pool: ConnectionPool, *, concurrency: int = 16, timeout: float = 30.0):
+        self.pool: ConnectionPool = pool
+        self.concurrency: int = concurrency
+        self.timeout: float = timeout
+
+    def _run(self, host: str, func: Callable[[str, Backend], _T]) -> _T:
+        with com_apartment():
+            return func(host, self.pool.get(host))
+
+    def map(
+        self, hosts: Iterable[str], func: Callable[[str, Backend], _T]
+    ) -> dict[str, _T | Exception]:
+        """
+        Call `func` with each host and its backend, returning the results keyed by host,
+        or the exception raised for it.
+        """
+        from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+        self.pool.evict_idle()
+        hosts = list(dict.fromkeys(hosts))
+        results: dict[str, _T | Exception] = {}
+        if not hosts:
+            return results
+        started: dict[str, float] = {}
+
+        def task(host: str) -> _T:
+            started[host] = time.monotonic()
+            return self._run(host, func)
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.concurrency, len(hosts)), thread_name_prefix="fleet"
+        )
+        pending: dict[Future[_T], str] = {executor.submit(task, host): host for host in hosts}
+        try:
+            while pending:
+                now = time.monotonic()
+                deadlines = [
+                    started[host] + self.timeout for host in pending.values() if host in started
+                ]
+                wait_for = max(min(deadlines) - now, 0) if deadlines else self.timeout
+                done, _ = wait(pending, timeout=min(wait_for, 1.0), return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = pending.pop(future)
+                    try:
+                        results[host] = future.result()
+                    except Exception as exc:
+                        self.pool.discard(host)
+                        results[host] = exc
+                now = time.monotonic()
+                for future, host in list(pending.items()):
+                    if host in started and now - started[host] >= self.timeout:
+                        del pending[future]
+                        self.pool.discard(host)
+                        results[host] = TimeoutError(
+                            f"{host} didn't finish within {self.timeout} seconds"
+                        )
+        finally:
+            # don't wait for the hosts that timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+        return {host: results[host] for host in hosts}
+
+    def snapshots(self, hosts: Iterable[str]) -> dict[str, list[AdapterSnapshot] | Exception]:
+        def enumerate_host(host: str, backend: Backend) -> list[AdapterSnapshot]:
+            return [
+                AdapterSnapshot.from_interface(nic, backend)
+                for nic in backend.interfaces(SNAPSHOT_FIELDS)
+            ]
+        return self.map(hosts, enumerate_host)
+
+
+class HostChange(NamedTuple):
+    """
+    One line of an address plan - the desired configuration of an adapter on a host,
+    selected by its Index, SettingID or Description.
+    """
+    host: str
+    adapter: str
+    desired: DesiredConfig
+
+
+class FleetRow(NamedTuple):
+    """
+    A row of the consolidated result table.
+    """
+    host: str
+    adapter: str
+    addresses: str
+    calls: list[MethodCall]
+    return_codes: list[int] | None
+    error: str | None
+
+
+def apply_plan(
+    fleet: Fleet,
+    changes: Iterable[HostChange],
+    *,
+    dry_run: bool = False,
+    journal: Journal | None = None,
+) -> list[FleetRow]:
+    """
+    Plan and apply the changes. Hosts are configured concurrently, and the adapters
+    of a single host one after another. Returns a row for every change, grouped by host.
+    With a `journal`, every change is recorded in it, along with its host.
+    """
+    by_host: dict[str, list[HostChange]] = {}
+    for change in changes:
+        by_host.setdefault(change.host, []).append(change)
+
+    def configure(host: str, backend: Backend) -> list[FleetRow]:
+        snapshots = [
+            AdapterSnapshot.from_interface(nic, backend)
+            for nic in backend.interfaces(SNAPSHOT_FIELDS)
+        ]
+        rows: list[FleetRow] = []
+        for change in by_host[host]:
+            if (nic := find_snapshot(snapshots, change.adapter)) is None:
+                rows.append(FleetRow(host, change.adapter, '', [], None, "no such adapter"))
+                continue
+            calls = plan_changes(nic, change.desired)
+            return_codes: list[int] | None = None
+            if dry_run:
+                pass
+            elif journal is None:
+                return_codes = run_calls(backend, nic, calls)
+            else:
+                from journal import run_journaled
+                return_codes = run_journaled(journal, backend, nic, calls, host=host)
+            rows.append(
+                FleetRow(host, nic.Description, ', '.join(nic.IPAddress), calls, return_codes, None)
+            )
+        return rows
+
+    rows: list[FleetRow] = []
+    for host, result in fleet.map(by_host, configure).items():
+        if isinstance(result, Exception):
+            rows.extend(
+                FleetRow(host, change.adapter, '', [], None, repr(result))
+                for change in by_host[host]
+            )
+        else:
+            rows.extend(result)
+    return rows
+
+
+def format_table(header: tuple[str, ...], rows: Iterable[tuple[str, ...]]) -> str:
+    """
+    Lay the rows out in columns, padded to the widest cell of each.
+    """
+    rows = [header, *rows]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return '\n'.join(
+        '  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows
+    )
+
+
+class FakeFleet:
+    """
+    Stand-in for a fleet of hosts, each with its own `FakeBackend`, to pass to the pool
+    as the connection factory. State is kept across reconnects, like on real hosts.
+    Hosts in `unreachable` fail to connect, and `latency` is passed on to every backend.
+    """
+
+    def __init__(
+        self,
+        hosts: Mapping[str, int],
+        *,
+        latency: dict[str, float] | None = None,
+        unreachable: Iterable[str] = (),
+    ):
+        self.backends: dict[str, FakeBackend] = {
+            host: FakeBackend(count, latency=dict(latency or {})) for host, count in hosts.items()
+        }
+        self.unreachable: set[str] = set(unreachable)
+        # how many times each host was connected to
+        self.connects: dict[str, int] = {host: 0 for host in hosts}
+
+    def __call__(self, host: str) -> Backend:
+        if host not in self.backends or host in self.unreachable:
+            raise ConnectionError(f"The RPC server is unavailable: {host}")
+        backend = self.backends[host]
+        # a new connection, which pays for the connect latency again
+        backend._connection = None
+        self.connects[host] += 1
+        return backend
@@ -186,3 +186,217 @@ class SelectMenu(tk.Menubutton, Generic[_T]):
 
     def get(self) -> _T | None:
         return self._options.get(self.cget("text"))
+
+
+class SearchPicker(ttk.Frame, Generic[_T]):
+    """
+    A search box above a list of options, for picking one out of hundreds.
+
+    Options are keyed by a unique key, and shown using the `label` function. Typing into
+    the search box narrows the list down to the options where every space-separated word
+    can be found in the text returned by `search_text`, case-insensitively.
+    Only the visible `height` rows are ever inserted into the listbox, the list is scrolled
+    by replacing them, so the widget stays fast no matter the number of options.
+    Generates a `<<PickerSelected>>` event whenever the selection changes.
+    """
+
+    def __init__(
+        self,
+        master: tk.Misc,
+        *args: Any,
+        label: abc.Callable[[_T], str],
+        search_text: abc.Callable[[_T], str],
+        options: dict[str, _T] | None = None,
+        height: int = 10,
+        placeholder: str = "Search",
+        **kwargs: Any,
+    ):
+        super().__init__(master, *args, **kwargs)
+        self._label = label
+        self._search_text = search_text
+        self._rows: int = height
+        self._options: dict[str, _T] = {}
+        self._haystacks: dict[str, str] = {}
+        self._matches: list[str] = []
+        self._query: str = ''
+        self._offset: int = 0
+        self._selected: str | None = None
+        self.search = PlaceholderEntry(self, placeholder=placeholder)
+        self.search.grid(column=0, row=0, columnspan=2, sticky="ew")
+        self.listbox = tk.Listbox(
+            self, height=height, width=60, activestyle="none", exportselection=False
+        )
+        self.listbox.grid(column=0, row=1, sticky="nsew")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._yview)
+        self.scrollbar.grid(column=1, row=1, sticky="ns")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+        self.search.bind("<KeyRelease>", self._search_changed)
+        self.search.bind("<Up>", partial(self._move, -1))
+        self.search.bind("<Down>", partial(self._move, 1))
+        self.listbox.bind("<<ListboxSelect>>", self._clicked)
+        self.listbox.bind("<MouseWheel>", self._wheel)
+        # X11 reports the mouse wheel as buttons instead
+        self.listbox.bind("<Button-4>", lambda event: self._scroll(-3))
+        self.listbox.bind("<Button-5>", lambda event: self._scroll(3))
+        if options:
+            self.set_options(options)
+
+    def set_options(self, options: dict[str, _T]) -> None:
+        """
+        Replace the available options. Clears the selection if it's no longer available.
+        """
+        self._options = dict(options)
+        self._haystacks = {
+            key: self._search_text(value).lower() for key, value in options.items()
+        }
+        if self._selected not in self._options:
+            self._select(None)
+        self._filter(incremental=False)
+
+    def update_options(self, changed: dict[str, _T], removed: abc.Iterable[str] = ()) -> None:
+        """
+        Add or replace the changed options and remove the removed ones. The scroll position
+        is kept, and only the visible rows are redrawn.
+        """
+        for key in removed:
+            if self._options.pop(key, None) is not None:
+                del self._haystacks[key]
+                if key == self._selected:
+                    self._select(None)
+        for key, value in changed.items():
+            self._options[key] = value
+            self._haystacks[key] = self._search_text(value).lower()
+        self._filter(incremental=False)
+
+    def get(self) -> _T | None:
+        """
+        The selected option, even if it's currently filtered out.
+        """
+        if self._selected is None:
+            return None
+        return self._options.get(self._selected)
+
+    def select(self, key: str | None) -> None:
+        if key is not None and key not in self._options:
+            raise KeyError(key)
+        self._select(key)
+        if key is not None and key in self._matches:
+            # scroll the selected option into view
+            position = self._matches.index(key)
+            if not (self._offset <= position < self._offset + self._rows):
+                self._offset = position
+        self._render()
+
+    def _select(self, key: str | None) -> None:
+        if key != self._selected:
+            self._selected = key
+            self.event_generate("<<PickerSelected>>")
+
+    def _filter(self, *, incremental: bool) -> None:
+        words = self._query.lower().split()
+        # a longer query can only narrow the matches down, so there's no need to look
+        # through all of the options again
+        keys = self._matches if incremental else self._options
+        haystacks = self._haystacks
+        self._matches = [
+            key for key in keys if all(word in haystacks[key] for word in words)
+        ]
+        self._render()
+
+    def _search_changed(self, event: tk.Event[PlaceholderEntry]) -> None:
+        query = self.search.get()
+        if query == self._query:
+            return
+        incremental = query.startswith(self._query)
+        self._query = query
+        self._offset = 0
+        self._filter(incremental=incremental)
+
+    def _render(self) -> None:
+        total = len(self._matches)
+        self._offset = max(min(self._offset, total - self._rows), 0)
+        visible = self._matches[self._offset:self._offset + self._rows]
+        self.listbox.delete(0, "end")
+        for key in visible:
+            self.listbox.insert("end", self._label(self._options[key]))
+        if self._selected in visible:
+            self.listbox.selection_set(visible.index(self._selected))
+        if total:
+            self.scrollbar.set(self._offset / total, (self._offset + len(visible)) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _scroll(self, rows: int) -> None:
+        offset = max(min(self._offset + rows, len(self._matches) - self._rows), 0)
+        if offset != self._offset:
+            self._offset = offset
+            self._render()
+
+    def _yview(self, action: str, value: str, unit: str | None = None) -> None:
+        if action == "moveto":
+            self._offset = int(float(value) * len(self._matches))
+            self._render()
+        elif action == "scroll":
+            self._scroll(int(value) * (self._rows if unit == "pages" else 1))
+
+    def _wheel(self, event: tk.Event[tk.Listbox]) -> None:
+        # Windows reports multiples of 120 per notch
+        self._scroll(-3 * (event.delta // 120) if abs(event.delta) >= 120 else -event.delta)
+
+    def _move(self, step: int, event: tk.Event[PlaceholderEntry]) -> str:
+        if not self._matches:
+            return "break"
+        if self._selected in self._matches:
+            position = self._matches.index(self._selected) + step
+        else:
+            position = 0
+        self.select(self._matches[max(min(position, len(self._matches) - 1), 0)])
+        return "break"
+
+    def _clicked(self, event: tk.Event[tk.Listbox]) -> None:
+        selection = self.listbox.curselection()
+        if selection:
+            self._select(self._matches[self._offset + selection[0]])
+
+
+class DiffTable(ttk.Treeview):
+    """
+    A table of rows keyed by a string, that only touches the cells whose values changed.
+
+    `columns` maps the column IDs to their headings. Rows are kept in the order
+    they were first added in.
+    """
+
+    def __init__(
+        self, master: tk.Misc, *args: Any, columns: dict[str, str], **kwargs: Any
+    ):
+        super().__init__(master, *args, columns=tuple(columns), show="headings", **kwargs)
+        self._columns: tuple[str, ...] = tuple(columns)
+        self._rows: dict[str, tuple[str, ...]] = {}
+        for column, heading in columns.items():
+            self.heading(column, text=heading)
+
+    def update_rows(
+        self, changed: dict[str, abc.Sequence[str]], removed: abc.Iterable[str] = ()
+    ) -> int:
+        """
+        Add or update the changed rows and delete the removed ones.
+        Returns the number of cells that actually had to be redrawn.
+        """
+        redrawn = 0
+        for key in removed:
+            if self._rows.pop(key, None) is not None:
+                self.delete(key)
+        for key, values in changed.items():
+            new = tuple(values)
+            if (old := self._rows.get(key)) is None:
+                self.insert('', "end", iid=key, values=new)
+                redrawn += len(new)
+            else:
+                for column, old_value, new_value in zip(self._columns, old, new):
+                    if old_value != new_value:
+                        self.set(key, column, new_value)
+                        redrawn += 1
+            self._rows[key] = new
+        return redrawn
@@ -0,0 +1,85 @@
+"""
+Run the GUI without a display, or Windows, for the start up benchmarks.
+
+tkinter itself is still imported, so that the start up pays for it like it normally would,
+but every widget is replaced by a stand-in that accepts anything, and WMI is replaced
+by a `FakeBackend`. main.py runs all the way to `mainloop`, which returns right away,
+so anything that breaks the start up fails the run.
+
+Usage:
+
+    python headless.py [adapters]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import types
+import runpy
+import tkinter
+import tkinter.ttk
+import tkinter.messagebox
+import tkinter.filedialog
+from typing import Any
+
+
+class Widget:
+    """
+    Stand-in for every tkinter class, with every method doing nothing.
+    Methods called through `super()` skip `__getattr__`, so those are defined explicitly.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Widget()
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return Widget()
+
+    def __iter__(self) -> Any:
+        return iter(())
+
+    def get(self, *args: Any, **kwargs: Any) -> Any:
+        return ''
+
+    def _nothing(self, *args: Any, **kwargs: Any) -> Any:
+        return Widget()
+
+    config = configure = insert = delete = mainloop = _nothing
+
+
+def stub_module(name: str) -> types.ModuleType:
+    module = types.ModuleType(name)
+
+    def attribute(attr: str) -> Any:
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        if attr.endswith("Error"):
+            return type(attr, (Exception,), {})
+        return type(attr, (Widget,), {})
+
+    module.__getattr__ = attribute  # type: ignore[method-assign]
+    return module
+
+
+def main(adapters: int = 8) -> None:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, directory)
+    stub = stub_module(tkinter.__name__)
+    sys.modules[tkinter.__name__] = stub
+    for name in ("ttk", "messagebox", "filedialog"):
+        submodule = stub_module(f"tkinter.{name}")
+        setattr(stub, name, submodule)
+        sys.modules[submodule.__name__] = submodule
+
+    import backend
+    backend.WMIBackend = lambda **kwargs: backend.FakeBackend(adapters)  # type: ignore
+    runpy.run_path(os.path.join(directory, "main.py"), run_name="__main__")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+import threading
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Callable, Iterator, Sequence, TYPE_CHECKING
+
+from backend import Backend
+
+if TYPE_CHECKING:
+    from cache import AdapterSnapshot
+    from element_types import InterfaceType
+
+
+# Environment variable enabling the timings, when set to anything but "" or "0"
+TIMINGS_ENV = "IPCHANGER_TIMINGS"
+# Upper bounds of the histogram buckets, in seconds - the last bucket catches everything else
+BUCKET_BOUNDS: tuple[float, ...] = (
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 60
+)
+BUCKET_LABELS: tuple[str, ...] = (
+    *(f"<={bound}" for bound in BUCKET_BOUNDS), f">{BUCKET_BOUNDS[-1]}"
+)
+# Number of durations kept per operation to estimate the percentiles from
+RESERVOIR_SIZE = 1024
+
+
+def timings_enabled() -> bool:
+    return os.environ.get(TIMINGS_ENV, "0") not in ('', '0')
+
+
+class TimingStats:
+    """
+    Latency histogram and samples, return codes and error count of a single operation.
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.errors: int = 0
+        self.total: float = 0.0
+        self.min: float = float("inf")
+        self.max: float = 0.0
+        self.buckets: list[int] = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.return_codes: Counter[int] = Counter()
+        # uniform random sample of the recorded durations, for the percentiles
+        self.samples: list[float] = []
+
+    def record(self, seconds: float, return_code: int | None, error: bool) -> None:
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        elif (index := random.randrange(self.count)) < RESERVOIR_SIZE:
+            self.samples[index] = seconds
+        if return_code is not None:
+            self.return_codes[return_code] += 1
+        if error or return_code not in (None, 0, 1):
+            self.errors += 1
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimate a percentile from the sample reservoir, interpolating between samples.
+        """
+        samples = sorted(self.samples)
+        position = fraction * (len(samples) - 1)
+        index = int(position)
+        if index + 1 >= len(samples):
+            return samples[-1]
+        return samples[index] + (samples[index + 1] - samples[index]) * (position - index)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.percentile(0.5) if self.count else None,
+            "p95": self.percentile(0.95) if self.count else None,
+            "buckets": {
+                label: count
+                for label, count in zip(BUCKET_LABELS, self.buckets)
+                if count
+            },
+            "return_codes": {str(code): count for code, count in self.return_codes.items()},
+        }
+
+
+class TimingRecorder:
+    """
+    Thread-safe collection of timings, per operation and per (operation, adapter) pair.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.operations: dict[str, TimingStats] = {}
+        self.adapters: dict[tuple[str, str], TimingStats] = {}
+
+    def record(
+        self,
+        operation: str,
+        seconds: float,
+        *,
+        adapter: str | None = None,
+        return_code: int | None = None,
+        error: bool = False,
+    ) -> None:
+        with self._lock:
+            if (stats := self.operations.get(operation)) is None:
+                stats = self.operations[operation] = TimingStats()
+            stats.record(seconds, return_code, error)
+            if adapter is not None:
+                key = (operation, adapter)
+                if (stats := self.adapters.get(key)) is None:
+                    stats = self.adapters[key] = TimingStats()
+                stats.record(seconds, return_code, error)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.operations.clear()
+            self.adapters.clear()
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            adapters: dict[str, dict[str, Any]] = {}
+            for (operation, adapter), stats in self.adapters.items():
+                adapters.setdefault(adapter, {})[operation] = stats.to_json()
+            return {
+                "operations": {name: s.to_json() for name, s in self.operations.items()},
+                "adapters": adapters,
+            }
+
+    def export(self, path: str) -> None:
+        with open(path, 'w', encoding="utf8") as file:
+            json.dump(self.report(), file, indent=2)
+
+
+class InstrumentedBackend(Backend):
+    """
+    Wraps another backend, timing every operation that goes through it.
+    Connecting is recorded as "connect", enumerating as "enumerate", looking up a single adapter
+    as "fetch", and method calls under the method's name, along with the adapter's SettingID.
+    Any other attribute is looked up on the wrapped backend.
+    """
+
+    def __init__(self, backend: Backend, recorder: TimingRecorder | None = None):
+        self.backend: Backend = backend
+        self.recorder: TimingRecorder = recorder or TimingRecorder()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.backend, name)
+
+    def _connect(self) -> None:
+        # time the lazy connection separately, so that it doesn't skew the first operation
+        if getattr(self.backend, "_connection", True) is None:
+            start = time.perf_counter()
+            try:
+                self.backend.connection  # type: ignore[attr-defined]
+            except Exception:
+                self.recorder.record("connect", time.perf_counter() - start, error=True)
+                raise
+            self.recorder.record("connect", time.perf_counter() - start)
+
+    def interfaces(self, fields: Sequence[str] | None = None) -> list[InterfaceType]:
+        self._connect()
+        start = time.perf_counter()
+        try:
+            result = self.backend.interfaces(fields)
+        except Exception:
+            self.recorder.record("enumerate", time.perf_counter() - start, error=True)
+            raise
+        self.recorder.record("enumerate", time.perf_counter() - start)
+        return result
+
+    def iter_interfaces(self, fields: Sequence[str] | None = None) -> Iterator[InterfaceType]:
+        # timed from the query to the last adapter, without the time spent by the consumer
+        self._connect()
+        elapsed = 0.0
+        iterator = iter(self.backend.iter_interfaces(fields))
+        while True:
+            start = time.perf_counter()
+            try:
+                nic = next(iterator)
+            except StopIteration:
+                break
+            except Exception:
+                self.recorder.record("enumerate", elapsed + time.perf_counter() - start, error=True)
+                raise
+            elapsed += time.perf_counter() - start
+            yield nic
+        self.recorder.record("enumerate", elapsed + time.perf_counter() - start)
+
+    def interface(self, index: int) -> InterfaceType | None:
+        self._connect()
+        start = time.perf_counter()
+        try:
+            result = self.backend.interface(index)
+        except Exception:
+            self.recorder.record("fetch", time.perf_counter() - start, error=True)
+            raise
+        self.recorder.record("fetch", time.perf_counter() - start)
+        return result
+
+    def read(self, nic: InterfaceType, fields: Sequence[str]) -> list[Any]:
+        return self.backend.read(nic, fields)
+
+    def bind(self, nic: AdapterSnapshot) -> Callable[..., int]:
+        self._connect()
+        bound = self.backend.bind(nic)
+
+        def call(method: str, **params: Any) -> int:
+            start = time.perf_counter()
+            try:
+                return_code = bound(method, **params)
+            except Exception:
+                self.recorder.record(
+                    method, time.perf_counter() - start, adapter=nic.SettingID, error=True
+                )
+                raise
+            self.recorder.record(
+                method, time.perf_counter() - start, adapter=nic.SettingID, return_code=return_code
+            )
+            return return_code
+
+        return call
+
+
+def instrument(backend: Backend, enabled: bool | None = None) -> Backend:
+    """
+    Wrap the backend with timings if they're enabled, either explicitly or through
+    the environment variable. When disabled, the backend is returned as is,
+    so that the timings cost nothing at all.
+    """
+    if enabled is None:
+        enabled = timings_enabled()
+    if not enabled:
+        return backend
+    return InstrumentedBackend(backend)
@@ -0,0 +1,979 @@
+"""
+Command line interface, for scripted use. Never imports tkinter.
+
+Usage:
+
+    python -m ipchanger [--json] [--fake N] [--timings PATH] [--journal PATH] <command> ...
+
+Adapters can be selected by their Index, SettingID or Description.
+Every change is recorded in the journal, unless it's disabled with --no-journal.
+Modules are only imported by the commands that need them, to keep the start up fast.
+"""
+from __future__ import annotations
+
+import sys
+import argparse
+from typing import Any, Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backend import Backend
+    from journal import Journal
+    from apply import DesiredConfig, MethodCall
+    from cache import AdapterCache, AdapterSnapshot
+    from fleet import Fleet, HostChange
+
+
+# Environment variable holding the password for --user, to keep it out of the process list
+PASSWORD_ENV = "IPCHANGER_PASSWORD"
+
+
+class CLIError(Exception):
+    pass
+
+
+def make_backend(args: argparse.Namespace) -> Backend:
+    backend: Backend
+    if args.fake is not None:
+        from backend import FakeBackend
+        backend = FakeBackend(args.fake)
+    else:
+        from backend import WMIBackend
+        backend = WMIBackend()
+    if args.recorder is not None:
+        from instrumentation import InstrumentedBackend
+        backend = InstrumentedBackend(backend, args.recorder)
+    return backend
+
+
+def make_journal(args: argparse.Namespace) -> Journal | None:
+    # changes to fake adapters only go to a journal that's asked for explicitly
+    if args.no_journal or (args.fake is not None and args.journal is None):
+        return None
+    from journal import Journal
+    return Journal(args.journal)
+
+
+def require_journal(args: argparse.Namespace) -> Journal:
+    if (journal := make_journal(args)) is None:
+        raise CLIError("This command needs a journal, pass one with --journal")
+    return journal
+
+
+def make_cache(args: argparse.Namespace) -> tuple[Backend, AdapterCache]:
+    """
+    The backend and its cache, connected to the remote `--host` of the commands that take one.
+    """
+    from cache import AdapterCache
+    if args.host is None:
+        backend = make_backend(args)
+    else:
+        backend = make_connector(args, [args.host])(args.host)
+    return backend, AdapterCache(backend)
+
+
+def find_adapter(cache: AdapterCache, selector: str) -> AdapterSnapshot:
+    from cache import find_snapshot
+    if (nic := find_snapshot(cache.snapshots(), selector)) is None:
+        raise CLIError(f"No adapter matches {selector!r}")
+    return nic
+
+
+def output(args: argparse.Namespace, data: Any, text: str) -> None:
+    if args.json:
+        import json
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print(text)
+
+
+def apply_config(
+    args: argparse.Namespace,
+    backend: Backend,
+    nic: AdapterSnapshot,
+    desired: DesiredConfig,
+    extra: dict[str, Any] | None = None,
+) -> int:
+    from apply import plan_changes
+    return apply_calls(args, backend, nic, plan_changes(nic, desired), extra)
+
+
+def apply_calls(
+    args: argparse.Namespace,
+    backend: Backend,
+    nic: AdapterSnapshot,
+    calls: list[MethodCall],
+    extra: dict[str, Any] | None = None,
+    *,
+    kind: str = "apply",
+    undoes: int | None = None,
+) -> int:
+    from apply import describe_return_code, run_calls, succeeded
+    return_codes: list[int] = []
+    if args.dry_run:
+        pass
+    elif (journal := make_journal(args)) is None:
+        return_codes = run_calls(backend, nic, calls)
+    else:
+        from journal import run_journaled
+        return_codes = run_journaled(
+            journal, backend, nic, calls, kind=kind, undoes=undoes, host=args.host
+        )
+    data = {
+        "adapter": nic.SettingID,
+        "dry_run": args.dry_run,
+        "calls": [
+            {
+                "method": call.method,
+                "params": call.params,
+                "return_code": return_codes[step] if step < len(return_codes) else None,
+            }
+            for step, call in enumerate(calls)
+        ],
+        **(extra or {}),
+    }
+    lines = [f"{nic.Description}:"]
+    if not calls:
+        lines.append("  already configured, nothing to do")
+    for step, call in enumerate(calls):
+        if step < len(return_codes):
+            lines.append(f"  {call} -> {describe_return_code(return_codes[step])}")
+        elif args.dry_run:
+            lines.append(f"  {call}")
+        else:
+            lines.append(f"  {call} -> skipped")
+    output(args, data, '\n'.join(lines))
+    return 0 if succeeded(return_codes) else 1
+
+
+def cmd_list(args: argparse.Namespace) -> int:
+    _, cache = make_cache(args)
+    snapshots = sorted(cache.snapshots(), key=lambda nic: nic.Index)
+    output(
+        args,
+        [nic.to_json() for nic in snapshots],
+        '\n'.join(
+            f"{nic.Index:>4}  {nic.SettingID}  {nic.Description}"
+            f"  {', '.join(nic.IPAddress) or '-'}"
+            for nic in snapshots
+        ),
+    )
+    return 0
+
+
+def cmd_show(args: argparse.Namespace) -> int:
+    _, cache = make_cache(args)
+    nic = find_adapter(cache, args.adapter)
+    data = nic.to_json()
+    output(args, data, '\n'.join(f"{name:>20}: {value}" for name, value in data.items()))
+    return 0
+
+
+def cmd_set(args: argparse.Namespace) -> int:
+    from apply import DesiredConfig
+    from addressing import parse_cidr
+    backend, cache = make_cache(args)
+    nic = find_adapter(cache, args.adapter)
+    if (network := parse_cidr(args.address)) is None or network.version != 4:
+        raise CLIError(f"Invalid address: {args.address!r}")
+    gateway = args.gateway
+    if gateway == "auto":
+        from probing import infer_gateway
+        gateway, _ = infer_gateway(network, nic.DefaultIPGateway)
+    # the fake adapters aren't on the network probed, and dry runs don't take the address
+    probe = not (args.force or args.dry_run or args.fake is not None)
+    if probe and network.address not in nic.IPAddress:
+        import asyncio
+        from probing import check_conflict, default_prober
+        if asyncio.run(check_conflict(network.address, default_prober())):
+            raise CLIError(f"{network.address} is already in use, use --force to set it anyway")
+    desired = DesiredConfig(
+        addresses=(network.address,),
+        subnets=(network.mask,),
+        gateways=None if gateway is None else (gateway,),
+        dns=None if args.dns is None else tuple(args.dns),
+    )
+    return apply_config(args, backend, nic, desired)
+
+
+def cmd_free(args: argparse.Namespace) -> int:
+    from addressing import parse_cidr
+    from probing import find_free_addresses
+    if (network := parse_cidr(args.network)) is None or network.version != 4:
+        raise CLIError(f"Invalid network: {args.network!r}")
+    try:
+        free = find_free_addresses(network, count=args.count, timeout=args.timeout)
+    except ValueError as exc:
+        raise CLIError(str(exc))
+    output(args, free, '\n'.join(free) or "no free addresses found")
+    return 0 if free else 1
+
+
+def cmd_dhcp(args: argparse.Namespace) -> int:
+    from apply import DesiredConfig
+    backend, cache = make_cache(args)
+    nic = find_adapter(cache, args.adapter)
+    return apply_config(args, backend, nic, DesiredConfig(dhcp=True))
+
+
+def cmd_dns(args: argparse.Namespace) -> int:
+    from apply import dns_only
+    backend, cache = make_cache(args)
+    nic = find_adapter(cache, args.adapter)
+    servers = tuple(args.servers)
+    extra: dict[str, Any] = {}
+    if args.fastest:
+        from resolvers import rank_servers
+        if not servers:
+            # reorder the servers the adapter already has
+            servers = nic.DNSServerSearchOrder
+        timings = rank_servers(servers, samples=args.samples, timeout=args.timeout)
+        servers = tuple(t.server for t in timings)
+        extra["timings"] = [
+            {"server": t.server, "median": t.median, "p95": t.p95, "lost": t.lost}
+            for t in timings
+        ]
+        if not args.json:
+            for t in timings:
+                if t.median is None or t.p95 is None:
+                    print(f"{t.server:>40}  no response")
+                else:
+                    print(
+                        f"{t.server:>40}  median {t.median * 1000:7.1f} ms"
+                        f"  p95 {t.p95 * 1000:7.1f} ms  lost {t.lost}"
+                    )
+    return apply_config(args, backend, nic, dns_only(nic, servers), extra)
+
+
+def cmd_lease(args: argparse.Namespace) -> int:
+    from apply import describe_return_code, dhcp_many, succeeded
+    backend, cache = make_cache(args)
+    if args.all:
+        nics = [nic for nic in cache.snapshots() if nic.DHCPEnabled]
+    elif args.adapters:
+        nics = [find_adapter(cache, selector) for selector in args.adapters]
+    else:
+        raise CLIError("Select the adapters, or pass --all")
+    if not nics:
+        raise CLIError("No adapters with DHCP enabled")
+
+    def progress(nic: AdapterSnapshot, step: int, call: MethodCall, return_code: int) -> None:
+        # called from the pool threads, as each adapter finishes
+        if not args.json:
+            sys.stdout.write(f"{nic.Description}: {describe_return_code(return_code)}\n")
+            sys.stdout.flush()
+
+    results = dhcp_many(
+        backend,
+        nics,
+        args.operation,
+        max_workers=args.workers,
+        progress=progress,
+        journal=make_journal(args),
+    )
+    ok = True
+    data: list[dict[str, Any]] = []
+    for nic in nics:
+        result = results[nic.SettingID]
+        if isinstance(result, Exception):
+            ok = False
+            data.append({"adapter": nic.SettingID, "error": repr(result)})
+            if not args.json:
+                print(f"{nic.Description}: failed with {result!r}")
+        else:
+            ok = ok and succeeded(result)
+            data.append({"adapter": nic.SettingID, "return_code": result[0]})
+    if args.json:
+        output(args, data, '')
+    return 0 if ok else 1
+
+
+def cmd_leases(args: argparse.Namespace) -> int:
+    import time
+    from apply import describe_return_code
+    from leases import Lease, LeaseTracker
+    backend, cache = make_cache(args)
+    nics = {nic.SettingID: nic for nic in cache.snapshots()}
+    leases = sorted(
+        (lease for nic in nics.values() if (lease := Lease.from_snapshot(nic)) is not None),
+        key=lambda lease: lease.expires,
+    )
+
+    def when(timestamp: float) -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+    output(
+        args,
+        [lease._asdict() for lease in leases],
+        '\n'.join(
+            f"{when(lease.expires)}  {nics[lease.setting_id].Description}" for lease in leases
+        ) or "no adapters with a DHCP lease",
+    )
+    if not args.watch:
+        return 0
+
+    def warn(nic: AdapterSnapshot, expires: float) -> None:
+        print(f"{nic.Description}: the lease expires at {when(expires)}", flush=True)
+
+    def renewed(nic: AdapterSnapshot, return_code: int) -> None:
+        print(f"{nic.Description}: renewed, {describe_return_code(return_code)}", flush=True)
+        cache.invalidate(nic.SettingID)
+        # pick up the new lease, to renew it again once that one runs out
+        if (snapshot := cache.get(nic.SettingID)) is not None:
+            tracker.track(snapshot)
+
+    tracker = LeaseTracker(
+        backend,
+        renew=args.renew,
+        renew_before=args.before,
+        warn_before=args.before,
+        on_warn=warn,
+        on_renew=renewed,
+    )
+    for nic in nics.values():
+        tracker.track(nic)
+    tracker.start()
+    try:
+        while tracker.is_alive():
+            tracker.join(1)
+    except KeyboardInterrupt:
+        tracker.stop()
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    from baseline import export_configs
+    backend = make_backend(args)
+    if args.path == '-':
+        export_configs(backend, sys.stdout)
+        return 0
+    with open(args.path, 'w', encoding="utf8") as file:
+        written = export_configs(backend, file)
+    print(f"exported {written} adapter(s) to {args.path}", file=sys.stderr)
+    return 0
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    import json
+    from apply import describe_return_code, succeeded
+    from baseline import import_configs
+    backend = make_backend(args)
+    ok = True
+    with open(args.path, encoding="utf8") as file:
+        for result in import_configs(
+            backend,
+            file,
+            batch_size=args.batch,
+            dry_run=args.dry_run,
+            max_workers=args.workers,
+            journal=make_journal(args),
+        ):
+            return_codes = result.return_codes or []
+            ok = ok and result.error is None and succeeded(return_codes)
+            if args.json:
+                # one line per result, as they come in
+                json.dump(
+                    {
+                        **result._asdict(),
+                        "calls": [
+                            {"method": call.method, "params": call.params}
+                            for call in result.calls
+                        ],
+                    },
+                    sys.stdout,
+                )
+                sys.stdout.write('\n')
+                continue
+            name = result.description or result.setting_id or "?"
+            if result.error is not None:
+                print(f"line {result.line} ({name}): {result.error}")
+                continue
+            if not result.calls:
+                print(f"line {result.line} ({name}): already configured")
+            for step, call in enumerate(result.calls):
+                outcome = ''
+                if step < len(return_codes):
+                    outcome = f" -> {describe_return_code(return_codes[step])}"
+                elif not args.dry_run:
+                    outcome = " -> skipped"
+                print(f"line {result.line} ({name}): {call}{outcome}")
+    return 0 if ok else 1
+
+
+def make_connector(args: argparse.Namespace, hosts: list[str]) -> Callable[[str], Backend]:
+    """
+    The factory connecting to the hosts, with the credentials from the command line.
+    With `--fake`, each of the hosts gets its own fake adapters.
+    """
+    from fleet import FakeFleet, wmi_connector
+    connect: Callable[[str], Backend]
+    if args.fake is not None:
+        connect = FakeFleet(dict.fromkeys(hosts, args.fake))
+    else:
+        import os
+        credentials: dict[str, str] = {}
+        if args.user is not None:
+            credentials["user"] = args.user
+            credentials["password"] = os.environ.get(PASSWORD_ENV, '')
+        connect = wmi_connector(**credentials)
+    if args.recorder is not None:
+        from instrumentation import InstrumentedBackend
+        connect_raw = connect
+
+        def connect(host: str) -> Backend:
+            return InstrumentedBackend(connect_raw(host), args.recorder)
+    return connect
+
+
+def make_fleet(args: argparse.Namespace, hosts: list[str]) -> Fleet:
+    from fleet import ConnectionPool, Fleet
+    return Fleet(
+        ConnectionPool(make_connector(args, hosts)),
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+    )
+
+
+def read_plan(path: str) -> list[HostChange]:
+    """
+    Read an address plan - JSON lines with the "host", the "adapter" selector,
+    and the "address" to set, plus the optional "gateway" and "dns" servers.
+    """
+    import json
+    from apply import DesiredConfig
+    from fleet import HostChange
+    from addressing import parse_cidr
+    changes: list[HostChange] = []
+    with open(path, encoding="utf8") as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                network = parse_cidr(entry["address"])
+                if network is None or network.version != 4:
+                    raise ValueError(f"invalid address {entry['address']!r}")
+                gateway = entry.get("gateway")
+                dns = entry.get("dns")
+                changes.append(HostChange(
+                    str(entry["host"]),
+                    str(entry["adapter"]),
+                    DesiredConfig(
+                        addresses=(network.address,),
+                        subnets=(network.mask,),
+                        gateways=None if gateway is None else (gateway,),
+                        dns=None if dns is None else tuple(dns),
+                    ),
+                ))
+            except (ValueError, KeyError, TypeError) as exc:
+                raise CLIError(f"{path}, line {number}: {exc}")
+    return changes
+
+
+def cmd_fleet_list(args: argparse.Namespace) -> int:
+    from fleet import format_table
+    results = make_fleet(args, args.hosts).snapshots(args.hosts)
+    data: dict[str, Any] = {}
+    rows: list[tuple[str, ...]] = []
+    for host, result in results.items():
+        if isinstance(result, Exception):
+            data[host] = {"error": repr(result)}
+            rows.append((host, '', '', f"error: {result}"))
+            continue
+        data[host] = [nic.to_json() for nic in result]
+        rows.extend(
+            (host, str(nic.Index), nic.Description, ', '.join(nic.IPAddress) or '-')
+            for nic in sorted(result, key=lambda nic: nic.Index)
+        )
+    output(args, data, format_table(("HOST", "INDEX", "ADAPTER", "ADDRESSES"), rows))
+    return 0 if not any(isinstance(r, Exception) for r in results.values()) else 1
+
+
+def cmd_fleet_apply(args: argparse.Namespace) -> int:
+    from apply import describe_return_code, succeeded
+    from fleet import apply_plan, format_table
+    changes = read_plan(args.plan)
+    fleet = make_fleet(args, [change.host for change in changes])
+    rows = apply_plan(fleet, changes, dry_run=args.dry_run, journal=make_journal(args))
+    table: list[tuple[str, ...]] = []
+    for row in rows:
+        if row.error is not None:
+            outcome = f"error: {row.error}"
+        elif not row.calls:
+            outcome = "already configured"
+        elif row.return_codes is None:
+            outcome = "; ".join(str(call) for call in row.calls)
+        elif succeeded(row.return_codes) and len(row.return_codes) == len(row.calls):
+            outcome = f"{len(row.calls)} call(s) made"
+        else:
+            failed = row.calls[len(row.return_codes) - 1]
+            outcome = f"{failed.method} -> {describe_return_code(row.return_codes[-1])}"
+        table.append((row.host, row.adapter, row.addresses or '-', outcome))
+    output(
+        args,
+        [
+            {
+                **row._asdict(),
+                "calls": [{"method": call.method, "params": call.params} for call in row.calls],
+            }
+            for row in rows
+        ],
+        format_table(("HOST", "ADAPTER", "ADDRESSES", "RESULT"), table),
+    )
+    ok = all(
+        row.error is None and (row.return_codes is None or succeeded(row.return_codes))
+        for row in rows
+    )
+    return 0 if ok else 1
+
+
+def optimize_once(args: argparse.Namespace, backend: Backend, cache: AdapterCache) -> int:
+    from apply import apply_many, describe_return_code, succeeded
+    from routing import effective_metric, plan_metrics, rank_adapters
+    cache.invalidate()
+    ranked = rank_adapters(
+        cache.snapshots(), target=args.target, samples=args.samples, timeout=args.timeout
+    )
+    plans = plan_metrics([nic for nic, _ in ranked], step=args.step)
+    results = {} if args.dry_run else apply_many(backend, plans, journal=make_journal(args))
+    data: list[dict[str, Any]] = []
+    lines: list[str] = []
+    ok = True
+    for nic, timings in ranked:
+        calls = plans.get(nic, [])
+        result = results.get(nic.SettingID, [])
+        if isinstance(result, Exception):
+            ok = False
+            outcome = f"failed with {result!r}"
+            result = []
+        else:
+            ok = ok and succeeded(result)
+            outcome = ', '.join(describe_return_code(code) for code in result)
+        data.append({
+            "adapter": nic.SettingID,
+            "path": timings.server,
+            "median": timings.median,
+            "lost": timings.lost,
+            "metric": effective_metric(nic),
+            "calls": [
+                {
+                    "method": call.method,
+                    "params": call.params,
+                    "return_code": result[step] if step < len(result) else None,
+                }
+                for step, call in enumerate(calls)
+            ],
+        })
+        rtt = "no response" if timings.median is None else f"{timings.median * 1000:.1f} ms"
+        lines.append(f"{nic.Description}: {timings.server} {rtt}, metric {effective_metric(nic)}")
+        lines.extend(f"  {call}" for call in calls)
+        if outcome:
+            lines.append(f"  -> {outcome}")
+    if not ranked:
+        lines.append("no adapters with an IPv4 gateway")
+    output(args, data, '\n'.join(lines))
+    return 0 if ok else 1
+
+
+def cmd_optimize(args: argparse.Namespace) -> int:
+    import time
+    backend, cache = make_cache(args)
+    while True:
+        result = optimize_once(args, backend, cache)
+        if args.every is None:
+            return result
+        time.sleep(args.every)
+
+
+def cmd_save_profile(args: argparse.Namespace) -> int:
+    from profiles import Profile, ProfileStore
+    from addressing import parse_cidr
+    if args.address is not None and (
+        (network := parse_cidr(args.address)) is None or network.version != 4
+    ):
+        raise CLIError(f"Invalid address: {args.address!r}")
+    _, cache = make_cache(args)
+    nic = find_adapter(cache, args.adapter)
+    # whatever isn't given is taken from the adapter
+    profile = Profile.capture(args.name, nic, args.address or '')
+    if args.gateway is not None:
+        profile = profile._replace(gateway=args.gateway)
+    if args.dns is not None:
+        profile = profile._replace(dns=tuple(args.dns))
+    if args.metric is not None:
+        profile = profile._replace(metric=args.metric)
+    ProfileStore(args.profiles).save(profile)
+    output(args, profile.to_json(), f"{nic.Description}: saved profile {args.name!r}")
+    return 0
+
+
+def cmd_apply_profile(args: argparse.Namespace) -> int:
+    from profiles import ProfileStore
+    backend, cache = make_cache(args)
+    nic = find_adapter(cache, args.adapter)
+    if (profile := ProfileStore(args.profiles).get(nic.SettingID, args.name)) is None:
+        raise CLIError(f"No profile named {args.name!r} for {nic.Description!r}")
+    try:
+        desired = profile.desired()
+    except ValueError as exc:
+        raise CLIError(str(exc))
+    return apply_config(args, backend, nic, desired)
+
+
+def parse_time(value: str) -> float:
+    from datetime import datetime
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an ISO 8601 date and time: {value!r}")
+
+
+def cmd_history(args: argparse.Namespace) -> int:
+    import time
+    from itertools import islice
+    from apply import describe_return_code
+    journal = require_journal(args)
+    if args.adapter is not None:
+        _, cache = make_cache(args)
+        entries = journal.history(find_adapter(cache, args.adapter).SettingID, args.host)
+    elif args.host is not None:
+        entries = (entry for entry in journal.newest() if entry.host == args.host)
+    else:
+        entries = journal.newest()
+    selected = [
+        entry for entry in islice(
+            (
+                e for e in entries
+                if (args.since is None or e.time >= args.since)
+                and (args.until is None or e.time <= args.until)
+            ),
+            args.limit,
+        )
+    ]
+    lines: list[str] = []
+    for entry in selected:
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.time))
+        adapter = entry.before.Description
+        if entry.host is not None:
+            adapter = f"{entry.host}: {adapter}"
+        lines.append(
+            f"{entry.number:>5}  {when}  {entry.kind:<5}  {adapter}"
+            f"  ({sum(entry.seconds) * 1000:.0f} ms)"
+        )
+        if entry.undoes is not None:
+            lines.append(f"         undoes {entry.undoes}")
+        for step, call in enumerate(entry.calls):
+            outcome = "skipped"
+            if step < len(entry.return_codes):
+                outcome = describe_return_code(entry.return_codes[step])
+            lines.append(f"         {call} -> {outcome}")
+        if entry.error is not None:
+            lines.append(f"         failed with {entry.error}")
+    output(
+        args,
+        [
+            {"number": e.number, "setting_id": e.setting_id, **e.to_json()}
+            for e in selected
+        ],
+        '\n'.join(lines) or "no changes recorded",
+    )
+    return 0
+
+
+def cmd_undo(args: argparse.Namespace) -> int:
+    from journal import plan_undo
+    journal = require_journal(args)
+    backend, cache = make_cache(args)
+    setting_id = None if args.adapter is None else find_adapter(cache, args.adapter).SettingID
+    if (entry := journal.undoable(setting_id, args.host)) is None:
+        raise CLIError("Nothing to undo")
+    nic = find_adapter(cache, entry.setting_id)
+    return apply_calls(
+        args,
+        backend,
+        nic,
+        plan_undo(entry, nic),
+        {"undoes": entry.number},
+        kind="undo",
+        undoes=entry.number,
+    )
+
+
+def cmd_replay(args: argparse.Namespace) -> int:
+    from apply import apply_many, describe_return_code, succeeded
+    from journal import plan_replay
+    journal = require_journal(args)
+    backend, cache = make_cache(args)
+    plans, missing = plan_replay(
+        journal.between(args.since, args.until), cache.snapshots(), args.host
+    )
+    results = {} if args.dry_run else apply_many(
+        backend, plans, max_workers=args.workers, journal=journal, host=args.host
+    )
+    data: list[dict[str, Any]] = []
+    lines: list[str] = []
+    ok = not missing
+    for nic, calls in plans.items():
+        result = results.get(nic.SettingID, [])
+        if isinstance(result, Exception):
+            ok = False
+            lines.append(f"{nic.Description}: failed with {result!r}")
+            result = []
+        else:
+            ok = ok and succeeded(result)
+            lines.append(f"{nic.Description}:")
+        for step, call in enumerate(calls):
+            outcome = ''
+            if step < len(result):
+                outcome = f" -> {describe_return_code(result[step])}"
+            elif not args.dry_run:
+                outcome = " -> skipped"
+            lines.append(f"  {call}{outcome}")
+        data.append({
+            "adapter": nic.SettingID,
+            "calls": [
+                {
+                    "method": call.method,
+                    "params": call.params,
+                    "return_code": result[step] if step < len(result) else None,
+                }
+                for step, call in enumerate(calls)
+            ],
+        })
+    lines.extend(f"{setting_id}: no such adapter" for setting_id in missing)
+    if not plans and not missing:
+        lines.append("already configured, nothing to do")
+    output(args, {"adapters": data, "missing": missing}, '\n'.join(lines))
+    return 0 if ok else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="ipchanger", description="Change the IP configuration of network adapters."
+    )
+    parser.add_argument("--json", action="store_true", help="output machine-readable JSON")
+    parser.add_argument(
+        "--fake", type=int, metavar="N", help="use N in-memory fake adapters instead of WMI"
+    )
+    parser.add_argument(
+        "--timings", metavar="PATH", help="time every WMI operation, and save a report as JSON"
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="PATH",
+        help="journal to record changes in, and undo or replay them from",
+    )
+    parser.add_argument(
+        "--no-journal", action="store_true", help="don't record the changes made"
+    )
+    # only some of the commands work with remote hosts
+    parser.set_defaults(host=None, user=None)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name: str, func: Any, help: str) -> argparse.ArgumentParser:
+        subparser = commands.add_parser(name, help=help)
+        subparser.set_defaults(func=func)
+        return subparser
+
+    def modifying(subparser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        subparser.add_argument("adapter", help="adapter Index, SettingID or Description")
+        subparser.add_argument(
+            "--dry-run", action="store_true", help="only show the calls that would be made"
+        )
+        return subparser
+
+    command("list", cmd_list, "list IP-enabled adapters")
+    show = command("show", cmd_show, "show an adapter's configuration")
+    show.add_argument("adapter", help="adapter Index, SettingID or Description")
+    set_ = modifying(command("set", cmd_set, "set a static address"))
+    set_.add_argument("address", help="address[/prefix], the prefix defaults to 24")
+    set_.add_argument(
+        "--gateway", help='default gateway, or "auto" to pick a reachable one in the network'
+    )
+    set_.add_argument("--dns", nargs="+", metavar="SERVER", help="DNS servers, in order")
+    set_.add_argument(
+        "--force",
+        action="store_true",
+        help="skip checking if the address is already in use, which --fake and --dry-run skip too",
+    )
+    free = command("free", cmd_free, "find addresses nothing responds on")
+    free.add_argument("network", help="network/prefix to search, up to a /22")
+    free.add_argument("--count", type=int, default=1, help="how many addresses to find")
+    free.add_argument(
+        "--timeout", type=float, default=0.5, help="seconds to wait for each address"
+    )
+    modifying(command("dhcp", cmd_dhcp, "enable DHCP"))
+    dns = modifying(command("dns", cmd_dns, "set the DNS servers"))
+    dns.add_argument("servers", nargs="*", help="DNS servers in order, none to reset")
+    dns.add_argument(
+        "--fastest",
+        action="store_true",
+        help="time the servers (the current ones if none are given) and use the fastest first",
+    )
+    dns.add_argument("--samples", type=int, default=5, help="queries to time per server")
+    dns.add_argument(
+        "--timeout", type=float, default=1.0, help="seconds to wait for each response"
+    )
+    for operation, help in (
+        ("renew", "renew the DHCP leases of adapters"),
+        ("release", "release the DHCP leases of adapters"),
+    ):
+        lease = command(operation, cmd_lease, help)
+        lease.set_defaults(operation=operation)
+        lease.add_argument(
+            "adapters", nargs="*", help="adapter Index, SettingID or Description"
+        )
+        lease.add_argument(
+            "--all", action="store_true", help="all adapters with DHCP enabled"
+        )
+        lease.add_argument(
+            "--workers", type=int, default=16, help="how many adapters to process at once"
+        )
+    export = command("export", cmd_export, "save the configuration of all adapters")
+    export.add_argument("path", help="JSON lines file to write, - for the standard output")
+    import_ = command("import", cmd_import, "restore the configurations saved by export")
+    import_.add_argument("path", help="JSON lines file to read")
+    import_.add_argument(
+        "--batch", type=int, default=64, help="how many adapters to validate and apply at once"
+    )
+    import_.add_argument(
+        "--workers", type=int, default=4, help="how many adapters to configure at once"
+    )
+    import_.add_argument(
+        "--dry-run", action="store_true", help="only show the calls that would be made"
+    )
+    leases = command("leases", cmd_leases, "list DHCP leases, soonest to expire first")
+    leases.add_argument(
+        "--watch", action="store_true", help="keep running, warning about expiring leases"
+    )
+    leases.add_argument(
+        "--renew", action="store_true", help="with --watch, renew the leases instead"
+    )
+    leases.add_argument(
+        "--before",
+        type=float,
+        default=300.0,
+        metavar="SECONDS",
+        help="how long before the expiry to warn or renew",
+    )
+    optimize = command(
+        "optimize", cmd_optimize, "prefer the adapters with the fastest default routes"
+    )
+    optimize.add_argument(
+        "--target",
+        help="address to probe through every adapter, instead of each adapter's gateway",
+    )
+    optimize.add_argument("--samples", type=int, default=5, help="probes per adapter")
+    optimize.add_argument(
+        "--timeout", type=float, default=1.0, help="seconds to wait for each probe"
+    )
+    optimize.add_argument(
+        "--step", type=int, default=10, help="metric difference between adapters"
+    )
+    optimize.add_argument(
+        "--every", type=float, metavar="SECONDS", help="keep re-evaluating at this interval"
+    )
+    optimize.add_argument(
+        "--dry-run", action="store_true", help="only show the calls that would be made"
+    )
+    save_profile = command(
+        "save-profile", cmd_save_profile, "save an adapter's configuration as a profile"
+    )
+    save_profile.add_argument("adapter", help="adapter Index, SettingID or Description")
+    save_profile.add_argument("name", help="profile name")
+    save_profile.add_argument(
+        "address", nargs="?", help="address[/prefix] to switch to, DHCP if not given"
+    )
+    save_profile.add_argument(
+        "--gateway", help="default gateway, the adapter's current one in the network if not given"
+    )
+    save_profile.add_argument(
+        "--dns",
+        nargs="*",
+        metavar="SERVER",
+        help="DNS servers in order, the current ones if not given",
+    )
+    save_profile.add_argument(
+        "--metric", type=int, help="interface metric, the current one if not given"
+    )
+    save_profile.add_argument("--profiles", metavar="PATH", help="profile store to use")
+    profile = modifying(command("apply-profile", cmd_apply_profile, "apply a saved profile"))
+    profile.add_argument("name", help="profile name")
+    profile.add_argument("--profiles", metavar="PATH", help="profile store to use")
+    history = command("history", cmd_history, "list the recorded changes, newest first")
+    history.add_argument(
+        "adapter", nargs="?", help="only changes of the adapter with this Index, SettingID or name"
+    )
+    undo = command("undo", cmd_undo, "undo the most recent change that wasn't undone yet")
+    undo.add_argument(
+        "adapter", nargs="?", help="only changes of the adapter with this Index, SettingID or name"
+    )
+    undo.add_argument(
+        "--dry-run", action="store_true", help="only show the calls that would be made"
+    )
+    replay = command(
+        "replay", cmd_replay, "bring the adapters to the configuration the changes left them in"
+    )
+    replay.add_argument(
+        "--workers", type=int, default=4, help="how many adapters to configure at once"
+    )
+    replay.add_argument(
+        "--dry-run", action="store_true", help="only show the calls that would be made"
+    )
+    for journaled in (history, replay):
+        journaled.add_argument(
+            "--since", type=parse_time, help="only changes from this ISO 8601 date and time on"
+        )
+        journaled.add_argument(
+            "--until", type=parse_time, help="only changes up to this ISO 8601 date and time"
+        )
+    history.add_argument("--limit", type=int, default=20, help="how many changes to list")
+    for remote in (history, undo, replay):
+        remote.add_argument("--host", help="the changes made to this host by fleet-apply")
+        remote.add_argument(
+            "--user", help=f"user to connect as, with the password taken from {PASSWORD_ENV}"
+        )
+    for name, func, help in (
+        ("fleet-list", cmd_fleet_list, "list the adapters of many hosts at once"),
+        ("fleet-apply", cmd_fleet_apply, "apply an address plan to many hosts at once"),
+    ):
+        fleet = command(name, func, help)
+        fleet.add_argument(
+            "--concurrency", type=int, default=16, help="how many hosts to process at once"
+        )
+        fleet.add_argument(
+            "--timeout", type=float, default=30.0, help="seconds to give each host"
+        )
+        fleet.add_argument(
+            "--user", help=f"user to connect as, with the password taken from {PASSWORD_ENV}"
+        )
+        if name == "fleet-list":
+            fleet.add_argument("hosts", nargs="+", help="hosts to connect to")
+        else:
+            fleet.add_argument(
+                "plan", help='JSON lines with the "host", "adapter", "address", "gateway", "dns"'
+            )
+            fleet.add_argument(
+                "--dry-run", action="store_true", help="only show the calls that would be made"
+            )
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    args.recorder = None
+    if args.timings is not None:
+        from instrumentation import TimingRecorder
+        args.recorder = TimingRecorder()
+    try:
+        return args.func(args)
+    except CLIError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 2
+    finally:
+        if args.recorder is not None:
+            args.recorder.export(args.timings)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
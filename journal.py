@@ -0,0 +1,469 @@
+"""
+Journal of every configuration change made, for undoing and replaying them.
+
+The journal is an append-only JSON lines file, with an entry for every apply: the adapter's
+snapshot from before it, the calls made, their return codes and how long each of them took.
+Next to it, an index file holds a fixed-size record per entry, with the entry's timestamp,
+offset, and the number of the previous entry of the same adapter. Opening the journal reads
+just the index, 40 bytes per entry, instead of parsing the journal itself. After that,
+finding the entries of a time range or the latest entry of an adapter doesn't depend on
+how large the journal grows, and only the entries needed are ever parsed.
+
+Changes made to remote hosts through the fleet are recorded with the `host` they were made on,
+and the entries of the local adapters have no host.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import struct
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, TYPE_CHECKING
+
+from cache import AdapterSnapshot, find_snapshot
+from apply import DesiredConfig, MethodCall, current_config, plan_changes, run_calls
+
+if TYPE_CHECKING:
+    from backend import Backend
+
+
+# timestamp, offset in the journal, number of the adapter's previous entry or -1,
+# and a digest of the adapter's SettingID
+_INDEX_RECORD = struct.Struct("<dQq16s")
+_NO_ENTRY = -1
+
+
+def default_path() -> str:
+    base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    return os.path.join(base, "IPChanger", "journal.jsonl")
+
+
+def _adapter_key(setting_id: str, host: str | None = None) -> bytes:
+    name = setting_id if host is None else f"{host}/{setting_id}"
+    return hashlib.blake2b(name.encode("utf8"), digest_size=16).digest()
+
+
+class JournalEntry(NamedTuple):
+    """
+    A single apply, as recorded in the journal. `return_codes` and `seconds` are shorter
+    than `calls` when the apply stopped early, and `error` holds the exception it stopped with.
+    Undo entries record the `number` of the entry they undid in `undoes`, and the changes
+    made to remote hosts record the `host`.
+    """
+    number: int
+    time: float
+    kind: str
+    before: AdapterSnapshot
+    calls: list[MethodCall]
+    return_codes: list[int]
+    seconds: list[float]
+    error: str | None = None
+    undoes: int | None = None
+    host: str | None = None
+
+    @property
+    def setting_id(self) -> str:
+        return self.before.SettingID
+
+    def made_calls(self) -> list[MethodCall]:
+        """
+        The calls that went through - the ones that returned 0 or 1.
+        """
+        return [
+            call for call, code in zip(self.calls, self.return_codes) if code in (0, 1)
+        ]
+
+    def to_json(self) -> dict[str, Any]:
+        record: dict[str, Any] = {
+            "time": self.time,
+            "kind": self.kind,
+            "before": self.before.to_json(),
+            "calls": [[call.method, call.params] for call in self.calls],
+            "return_codes": self.return_codes,
+            "seconds": [round(seconds, 6) for seconds in self.seconds],
+        }
+        if self.error is not None:
+            record["error"] = self.error
+        if self.undoes is not None:
+            record["undoes"] = self.undoes
+        if self.host is not None:
+            record["host"] = self.host
+        return record
+
+    @classmethod
+    def from_json(cls, number: int, record: dict[str, Any]) -> JournalEntry:
+        return cls(
+            number,
+            record["time"],
+            record["kind"],
+            AdapterSnapshot(**record["before"]),
+            [MethodCall(method, params) for method, params in record["calls"]],
+            record["return_codes"],
+            record["seconds"],
+            record.get("error"),
+            record.get("undoes"),
+            record.get("host"),
+        )
+
+
+class Journal:
+    """
+    The change journal, kept in `path` and its index in `path` + ".idx".
+
+    Entries are numbered from 0 in the order they were recorded, which is also the order
+    of their timestamps. An entry interrupted while being written is discarded the next time
+    the journal is opened, and entries written without their index record are indexed then.
+    Recording is thread-safe.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path: str = path or default_path()
+        self.index_path: str = f"{self.path}.idx"
+        self._lock = threading.Lock()
+        self._times: list[float] = []
+        self._offsets: list[int] = []
+        self._previous: list[int] = []
+        # adapter key -> number of its latest entry
+        self._latest: dict[bytes, int] = {}
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _index(self, timestamp: float, offset: int, key: bytes) -> bytes:
+        number = len(self._offsets)
+        previous = self._latest.get(key, _NO_ENTRY)
+        self._times.append(timestamp)
+        self._offsets.append(offset)
+        self._previous.append(previous)
+        self._latest[key] = number
+        return _INDEX_RECORD.pack(timestamp, offset, previous, key)
+
+    def _load(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        for path in (self.path, self.index_path):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+        journal_size = os.path.getsize(self.path)
+        with open(self.index_path, "rb") as file:
+            data = file.read()
+        indexed = 0
+        for timestamp, offset, _, key in _INDEX_RECORD.iter_unpack(
+            data[:len(data) - len(data) % _INDEX_RECORD.size]
+        ):
+            if offset >= journal_size:
+                # the journal lost its tail, the index can't point past it
+                break
+            self._index(timestamp, offset, key)
+            indexed += 1
+        # entries written after the last indexed one, whose index records didn't make it
+        missing: list[bytes] = []
+        with open(self.path, "rb") as file:
+            if self._offsets:
+                file.seek(self._offsets[-1])
+                file.readline()
+            good_until = file.tell()
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # an entry that was interrupted while being written
+                    break
+                try:
+                    record = json.loads(line)
+                    key = _adapter_key(record["before"]["SettingID"], record.get("host"))
+                    timestamp = float(record["time"])
+                except (ValueError, KeyError, TypeError):
+                    break
+                missing.append(self._index(timestamp, good_until, key))
+                good_until += len(line)
+        if good_until < journal_size:
+            # cut off the damaged tail, so that new entries don't get appended to it
+            with open(self.path, "r+b") as file:
+                file.truncate(good_until)
+        if indexed * _INDEX_RECORD.size != len(data) or missing:
+            with open(self.index_path, "r+b") as file:
+                file.truncate(indexed * _INDEX_RECORD.size)
+                file.seek(0, os.SEEK_END)
+                file.write(b''.join(missing))
+
+    def record(
+        self,
+        before: AdapterSnapshot,
+        calls: list[MethodCall],
+        return_codes: list[int],
+        seconds: list[float],
+        *,
+        kind: str = "apply",
+        error: str | None = None,
+        undoes: int | None = None,
+        host: str | None = None,
+    ) -> JournalEntry:
+        """
+        Append an entry, and return it. The journal is synced to disk before its index,
+        so that the index never points at an entry that doesn't exist.
+        """
+        with self._lock:
+            # timestamps have to keep growing, even if the clock is set back
+            timestamp = max(time.time(), self._times[-1] if self._times else 0.0)
+            entry = JournalEntry(
+                len(self._offsets),
+                timestamp,
+                kind,
+                before,
+                calls,
+                return_codes,
+                seconds,
+                error,
+                undoes,
+                host,
+            )
+            line = json.dumps(entry.to_json(), separators=(',', ':')).encode("utf8") + b'\n'
+            with open(self.path, "ab") as file:
+                offset = file.tell()
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            index_record = self._index(timestamp, offset, _adapter_key(before.SettingID, host))
+            with open(self.index_path, "ab") as file:
+                file.write(index_record)
+        return entry
+
+    def entry(self, number: int) -> JournalEntry:
+        if not 0 <= number < len(self._offsets):
+            raise IndexError(f"No journal entry number {number}")
+        with open(self.path, "rb") as file:
+            file.seek(self._offsets[number])
+            return JournalEntry.from_json(number, json.loads(file.readline()))
+
+    def _entries(self, numbers: Iterable[int]) -> Iterator[JournalEntry]:
+        with open(self.path, "rb") as file:
+            for number in numbers:
+                file.seek(self._offsets[number])
+                yield JournalEntry.from_json(number, json.loads(file.readline()))
+
+    def latest(self, setting_id: str, host: str | None = None) -> JournalEntry | None:
+        """
+        The most recent entry of the adapter, on the given host or the local one.
+        """
+        return next(self.history(setting_id, host), None)
+
+    def history(self, setting_id: str, host: str | None = None) -> Iterator[JournalEntry]:
+        """
+        The entries of the adapter, on the given host or the local one, newest first.
+        """
+        def numbers() -> Iterator[int]:
+            number = self._latest.get(_adapter_key(setting_id, host), _NO_ENTRY)
+            while number != _NO_ENTRY:
+                yield number
+                number = self._previous[number]
+        # different adapters could share a digest, in theory
+        return (
+            e for e in self._entries(numbers()) if e.setting_id == setting_id and e.host == host
+        )
+
+    def between(
+        self, start: float | None = None, end: float | None = None
+    ) -> Iterator[JournalEntry]:
+        """
+        The entries recorded from `start` up to and including `end`, oldest first.
+        """
+        first = 0 if start is None else bisect_left(self._times, start)
+        last = len(self._times) if end is None else bisect_right(self._times, end)
+        return self._entries(range(first, last))
+
+    def newest(self) -> Iterator[JournalEntry]:
+        """
+        All entries, newest first.
+        """
+        return self._entries(range(len(self._offsets) - 1, -1, -1))
+
+    def undoable(
+        self, setting_id: str | None = None, host: str | None = None
+    ) -> JournalEntry | None:
+        """
+        The most recent entry made on the given host or the local one, that can be undone
+        and hasn't been yet, optionally only of the given adapter. Undo entries themselves
+        aren't undoable, so undoing repeatedly steps further back.
+        """
+        if setting_id is None:
+            entries = (entry for entry in self.newest() if entry.host == host)
+        else:
+            entries = self.history(setting_id, host)
+        undone: set[int] = set()
+        for entry in entries:
+            if entry.undoes is not None:
+                undone.add(entry.undoes)
+            elif entry.number not in undone and reversible(entry):
+                return entry
+        return None
+
+
+def run_journaled(
+    journal: Journal,
+    backend: Backend,
+    nic: AdapterSnapshot,
+    calls: list[MethodCall],
+    progress: Callable[[int, MethodCall, int], None] | None = None,
+    *,
+    kind: str = "apply",
+    undoes: int | None = None,
+    host: str | None = None,
+) -> list[int]:
+    """
+    `run_calls`, recording the apply in the journal, along with how long each call took.
+    Pass the `host` when the backend is connected to a remote one.
+    Applies that make no calls aren't recorded.
+    """
+    if not calls:
+        return []
+    # kept here rather than taken from run_calls, to have them even if a call raises
+    return_codes: list[int] = []
+    seconds: list[float] = []
+    start = time.perf_counter()
+
+    def timed(step: int, call: MethodCall, return_code: int) -> None:
+        nonlocal start
+        seconds.append(time.perf_counter() - start)
+        return_codes.append(return_code)
+        if progress is not None:
+            progress(step, call, return_code)
+        start = time.perf_counter()
+
+    try:
+        run_calls(backend, nic, calls, timed)
+    except Exception as exc:
+        journal.record(
+            nic,
+            calls,
+            return_codes,
+            seconds,
+            kind=kind,
+            error=repr(exc),
+            undoes=undoes,
+            host=host,
+        )
+        raise
+    journal.record(nic, calls, return_codes, seconds, kind=kind, undoes=undoes, host=host)
+    return return_codes
+
+
+def changed_fields(calls: Iterable[MethodCall]) -> tuple[dict[str, Any], dict[str, MethodCall]]:
+    """
+    Fold the calls into the DesiredConfig fields they set, and the other calls,
+    the latest one of each method.
+    """
+    fields: dict[str, Any] = {}
+    other: dict[str, MethodCall] = {}
+    for call in calls:
+        params = call.params
+        if call.method == "EnableStatic":
+            fields.update(
+                dhcp=False,
+                addresses=tuple(params["IPAddress"]),
+                subnets=tuple(params["SubnetMask"]),
+            )
+        elif call.method == "EnableDHCP":
+            fields["dhcp"] = True
+        elif call.method == "SetGateways":
+            metrics = params.get("GatewayCostMetric")
+            fields.update(
+                gateways=tuple(params["DefaultIPGateway"]),
+                gateway_metrics=None if metrics is None else tuple(metrics),
+            )
+        elif call.method == "SetDNSServerSearchOrder":
+            fields["dns"] = tuple(params["DNSServerSearchOrder"] or ())
+        elif call.method == "SetIPConnectionMetric":
+            fields["metric"] = params["IPConnectionMetric"]
+        else:
+            other.pop(call.method, None)
+            other[call.method] = call
+    return fields, other
+
+
+def reversible(entry: JournalEntry) -> bool:
+    """
+    Whether `plan_undo` can bring back anything the entry changed.
+    """
+    fields, other = changed_fields(entry.made_calls())
+    return bool(fields) or "ReleaseDHCPLease" in other
+
+
+def plan_undo(entry: JournalEntry, current: AdapterSnapshot) -> list[MethodCall]:
+    """
+    The calls that bring back what the entry changed, as it was before it.
+    Only the settings the entry changed are touched, so anything else changed since
+    is kept. Settings outside of the snapshot, like WINS servers, can't be undone.
+    A released DHCP lease is renewed, but renewing a lease can't be undone.
+    """
+    fields, other = changed_fields(entry.made_calls())
+    before = entry.before
+    restore: dict[str, Any] = {}
+    if "dhcp" in fields:
+        restore.update(current_config(before)._asdict())
+    # switching to DHCP and back loses the gateways, so they're restored as well
+    if "gateways" in fields or ("dhcp" in fields and not before.DHCPEnabled):
+        gateways = [
+            (gateway, metric)
+            for gateway, metric in zip(
+                before.DefaultIPGateway,
+                before.GatewayCostMetric or (1,) * len(before.DefaultIPGateway),
+            )
+            if ':' not in gateway
+        ]
+        restore.update(
+            gateways=tuple(g for g, _ in gateways),
+            gateway_metrics=tuple(m for _, m in gateways),
+        )
+    if "dns" in fields:
+        restore["dns"] = before.DNSServerSearchOrder
+    if "metric" in fields and before.IPConnectionMetric is not None:
+        restore["metric"] = before.IPConnectionMetric
+    calls = plan_changes(current, current_config(current)._replace(**restore))
+    if "ReleaseDHCPLease" in other and current.DHCPEnabled:
+        calls.append(MethodCall("RenewDHCPLease", {}))
+    return calls
+
+
+def plan_replay(
+    entries: Iterable[JournalEntry],
+    snapshots: Iterable[AdapterSnapshot],
+    host: str | None = None,
+) -> tuple[dict[AdapterSnapshot, list[MethodCall]], list[str]]:
+    """
+    Plan the calls that bring the adapters to the configuration the entries left them in.
+
+    Rather than repeating every call, the calls of each adapter are folded into the final
+    configuration, which is planned against the adapter's current state, so replaying
+    a long range takes no more calls than a single apply. Calls that don't map onto
+    the configuration are repeated after that, the latest of each method.
+    Adapters are matched by SettingID, or by MAC address if there's no such adapter anymore,
+    like after reinstalling the system. Only the entries made on `host` are replayed,
+    with `None` for the local one. Returns the plans, and the SettingIDs of the adapters
+    that couldn't be found.
+    """
+    snapshots = list(snapshots)
+    made: dict[str, list[MethodCall]] = {}
+    befores: dict[str, AdapterSnapshot] = {}
+    for entry in entries:
+        if entry.host != host:
+            continue
+        made.setdefault(entry.setting_id, []).extend(entry.made_calls())
+        befores.setdefault(entry.setting_id, entry.before)
+    plans: dict[AdapterSnapshot, list[MethodCall]] = {}
+    missing: list[str] = []
+    for setting_id, calls in made.items():
+        current = find_snapshot(snapshots, setting_id)
+        if current is None and (mac := befores[setting_id].MACAddress):
+            current = next(
+                (nic for nic in snapshots if (nic.MACAddress or '').upper() == mac.upper()), None
+            )
+        if current is None:
+            missing.append(setting_id)
+            continue
+        fields, other = changed_fields(calls)
+        desired: DesiredConfig = current_config(current)._replace(**fields)
+        if planned := plan_changes(current, desired) + list(other.values()):
+            plans[current] = planned
+    return plans, missing
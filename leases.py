@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import time
+import heapq
+import calendar
+import threading
+from functools import lru_cache
+from typing import Callable, NamedTuple, TYPE_CHECKING
+
+from backend import com_apartment
+
+if TYPE_CHECKING:
+    from backend import Backend
+    from cache import AdapterSnapshot
+
+
+@lru_cache(maxsize=4096)
+def parse_cim_datetime(text: str) -> float | None:
+    """
+    Convert a CIM datetime, like '20220816124219.000000+120', to a UNIX timestamp.
+    The part after the sign is the UTC offset in minutes. Returns `None` for anything else,
+    including the intervals and wildcarded ('*') values CIM allows.
+    Adapters report the same few values over and over, so the results are cached.
+    """
+    if len(text) != 25 or text[14] != '.' or text[21] not in "+-":
+        return None
+    try:
+        seconds = calendar.timegm((
+            int(text[0:4]),
+            int(text[4:6]),
+            int(text[6:8]),
+            int(text[8:10]),
+            int(text[10:12]),
+            int(text[12:14]),
+        ))
+        fraction = int(text[15:21]) / 1_000_000
+        offset = int(text[21:25]) * 60
+    except ValueError:
+        return None
+    return seconds + fraction - offset
+
+
+class Lease(NamedTuple):
+    """
+    The DHCP lease of an adapter, as UNIX timestamps.
+    """
+    setting_id: str
+    obtained: float | None
+    expires: float
+
+    @classmethod
+    def from_snapshot(cls, nic: AdapterSnapshot) -> Lease | None:
+        if not nic.DHCPEnabled or not nic.DHCPLeaseExpires:
+            return None
+        if (expires := parse_cim_datetime(nic.DHCPLeaseExpires)) is None:
+            return None
+        obtained = None
+        if nic.DHCPLeaseObtained:
+            obtained = parse_cim_datetime(nic.DHCPLeaseObtained)
+        return cls(nic.SettingID, obtained, expires)
+
+
+class LeaseTracker(threading.Thread):
+    """
+    Daemon thread watching the expiry of the DHCP leases of all tracked adapters.
+
+    The leases are kept in a heap ordered by when they need attention next, so the thread
+    only wakes up for the lease closest to it, or when a lease that's even closer is tracked.
+    `warn_before` seconds before a lease expires, `on_warn` is called with the adapter
+    and the expiry. With `renew` enabled, leases are renewed through `RenewDHCPLease`
+    `renew_before` seconds before they expire instead, and `on_renew` receives the adapter
+    and the return code. Failed renewals are retried every `retry` seconds until the lease
+    expires. Callbacks are called from the tracker's thread.
+
+    Adapters are (re)tracked by passing their newest snapshots to `track`,
+    which replaces whatever was scheduled for them before.
+    """
+
+    def __init__(
+        self,
+        backend: Backend,
+        *,
+        renew: bool = False,
+        renew_before: float = 300.0,
+        warn_before: float = 600.0,
+        retry: float = 60.0,
+        on_warn: Callable[[AdapterSnapshot, float], None] | None = None,
+        on_renew: Callable[[AdapterSnapshot, int], None] | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__(name="lease-tracker", daemon=True)
+        self._backend: Backend = backend
+        self.renew: bool = renew
+        self.renew_before: float = renew_before
+        self.warn_before: float = warn_before
+        self.retry: float = retry
+        self._on_warn = on_warn
+        self._on_renew = on_renew
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._stopped: bool = False
+        # (due, generation, SettingID), with entries replaced since left in place
+        # and skipped once they come up, instead of searching the heap for them
+        self._heap: list[tuple[float, int, str]] = []
+        self._tracked: dict[str, tuple[int, AdapterSnapshot, Lease]] = {}
+        # leases already warned about or renewed, so that tracking them again does nothing
+        self._handled: dict[str, tuple[AdapterSnapshot, Lease]] = {}
+        self._generation: int = 0
+        self.wakeups: int = 0
+
+    def _due(self, lease: Lease) -> float:
+        return lease.expires - (self.renew_before if self.renew else self.warn_before)
+
+    def _schedule(self, nic: AdapterSnapshot, lease: Lease, due: float) -> None:
+        # called with the condition held
+        self._generation += 1
+        self._tracked[nic.SettingID] = (self._generation, nic, lease)
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due, self._generation, nic.SettingID))
+        if earliest is None or due < earliest:
+            # the thread sleeps until the previous earliest entry, wake it up
+            self._condition.notify()
+
+    def track(self, nic: AdapterSnapshot) -> None:
+        """
+        Start or update tracking the adapter's lease. Adapters without DHCP are untracked.
+        """
+        if (lease := Lease.from_snapshot(nic)) is None:
+            self.untrack(nic.SettingID)
+            return
+        with self._condition:
+            tracked = self._tracked.get(nic.SettingID)
+            if tracked is not None and tracked[2] == lease:
+                # nothing changed, keep the existing entry and any retries it has scheduled
+                return
+            handled = self._handled.get(nic.SettingID)
+            if handled is not None and handled[1] == lease:
+                return
+            self._handled.pop(nic.SettingID, None)
+            self._schedule(nic, lease, self._due(lease))
+
+    def set_renew(self, renew: bool) -> None:
+        """
+        Switch between warning and renewing, rescheduling the tracked leases to match.
+        Turning renewing on also renews the leases only warned about so far,
+        unless they've expired already.
+        """
+        with self._condition:
+            if renew == self.renew:
+                return
+            self.renew = renew
+            pending = [(nic, lease) for _, nic, lease in self._tracked.values()]
+            if renew:
+                now = self._clock()
+                for setting_id, (nic, lease) in list(self._handled.items()):
+                    if lease.expires > now:
+                        del self._handled[setting_id]
+                        pending.append((nic, lease))
+            for nic, lease in pending:
+                self._schedule(nic, lease, self._due(lease))
+
+    def untrack(self, setting_id: str) -> None:
+        with self._condition:
+            self._tracked.pop(setting_id, None)
+            self._handled.pop(setting_id, None)
+
+    def leases(self) -> list[Lease]:
+        """
+        The tracked leases, expiring soonest first.
+        """
+        with self._condition:
+            leases = [lease for _, _, lease in self._tracked.values()]
+        return sorted(leases, key=lambda lease: lease.expires)
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _next_due(self) -> tuple[AdapterSnapshot, Lease] | None:
+        """
+        Wait until the earliest entry is due, and return it. Returns `None` once stopped.
+        """
+        with self._condition:
+            while not self._stopped:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, generation, setting_id = self._heap[0]
+                tracked = self._tracked.get(setting_id)
+                if tracked is None or tracked[0] != generation:
+                    # replaced or untracked since
+                    heapq.heappop(self._heap)
+                    continue
+                if (remaining := due - self._clock()) > 0:
+                    self._condition.wait(remaining)
+                    self.wakeups += 1
+                    continue
+                heapq.heappop(self._heap)
+                del self._tracked[setting_id]
+                self._handled[setting_id] = (tracked[1], tracked[2])
+                return tracked[1], tracked[2]
+            return None
+
+    def run(self) -> None:
+        with com_apartment():
+            while (entry := self._next_due()) is not None:
+                nic, lease = entry
+                if not self.renew:
+                    if self._on_warn is not None:
+                        self._on_warn(nic, lease.expires)
+                    continue
+                try:
+                    return_code = self._backend.renew_dhcp(nic)
+                except Exception:
+                    return_code = 65  # Unknown failure
+                if self._on_renew is not None:
+                    self._on_renew(nic, return_code)
+                if return_code not in (0, 1):
+                    retry_at = self._clock() + self.retry
+                    if retry_at < lease.expires:
+                        with self._condition:
+                            # unless a newer lease has been tracked in the meantime
+                            handled = self._handled.get(nic.SettingID)
+                            if handled is not None and handled[1] == lease:
+                                self._schedule(nic, lease, retry_at)
@@ -1,75 +1,785 @@
 from __future__ import annotations
 
-import re
+import sys
+import time
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog, messagebox
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING
 
-import wmi as wmi_lib
-
-from element_types import InterfaceType
-from gui_elements import PlaceholderEntry, HelpLabel, SelectMenu
-
-
-IP_PATTERN = re.compile(
-    r'\b('
-    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))\.'
-    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))\.'
-    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))\.'
-    r'(?:1?[0-9]{1,2}|2(?:[0-4][0-9]|5[0-5]))'
-    r')(?:/([1-2]?[0-9]|3[0-2]))?'
-    r'\b$'
+from worker import ComWorker
+from backend import WMIBackend
+from cache import AdapterCache
+from watcher import AdapterWatcher, WMIEventSource
+from addressing import parse_cidr
+from apply import (
+    DesiredConfig,
+    MethodCall,
+    apply_many,
+    describe_return_code,
+    dhcp_many,
+    dns_only,
+    parse_ipmask,
+    plan_changes,
+    succeeded,
+)
+from profiles import Profile, ProfileStore
+from journal import Journal, plan_undo, run_journaled
+from leases import LeaseTracker, parse_cim_datetime
+from instrumentation import InstrumentedBackend, instrument
+from gui_elements import (
+    DiffTable, HelpLabel, PlaceholderEntry, PlaceholderCombobox, SearchPicker
 )
 
+if TYPE_CHECKING:
+    from cache import AdapterSnapshot
+    from addressing import Network
+    from resolvers import ServerTimings
+    from probing import Prober, ScanCache
 
-def get_mask(value: int) -> str:
-    if not (0 <= value <= 32):
-        raise ValueError("Network mask can only range between 1 and 32")
-    parts = []
-    m, n = divmod(value, 8)
-    for i in range(m):
-        parts.append('255')
-    if n > 0:
-        parts.append(str((1 << 8) - (1 << 8-n)))
-    while len(parts) < 4:
-        parts.append('0')
-    return '.'.join(parts)
 
+POLL_INTERVAL = 50  # ms
+STATUS_INTERVAL = 5  # seconds, the default for the status table's refresh interval
+OPTIMIZE_INTERVAL = 10 * 60 * 1000  # ms, how often the route preference is re-evaluated
 
-wmi = wmi_lib.WMI()
+# timings are only collected with the IPCHANGER_TIMINGS environment variable set
+backend = instrument(WMIBackend())
+cache = AdapterCache(backend)
+profiles = ProfileStore()
+journal = Journal()
+# enumeration and applying run on separate workers, so that a refresh doesn't wait on an apply
+worker = ComWorker()
+worker.start()
+apply_worker = ComWorker("apply-worker")
+apply_worker.start()
+# IDs of the apply jobs that haven't started yet, most recent last
+queued_jobs: list[int] = []
 root = tk.Tk()
 root.title("IP Changer (by DevilXD)")
 frame = ttk.Frame(root, padding=20)
 frame.pack(expand=True, fill="both")
-# Gather and display a list of interfaces
-raw_interfaces: list[InterfaceType] = wmi.Win32_NetworkAdapterConfiguration(IPEnabled=True)
-interfaces: dict[str, InterfaceType] = {i.Description: i for i in raw_interfaces}
 HelpLabel(
     frame, text="Interface: ", tooltip="Select the interface to interract with."
 ).grid(column=0, row=0)
-nic_menu: SelectMenu[InterfaceType] = SelectMenu(frame, options=interfaces)
-nic_menu.grid(column=1, row=0, sticky="ew")
+nic_picker: SearchPicker[AdapterSnapshot] = SearchPicker(
+    frame,
+    label=lambda nic: f"{nic.Index:>4}  {nic.Description}  {', '.join(nic.IPAddress)}",
+    search_text=lambda nic: (
+        f"{nic.Index} {nic.Description} {nic.MACAddress or ''} {' '.join(nic.IPAddress)}"
+    ),
+    placeholder="Search by name, MAC, IP or index",
+    height=8,
+)
+nic_picker.search.config(state="disabled")
+nic_picker.grid(column=1, row=0, sticky="ew")
 ipaddress = PlaceholderEntry(frame, placeholder="IP Address")
 ipaddress.grid(column=0, row=1, sticky="ew")
+profile_name = PlaceholderCombobox(frame, placeholder="Profile name")
+profile_name.grid(column=0, row=2, sticky="ew")
+status = ttk.Label(frame, text="Loading adapters...")
+status.grid(column=0, row=4, columnspan=2, sticky="w")
+status_table = DiffTable(
+    frame,
+    columns={
+        "index": "Index",
+        "description": "Adapter",
+        "dhcp": "DHCP",
+        "addresses": "Addresses",
+        "gateways": "Gateways",
+        "dns": "DNS servers",
+        "lease": "Lease expires",
+    },
+    height=8,
+)
+status_table.grid(column=0, row=5, columnspan=2, sticky="nsew")
+status_interval = tk.IntVar(value=STATUS_INTERVAL)
+status_options = ttk.Frame(frame)
+status_options.grid(column=0, row=6, columnspan=2, sticky="w")
+ttk.Label(status_options, text="Refresh every (s): ").pack(side="left")
+ttk.Spinbox(status_options, from_=1, to=300, width=5, textvariable=status_interval).pack(
+    side="left"
+)
+# the cache version the status table is up to date with
+status_version = 0
+# fed with the adapters changed in the cache, by update_status
+lease_tracker = LeaseTracker(
+    backend,
+    on_warn=lambda nic, expires: worker.post(lease_expiring, (nic, expires)),
+    on_renew=lambda nic, code: worker.post(lease_renewed, (nic, code)),
+)
+lease_tracker.start()
+
+
+# Probing, DNS and route timing pull in asyncio, which takes longer to import than everything
+# else the window needs, so those modules are only imported once the features are used.
+@lru_cache(maxsize=None)
+def get_prober() -> Prober:
+    from probing import default_prober
+    return default_prober()
+
+
+@lru_cache(maxsize=None)
+def get_scan_cache() -> ScanCache:
+    from probing import ScanCache
+    return ScanCache()
+
+
+def invalidate_scans() -> None:
+    # nothing could've been scanned before the probing module was imported
+    if "probing" in sys.modules:
+        get_scan_cache().invalidate()
+
+
+def interfaces_loaded(result: list[AdapterSnapshot] | Exception) -> None:
+    if isinstance(result, Exception):
+        status.config(text=f"Failed to load the adapters: {result!r}")
+        return
+    # keyed by SettingID, since the descriptions of virtual adapters often repeat
+    nic_picker.set_options({nic.SettingID: nic for nic in sorted(result, key=lambda n: n.Index)})
+    nic_picker.search.config(state="normal")
+    status.config(text='')
+    update_status()
+    root.after(status_delay(), refresh_status)
+    # keep the list up to date from now on
+    AdapterWatcher(
+        WMIEventSource(backend),
+        cache,
+        lambda updated, removed: worker.post(adapters_changed, (updated, removed)),
+    ).start()
+
+
+def adapters_changed(change: tuple[list[AdapterSnapshot], list[AdapterSnapshot]]) -> None:
+    updated, removed = change
+    nic_picker.update_options(
+        {nic.SettingID: nic for nic in updated}, [nic.SettingID for nic in removed]
+    )
+    update_status()
+
+
+def format_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+
+def format_lease(value: str | None) -> str:
+    if not value or (timestamp := parse_cim_datetime(value)) is None:
+        return ''
+    return format_time(timestamp)
+
+
+def status_row(nic: AdapterSnapshot) -> tuple[str, ...]:
+    return (
+        str(nic.Index),
+        nic.Description,
+        "yes" if nic.DHCPEnabled else "no",
+        ', '.join(
+            f"{address}/{subnet}" for address, subnet in zip(nic.IPAddress, nic.IPSubnet)
+        ),
+        ', '.join(nic.DefaultIPGateway),
+        ', '.join(nic.DNSServerSearchOrder),
+        format_lease(nic.DHCPLeaseExpires) if nic.DHCPEnabled else '',
+    )
+
+
+def update_status() -> None:
+    # only the adapters that changed since the last update are redrawn,
+    # so this costs the same no matter how many adapters there are
+    global status_version
+    status_version, changed, removed = cache.changes_since(status_version)
+    status_table.update_rows({nic.SettingID: status_row(nic) for nic in changed}, removed)
+    for nic in changed:
+        lease_tracker.track(nic)
+    for setting_id in removed:
+        lease_tracker.untrack(setting_id)
+
+
+def status_delay() -> int:
+    try:
+        return max(status_interval.get(), 1) * 1000
+    except tk.TclError:
+        # the spinbox holds something that isn't a number
+        return STATUS_INTERVAL * 1000
+
+
+def refresh_status() -> None:
+    # re-enumerates once the cache expires, and fetches adapters invalidated by applies
+    def done(result: object) -> None:
+        update_status()
+        root.after(status_delay(), refresh_status)
+
+    worker.submit(cache.snapshots, done)
+
+
+def poll_worker() -> None:
+    worker.poll()
+    apply_worker.poll()
+    root.after(POLL_INTERVAL, poll_worker)
+
+
+def apply_progress(
+    nic: AdapterSnapshot, total: int, update: tuple[int, MethodCall, int]
+) -> None:
+    step, call, return_code = update
+    status.config(
+        text=f"{nic.Description}: step {step + 1}/{total} {call.method} -> {return_code}"
+    )
+
+
+def apply_done(nic: AdapterSnapshot, result: list[int] | Exception) -> None:
+    cache.invalidate(nic.SettingID)
+    # the addresses in use have likely changed
+    invalidate_scans()
+    if isinstance(result, Exception):
+        status.config(text=f"{nic.Description}: failed with {result!r}")
+    elif not succeeded(result):
+        status.config(text=f"{nic.Description}: failed with {describe_return_code(result[-1])}")
+    else:
+        status.config(text=f"{nic.Description}: done")
+
+
+def job_started(task_id: int) -> None:
+    if task_id in queued_jobs:
+        queued_jobs.remove(task_id)
 
 
 def ipset():
-    nic = nic_menu.get()
+    nic = nic_picker.get()
     if nic is None:
         return
-    ipmask = ipaddress.get()
-    if (match := IP_PATTERN.match(ipmask)) is None:
+    if (network := parse_cidr(ipaddress.get())) is None or network.version != 4:
         return
-    ip = match.group(1)
-    raw_mask = match.group(2)
-    if raw_mask is None:
-        raw_mask = 24
-    subnetmask = get_mask(int(raw_mask))
-    gateway = "192.168.0.1"
-    print(ip, subnetmask, gateway)
-    nic.EnableStatic(IPAddress=[ip], SubnetMask=[subnetmask])
-    nic.SetGateways(DefaultIPGateway=[gateway])
-    # nic.EnableDHCP()
+    desired = DesiredConfig(addresses=(network.address,), subnets=(network.mask,))
+    # desired = DesiredConfig(dhcp=True)
+    apply_desired(nic, desired, network)
+
+
+def apply_desired(
+    nic: AdapterSnapshot, desired: DesiredConfig, network: Network | None = None
+) -> None:
+    """
+    Plan and confirm the changes. If a network is passed and the desired configuration
+    doesn't specify a gateway, it's inferred from the network first.
+    """
+    saved = [p.gateway for p in profiles.profiles(nic.SettingID) if p.gateway]
+
+    def plan() -> tuple[DesiredConfig, list[MethodCall], list[str]]:
+        import asyncio
+        from probing import check_conflict, infer_gateway
+        prober = get_prober()
+        # planning needs the current adapter state, which may need to be fetched first
+        current = cache.get(nic.SettingID) or nic
+        final = desired
+        warnings: list[str] = []
+        if network is not None and desired.gateways is None and not desired.dhcp:
+            gateway, reachable = infer_gateway(
+                network, current.DefaultIPGateway, saved, prober=prober
+            )
+            if gateway is not None:
+                final = desired._replace(gateways=(gateway,))
+                if not reachable:
+                    warnings.append(f"{gateway} didn't respond, it's only the likeliest gateway.")
+        calls = plan_changes(current, final)
+        # make sure nothing else is using the new addresses, before taking them over
+        if any(call.method == "EnableStatic" for call in calls):
+            for address in final.addresses:
+                if address not in current.IPAddress and asyncio.run(
+                    check_conflict(address, prober)
+                ):
+                    warnings.append(f"{address} is already in use by another host!")
+        return (final, calls, warnings)
+
+    worker.submit(plan, partial(confirm_plan, nic))
+
+
+def confirm_plan(
+    nic: AdapterSnapshot,
+    result: tuple[DesiredConfig, list[MethodCall], list[str]] | Exception,
+) -> None:
+    if isinstance(result, Exception):
+        status.config(text=f"{nic.Description}: planning failed with {result!r}")
+        return
+    final, calls, warnings = result
+    if not calls:
+        status.config(text=f"{nic.Description}: already configured, nothing to do")
+        return
+    plan = '\n'.join(f"{step}. {call}" for step, call in enumerate(calls, start=1))
+    message = f"{nic.Description} will be reconfigured with:\n\n{plan}"
+    if warnings:
+        message = '\n'.join(warnings) + f"\n\n{message}"
+    if not messagebox.askokcancel(
+        "Apply changes?", message, icon="warning" if warnings else "question", parent=root
+    ):
+        return
+
+    def job() -> list[int]:
+        # applies queued before this one may have changed the adapter since the plan was shown,
+        # so it's planned again against its state right before applying
+        cache.invalidate(nic.SettingID)
+        current = cache.get(nic.SettingID) or nic
+        calls = plan_changes(current, final)
+        progress = partial(apply_progress, nic, len(calls))
+        # the journal records the snapshot the calls were planned against as the state before
+        return run_journaled(
+            journal, backend, current, calls, lambda *update: apply_worker.post(progress, update)
+        )
+
+    # job_started runs through poll on this thread, so it can't run before the append
+    queued_jobs.append(apply_worker.submit(job, partial(apply_done, nic), job_started))
+    status.config(text=f"{nic.Description}: queued ({apply_worker.pending} waiting)")
 
 
-ttk.Button(frame, text="Set", command=ipset).grid(column=1, row=1)
+def find_free():
+    from probing import MAX_SCAN_PREFIX, find_free_addresses
+    nic = nic_picker.get()
+    if (network := parse_cidr(ipaddress.get())) is None or network.version != 4:
+        status.config(text="Enter the network to search in, like 192.168.1.0/24")
+        return
+    if network.prefix < MAX_SCAN_PREFIX:
+        status.config(text=f"Only networks up to a /{MAX_SCAN_PREFIX} can be searched")
+        return
+    status.config(text=f"Searching {network} for a free address...")
+    exclude = () if nic is None else nic.IPAddress
+    worker.submit(
+        lambda: find_free_addresses(
+            network, exclude=exclude, prober=get_prober(), cache=get_scan_cache()
+        ),
+        partial(free_found, network),
+    )
+
+
+def free_found(network: Network, result: list[str] | Exception) -> None:
+    if isinstance(result, Exception):
+        status.config(text=f"Searching {network} failed with {result!r}")
+    elif not result:
+        status.config(text=f"No free addresses found in {network}")
+    else:
+        ipaddress.replace(f"{result[0]}/{network.prefix}")
+        status.config(text=f"{result[0]} is free")
+
+
+def list_profiles():
+    # called right before the dropdown opens, so it always matches the selected adapter
+    nic = nic_picker.get()
+    profile_name.config(values=[] if nic is None else profiles.names(nic.SettingID))
+
+
+def save_profile():
+    nic = nic_picker.get()
+    if nic is None or not (name := profile_name.get()):
+        return
+    if (address := ipaddress.get()) and parse_ipmask(address) is None:
+        status.config(text=f"Invalid address: {address}")
+        return
+    profiles.save(Profile.capture(name, nic, address))
+    status.config(text=f"{nic.Description}: saved profile {name!r}")
+
+
+def apply_profile():
+    nic = nic_picker.get()
+    if nic is None or not (name := profile_name.get()):
+        return
+    if (profile := profiles.get(nic.SettingID, name)) is None:
+        status.config(text=f"{nic.Description}: no profile named {name!r}")
+        return
+    try:
+        desired = profile.desired()
+    except ValueError as exc:
+        status.config(text=str(exc))
+        return
+    ipaddress.replace(profile.address)
+    apply_desired(nic, desired, parse_cidr(profile.address) if profile.address else None)
+
+
+def show_timings():
+    assert isinstance(backend, InstrumentedBackend)
+    recorder = backend.recorder
+    panel = tk.Toplevel(root)
+    panel.title("WMI timings")
+    columns = ("count", "errors", "mean", "p95", "max", "codes")
+    tree = ttk.Treeview(panel, columns=columns)
+    tree.heading("#0", text="Operation")
+    for column in columns:
+        tree.heading(column, text=column.capitalize())
+        tree.column(column, width=70, anchor="e")
+    tree.column("codes", width=120, anchor="w")
+    tree.pack(expand=True, fill="both")
+
+    def row(stats: dict) -> tuple:
+        def ms(value: float | None) -> str:
+            return '-' if value is None else f"{value * 1000:.1f} ms"
+
+        codes = ", ".join(f"{code}: {count}" for code, count in stats["return_codes"].items())
+        return (
+            stats["count"], stats["errors"], ms(stats["mean"]), ms(stats["p95"]),
+            ms(stats["max"]), codes,
+        )
+
+    def refresh():
+        tree.delete(*tree.get_children())
+        report = recorder.report()
+        for operation, stats in report["operations"].items():
+            parent = tree.insert('', "end", text=operation, values=row(stats))
+            # break the method calls down per adapter
+            for setting_id, methods in report["adapters"].items():
+                if operation in methods:
+                    tree.insert(parent, "end", text=setting_id, values=row(methods[operation]))
+
+    def export():
+        path = filedialog.asksaveasfilename(
+            parent=panel, defaultextension=".json", filetypes=[("JSON", "*.json")]
+        )
+        if path:
+            recorder.export(path)
+
+    buttons = ttk.Frame(panel)
+    buttons.pack(fill="x")
+    ttk.Button(buttons, text="Refresh", command=refresh).pack(side="left")
+    ttk.Button(buttons, text="Clear", command=lambda: (recorder.clear(), refresh())).pack(
+        side="left"
+    )
+    ttk.Button(buttons, text="Export JSON", command=export).pack(side="left")
+    refresh()
+
+
+def selected_adapters() -> list[AdapterSnapshot]:
+    # the rows selected in the status table, or the adapter picked above it.
+    # cached() never calls into WMI, so it's safe to use from the GUI thread
+    cached = {nic.SettingID: nic for nic in cache.cached()}
+    nics = [cached[key] for key in status_table.selection() if key in cached]
+    if not nics and (nic := nic_picker.get()) is not None:
+        nics.append(nic)
+    return nics
+
+
+def dhcp_lease(operation: str):
+    if not (nics := selected_adapters()):
+        return
+    done: list[str] = []
+
+    def progress(update: tuple[AdapterSnapshot, int]) -> None:
+        nic, return_code = update
+        done.append(nic.SettingID)
+        status.config(
+            text=f"{nic.Description}: {operation} -> {describe_return_code(return_code)}"
+            f" ({len(done)}/{len(nics)})"
+        )
+
+    def job() -> dict[str, list[int] | Exception]:
+        return dhcp_many(
+            backend,
+            nics,
+            operation,
+            progress=lambda nic, step, call, code: apply_worker.post(progress, (nic, code)),
+            journal=journal,
+        )
+
+    apply_worker.submit(job, partial(dhcp_done, operation, nics))
+    status.config(text=f"Running {operation} on {len(nics)} adapter(s)...")
+
+
+def dhcp_done(
+    operation: str,
+    nics: list[AdapterSnapshot],
+    result: dict[str, list[int] | Exception] | Exception,
+) -> None:
+    if isinstance(result, Exception):
+        status.config(text=f"{operation.capitalize()} failed with {result!r}")
+        return
+    failed = 0
+    for nic in nics:
+        cache.invalidate(nic.SettingID)
+        outcome = result[nic.SettingID]
+        if isinstance(outcome, Exception) or not succeeded(outcome):
+            failed += 1
+    invalidate_scans()
+    if failed:
+        status.config(text=f"{operation.capitalize()}: {failed} of {len(nics)} adapter(s) failed")
+    else:
+        status.config(text=f"{operation.capitalize()}: done for {len(nics)} adapter(s)")
+
+
+def show_dns():
+    if (nic := nic_picker.get()) is None:
+        return
+    panel = tk.Toplevel(root)
+    panel.title(f"DNS servers of {nic.Description}")
+    servers = PlaceholderEntry(panel, placeholder="Candidate servers, separated by spaces")
+    servers.replace(' '.join(nic.DNSServerSearchOrder))
+    servers.pack(fill="x")
+    columns = {"median": "Median", "p95": "95th percentile", "lost": "Lost"}
+    results = DiffTable(panel, columns={"server": "Server", **columns}, height=6)
+    results.pack(expand=True, fill="both")
+    ranked: list[str] = []
+
+    def ms(value: float | None) -> str:
+        return "no response" if value is None else f"{value * 1000:.1f} ms"
+
+    def timed(result: list[ServerTimings] | Exception) -> None:
+        if isinstance(result, Exception):
+            status.config(text=f"Timing the DNS servers failed with {result!r}")
+            return
+        results.update_rows({}, list(results.get_children()))
+        results.update_rows(
+            {t.server: (t.server, ms(t.median), ms(t.p95), str(t.lost)) for t in result}
+        )
+        ranked[:] = [t.server for t in result]
+        apply_button.config(state="normal")
+        status.config(text=f"Fastest DNS server: {ranked[0]}" if ranked else '')
+
+    def benchmark():
+        if not (candidates := servers.get().replace(',', ' ').split()):
+            return
+        apply_button.config(state="disabled")
+        status.config(text=f"Timing {len(candidates)} DNS server(s)...")
+        from resolvers import rank_servers
+        worker.submit(lambda: rank_servers(candidates), timed)
+
+    def apply():
+        # the cache may hold a newer snapshot, but fetching one would block the GUI
+        current = next((n for n in cache.cached() if n.SettingID == nic.SettingID), nic)
+        apply_desired(current, dns_only(current, tuple(ranked)))
+
+    buttons = ttk.Frame(panel)
+    buttons.pack(fill="x")
+    ttk.Button(buttons, text="Benchmark", command=benchmark).pack(side="left")
+    apply_button = ttk.Button(
+        buttons, text="Apply fastest first", command=apply, state="disabled"
+    )
+    apply_button.pack(side="left")
+
+
+def optimize_routes(scheduled: bool = False):
+    def plan() -> dict[AdapterSnapshot, list[MethodCall]]:
+        from routing import plan_metrics, rank_adapters
+        cache.invalidate()
+        ranked = rank_adapters(cache.snapshots(), get_prober())
+        return plan_metrics([nic for nic, _ in ranked])
+
+    status.config(text="Timing the default routes...")
+    worker.submit(plan, partial(confirm_metrics, scheduled))
+
+
+def confirm_metrics(
+    scheduled: bool, result: dict[AdapterSnapshot, list[MethodCall]] | Exception
+) -> None:
+    if isinstance(result, Exception):
+        status.config(text=f"Timing the routes failed with {result!r}")
+        return
+    if not result:
+        status.config(text="The fastest routes are already preferred")
+        return
+    # the scheduled re-evaluations were opted into, so they don't ask every time
+    if not scheduled:
+        plan = '\n'.join(
+            f"{nic.Description}: {', '.join(str(call) for call in calls)}"
+            for nic, calls in result.items()
+        )
+        if not messagebox.askokcancel(
+            "Apply changes?", f"Prefer the faster routes with:\n\n{plan}", parent=root
+        ):
+            status.config(text='')
+            return
+    apply_worker.submit(
+        lambda: apply_many(backend, result, journal=journal), partial(metrics_done, list(result))
+    )
+
+
+def metrics_done(
+    nics: list[AdapterSnapshot], result: dict[str, list[int] | Exception] | Exception
+) -> None:
+    for nic in nics:
+        cache.invalidate(nic.SettingID)
+    if isinstance(result, Exception):
+        status.config(text=f"Changing the metrics failed with {result!r}")
+    elif all(not isinstance(r, Exception) and succeeded(r) for r in result.values()):
+        status.config(text=f"Changed the metrics of {len(nics)} adapter(s)")
+    else:
+        status.config(text="Changing the metrics failed for some adapters")
+
+
+def reevaluate_routes():
+    if auto_optimize.get():
+        optimize_routes(scheduled=True)
+    root.after(OPTIMIZE_INTERVAL, reevaluate_routes)
+
+
+def lease_expiring(update: tuple[AdapterSnapshot, float]) -> None:
+    nic, expires = update
+    status.config(text=f"{nic.Description}: the DHCP lease expires at {format_time(expires)}")
+
+
+def lease_renewed(update: tuple[AdapterSnapshot, int]) -> None:
+    nic, return_code = update
+    cache.invalidate(nic.SettingID)
+    if succeeded([return_code]):
+        status.config(text=f"{nic.Description}: renewed the DHCP lease ahead of its expiry")
+    else:
+        status.config(
+            text=f"{nic.Description}: renewing the DHCP lease failed with"
+            f" {describe_return_code(return_code)}"
+        )
+
+
+def export_all():
+    path = filedialog.asksaveasfilename(
+        parent=root, defaultextension=".jsonl", filetypes=[("JSON lines", "*.jsonl")]
+    )
+    if not path:
+        return
+
+    def export() -> int:
+        from baseline import export_configs
+        with open(path, 'w', encoding="utf8") as file:
+            return export_configs(backend, file)
+
+    def exported(result: int | Exception) -> None:
+        if isinstance(result, Exception):
+            status.config(text=f"Exporting failed with {result!r}")
+        else:
+            status.config(text=f"Exported {result} adapter(s)")
+
+    worker.submit(export, exported)
+
+
+def import_all():
+    path = filedialog.askopenfilename(
+        parent=root, filetypes=[("JSON lines", "*.jsonl"), ("All files", "*")]
+    )
+    if not path:
+        return
+
+    def count(dry_run: bool) -> tuple[int, int, list[str]]:
+        from baseline import import_configs
+        # only the counts and the first few errors are kept, the file can be large
+        changed = failed = 0
+        errors: list[str] = []
+        with open(path, encoding="utf8") as file:
+            for result in import_configs(
+                backend, file, dry_run=dry_run, journal=journal
+            ):
+                if result.error is not None or not succeeded(result.return_codes or []):
+                    failed += 1
+                    if len(errors) < 5:
+                        errors.append(f"line {result.line}: {result.error or result.return_codes}")
+                elif result.calls:
+                    changed += 1
+        return (changed, failed, errors)
+
+    def planned(result: tuple[int, int, list[str]] | Exception) -> None:
+        if isinstance(result, Exception):
+            status.config(text=f"Reading {path} failed with {result!r}")
+            return
+        changed, failed, errors = result
+        if not changed:
+            status.config(text=f"Nothing to change, {failed} invalid line(s)")
+            return
+        message = f"{changed} adapter(s) will be reconfigured."
+        if failed:
+            message += f"\n\n{failed} line(s) will be skipped:\n" + '\n'.join(errors)
+        if not messagebox.askokcancel("Import configurations?", message, parent=root):
+            return
+        apply_worker.submit(partial(count, False), imported)
+        status.config(text=f"Importing {changed} adapter(s)...")
+
+    def imported(result: tuple[int, int, list[str]] | Exception) -> None:
+        cache.invalidate()
+        if isinstance(result, Exception):
+            status.config(text=f"Importing failed with {result!r}")
+        else:
+            changed, failed, _ = result
+            status.config(text=f"Imported: {changed} reconfigured, {failed} failed")
+
+    worker.submit(partial(count, True), planned)
+
+
+def undo_last():
+    nic = nic_picker.get()
+    if nic is None:
+        return
+
+    def plan() -> tuple[AdapterSnapshot, list[MethodCall], int] | None:
+        if (entry := journal.undoable(nic.SettingID)) is None:
+            return None
+        cache.invalidate(nic.SettingID)
+        current = cache.get(nic.SettingID) or nic
+        return (current, plan_undo(entry, current), entry.number)
+
+    def confirm(result: tuple[AdapterSnapshot, list[MethodCall], int] | None | Exception) -> None:
+        if isinstance(result, Exception):
+            status.config(text=f"{nic.Description}: planning the undo failed with {result!r}")
+            return
+        if result is None:
+            status.config(text=f"{nic.Description}: no changes left to undo")
+            return
+        current, calls, number = result
+        if not calls:
+            status.config(text=f"{nic.Description}: the change was already reverted")
+            return
+        plan = '\n'.join(f"{step}. {call}" for step, call in enumerate(calls, start=1))
+        if not messagebox.askokcancel(
+            "Undo the last change?",
+            f"{nic.Description} will be reverted with:\n\n{plan}",
+            parent=root,
+        ):
+            return
+        apply_worker.submit(
+            lambda: run_journaled(journal, backend, current, calls, kind="undo", undoes=number),
+            partial(apply_done, current),
+        )
+        status.config(text=f"{nic.Description}: undoing...")
+
+    worker.submit(plan, confirm)
+
+
+def cancel_queued():
+    # cancel the most recently queued job that hasn't started yet
+    while queued_jobs:
+        if apply_worker.cancel(queued_jobs.pop()):
+            status.config(text=f"Cancelled, {apply_worker.pending} still waiting")
+            return
+
+
+set_buttons = ttk.Frame(frame)
+set_buttons.grid(column=1, row=1, sticky="ew")
+ttk.Button(set_buttons, text="Set", command=ipset).pack(side="left")
+ttk.Button(set_buttons, text="Find free", command=find_free).pack(side="left")
+ttk.Button(set_buttons, text="DNS...", command=show_dns).pack(side="left")
+profile_name.config(postcommand=list_profiles)
+profile_buttons = ttk.Frame(frame)
+profile_buttons.grid(column=1, row=2, sticky="ew")
+ttk.Button(profile_buttons, text="Save", command=save_profile).pack(side="left")
+ttk.Button(profile_buttons, text="Apply", command=apply_profile).pack(side="left")
+cancel_buttons = ttk.Frame(frame)
+cancel_buttons.grid(column=1, row=3)
+ttk.Button(cancel_buttons, text="Cancel queued", command=cancel_queued).pack(side="left")
+ttk.Button(cancel_buttons, text="Undo", command=undo_last).pack(side="left")
+adapter_buttons = ttk.Frame(frame)
+adapter_buttons.grid(column=0, row=7, columnspan=2, sticky="w")
+ttk.Button(adapter_buttons, text="Renew", command=partial(dhcp_lease, "renew")).pack(side="left")
+ttk.Button(adapter_buttons, text="Release", command=partial(dhcp_lease, "release")).pack(
+    side="left"
+)
+ttk.Button(adapter_buttons, text="Prefer fastest routes", command=optimize_routes).pack(
+    side="left"
+)
+ttk.Button(adapter_buttons, text="Export all...", command=export_all).pack(side="left")
+ttk.Button(adapter_buttons, text="Import...", command=import_all).pack(side="left")
+auto_optimize = tk.BooleanVar(value=False)
+ttk.Checkbutton(
+    adapter_buttons,
+    text=f"Re-evaluate every {OPTIMIZE_INTERVAL // 60000} minutes",
+    variable=auto_optimize,
+).pack(side="left")
+auto_renew = tk.BooleanVar(value=False)
+ttk.Checkbutton(
+    adapter_buttons,
+    text="Renew leases before they expire",
+    variable=auto_renew,
+    command=lambda: lease_tracker.set_renew(auto_renew.get()),
+).pack(side="left")
+root.after(OPTIMIZE_INTERVAL, reevaluate_routes)
+if isinstance(backend, InstrumentedBackend):
+    ttk.Button(frame, text="Timings", command=show_timings).grid(column=0, row=3, sticky="w")
+# Connecting to WMI and gathering the interfaces can take a while - do it in the background
+worker.submit(cache.snapshots, interfaces_loaded)
+root.after(POLL_INTERVAL, poll_worker)
 root.mainloop()
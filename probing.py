@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import sys
+import time
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Sequence
+
+from addressing import Network, int_to_ipv4, parse_cidr
+
+
+class ProbeTimeout(Exception):
+    """
+    Raised by probers that couldn't tell whether the host is up within the timeout,
+    as opposed to the host not responding.
+    """
+
+
+class Prober:
+    """
+    Base class for checking whether a host is reachable.
+    """
+
+    async def probe(self, address: str, timeout: float) -> float | None:
+        """
+        Return the round trip time in seconds, or `None` if the host didn't respond in time.
+        Raises `ProbeTimeout` if it couldn't tell.
+        """
+        raise NotImplementedError
+
+
+class TCPProber(Prober):
+    """
+    Probes hosts by opening TCP connections to a few ports commonly open on gateways.
+    Both an accepted and a refused connection mean the host is up, so this works
+    without the raw sockets ICMP would need, and thus without administrator rights.
+    With a `local_address`, connections are made from it, which on Windows also means
+    through the adapter that has it.
+    """
+
+    def __init__(self, ports: Sequence[int] = (53, 80, 443), local_address: str | None = None):
+        self.ports: Sequence[int] = ports
+        self.local_address: str | None = local_address
+
+    async def _connect(self, address: str, port: int) -> None:
+        local_addr = None if self.local_address is None else (self.local_address, 0)
+        try:
+            _, writer = await asyncio.open_connection(address, port, local_addr=local_addr)
+        except ConnectionRefusedError:
+            # the host responded with a reset
+            return
+        writer.close()
+
+    async def probe(self, address: str, timeout: float) -> float | None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = [asyncio.create_task(self._connect(address, port)) for port in self.ports]
+        try:
+            for attempt in asyncio.as_completed(tasks, timeout=timeout):
+                try:
+                    await attempt
+                except OSError:
+                    # unreachable or no route, which may differ between the ports
+                    continue
+                return loop.time() - start
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+        return None
+
+
+class ARPProber(Prober):
+    """
+    Probes hosts on the local network with ARP requests, through `SendARP` (Windows only).
+    Unlike with TCP, every host has to answer these, even one with a firewall dropping
+    everything else, which makes this the reliable way to detect address conflicts.
+    `SendARP` blocks, so requests are made from a pool of up to `workers` threads,
+    which should be at least as many as the probes kept in flight at once. The timeout
+    only starts once a request is actually sent, and a request still waiting for its answer
+    when it runs out raises `ProbeTimeout`, since `SendARP` retries on its own.
+    """
+
+    def __init__(self, workers: int = 64):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="arp")
+
+    @staticmethod
+    def _send_arp(address: str) -> bool:
+        import ctypes
+        destination = int.from_bytes(socket.inet_aton(address), sys.byteorder)
+        mac = (ctypes.c_ulong * 2)()
+        length = ctypes.c_ulong(6)
+        result = ctypes.windll.iphlpapi.SendARP(  # type: ignore[attr-defined]
+            destination, 0, mac, ctypes.byref(length)
+        )
+        return result == 0 and length.value > 0
+
+    async def probe(self, address: str, timeout: float) -> float | None:
+        loop = asyncio.get_running_loop()
+        started: asyncio.Future[None] = loop.create_future()
+
+        def mark_started() -> None:
+            if not started.done():
+                started.set_result(None)
+
+        def send() -> tuple[bool, float]:
+            loop.call_soon_threadsafe(mark_started)
+            start = time.perf_counter()
+            answered = self._send_arp(address)
+            return (answered, time.perf_counter() - start)
+
+        request = loop.run_in_executor(self._pool, send)
+        try:
+            # waiting for a free thread doesn't count towards the timeout
+            await started
+            answered, rtt = await asyncio.wait_for(request, timeout)
+        except asyncio.TimeoutError:
+            raise ProbeTimeout(address)
+        finally:
+            request.cancel()
+        return rtt if answered else None
+
+
+class AnyProber(Prober):
+    """
+    Combines several probers - a host is reachable if any of them gets a response.
+    """
+
+    def __init__(self, *probers: Prober):
+        self.probers: tuple[Prober, ...] = probers
+
+    async def probe(self, address: str, timeout: float) -> float | None:
+        tasks = [asyncio.create_task(p.probe(address, timeout)) for p in self.probers]
+        timed_out = False
+        try:
+            for result in asyncio.as_completed(tasks):
+                try:
+                    rtt = await result
+                except ProbeTimeout:
+                    timed_out = True
+                    continue
+                if rtt is not None:
+                    return rtt
+        finally:
+            for task in tasks:
+                task.cancel()
+        if timed_out:
+            raise ProbeTimeout(address)
+        return None
+
+
+def default_prober() -> Prober:
+    """
+    ARP and TCP together on Windows, and just TCP everywhere else.
+    """
+    if sys.platform == "win32":
+        return AnyProber(ARPProber(), TCPProber())
+    return TCPProber()
+
+
+class FakeProber(Prober):
+    """
+    Stand-in for the network, with a fixed set of reachable hosts and their round trip times.
+    Everything else stays silent until the timeout.
+    """
+
+    def __init__(self, hosts: dict[str, float]):
+        self.hosts: dict[str, float] = hosts
+        self.probed: list[str] = []
+
+    async def probe(self, address: str, timeout: float) -> float | None:
+        self.probed.append(address)
+        rtt = self.hosts.get(address)
+        if rtt is None or rtt > timeout:
+            await asyncio.sleep(timeout)
+            return None
+        await asyncio.sleep(rtt)
+        return rtt
+
+
+def gateway_candidates(
+    network: Network, current: Iterable[str] = (), saved: Iterable[str] = ()
+) -> list[str]:
+    """
+    List the likely gateways of the network the address is in, most likely first:
+    the adapter's current gateways, gateways saved in profiles, and then the conventional
+    first and last host addresses (.1 and .254 for a /24). Only IPv4 is supported,
+    and gateways outside of the network, or equal to the address itself, are skipped.
+    """
+    if network.version != 4 or network.prefix > 30:
+        return []
+    candidates: list[str] = []
+    for gateway in (*current, *saved):
+        parsed = parse_cidr(gateway, default_prefix=network.prefix)
+        if (
+            parsed is not None
+            and parsed.version == 4
+            and parsed.network_value == network.network_value
+        ):
+            candidates.append(parsed.address)
+    candidates.append(int_to_ipv4(network.network_value + 1))
+    candidates.append(int_to_ipv4(network.broadcast_value - 1))
+    # remove duplicates while keeping the order
+    return [c for c in dict.fromkeys(candidates) if c != network.address]
+
+
+async def first_reachable(
+    candidates: Sequence[str], prober: Prober, deadline: float
+) -> str | None:
+    """
+    Probe all candidates concurrently, and return the first one to respond.
+    Gives up and returns `None` once `deadline` seconds have passed.
+    """
+    async def probe(address: str) -> tuple[str, float | None]:
+        try:
+            return (address, await prober.probe(address, deadline))
+        except ProbeTimeout:
+            return (address, None)
+
+    tasks = [asyncio.create_task(probe(address)) for address in candidates]
+    try:
+        for result in asyncio.as_completed(tasks, timeout=deadline):
+            address, rtt = await result
+            if rtt is not None:
+                return address
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+    return None
+
+
+def infer_gateway(
+    network: Network,
+    current: Iterable[str] = (),
+    saved: Iterable[str] = (),
+    *,
+    prober: Prober | None = None,
+    deadline: float = 1.0,
+) -> tuple[str | None, bool]:
+    """
+    Pick a gateway for the network. Returns the gateway and whether it responded to a probe.
+    When none of the candidates respond in time, which is expected when moving the adapter
+    to a network it isn't connected to yet, the most likely candidate is returned instead.
+    """
+    candidates = gateway_candidates(network, current, saved)
+    if not candidates:
+        return (None, False)
+    if prober is None:
+        prober = default_prober()
+    if (gateway := asyncio.run(first_reachable(candidates, prober, deadline))) is not None:
+        return (gateway, True)
+    return (candidates[0], False)
+
+
+# The largest network `scan` is willing to go through, to keep it from taking minutes
+MAX_SCAN_PREFIX = 22
+
+
+class ScanCache:
+    """
+    Remembers which addresses of a network were found in use, for `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl: float = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[int, int], tuple[float, frozenset[str]]] = {}
+
+    def get(self, network: Network) -> frozenset[str] | None:
+        key = (network.network_value, network.prefix)
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, network: Network, used: frozenset[str]) -> None:
+        with self._lock:
+            self._entries[(network.network_value, network.prefix)] = (time.monotonic(), used)
+
+    def invalidate(self, network: Network | None = None) -> None:
+        with self._lock:
+            if network is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((network.network_value, network.prefix), None)
+
+
+def host_addresses(network: Network) -> list[str]:
+    """
+    All usable host addresses of an IPv4 network.
+    """
+    if network.prefix >= 31:
+        # point-to-point networks have no network and broadcast addresses
+        first, last = network.network_value, network.broadcast_value
+    else:
+        first, last = network.network_value + 1, network.broadcast_value - 1
+    return [int_to_ipv4(value) for value in range(first, last + 1)]
+
+
+async def check_conflict(address: str, prober: Prober, timeout: float = 1.0) -> bool:
+    """
+    Return `True` if something already responds on the address,
+    or if the prober couldn't tell in time, so that the address isn't taken blindly.
+    """
+    try:
+        return await prober.probe(address, timeout) is not None
+    except ProbeTimeout:
+        return True
+
+
+async def scan(
+    network: Network, prober: Prober, *, concurrency: int = 64, timeout: float = 0.5
+) -> frozenset[str]:
+    """
+    Probe every host address of the network, with at most `concurrency` probes in flight,
+    and return the addresses that responded, along with the ones the prober couldn't tell
+    about in time - those aren't known to be free. Refuses networks larger than a /22.
+    """
+    if network.version != 4:
+        raise ValueError("Only IPv4 networks can be scanned")
+    if network.prefix < MAX_SCAN_PREFIX:
+        raise ValueError(f"Refusing to scan a network larger than a /{MAX_SCAN_PREFIX}")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(address: str) -> str | None:
+        async with semaphore:
+            try:
+                return address if await prober.probe(address, timeout) is not None else None
+            except ProbeTimeout:
+                return address
+
+    results = await asyncio.gather(*(probe(address) for address in host_addresses(network)))
+    return frozenset(address for address in results if address is not None)
+
+
+def find_free_addresses(
+    network: Network,
+    *,
+    count: int = 1,
+    exclude: Iterable[str] = (),
+    prober: Prober | None = None,
+    cache: ScanCache | None = None,
+    concurrency: int = 64,
+    timeout: float = 0.5,
+) -> list[str]:
+    """
+    Return up to `count` addresses of the network nothing responded on,
+    starting from the entered address and wrapping around. Addresses in `exclude`,
+    as well as the conventional gateway addresses, are never returned.
+    Scan results are taken from, and stored in, the cache if one is passed.
+    """
+    if (used := None if cache is None else cache.get(network)) is None:
+        used = asyncio.run(
+            scan(
+                network,
+                prober or default_prober(),
+                concurrency=concurrency,
+                timeout=timeout,
+            )
+        )
+        if cache is not None:
+            cache.put(network, used)
+    skip = used.union(exclude, gateway_candidates(network))
+    hosts = host_addresses(network)
+    start = max(network.value - network.network_value - 1, 0) % max(len(hosts), 1)
+    free: list[str] = []
+    for address in hosts[start:] + hosts[:start]:
+        if address not in skip:
+            free.append(address)
+            if len(free) >= count:
+                break
+    return free
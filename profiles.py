@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import os
+import json
+from typing import Any, NamedTuple, TYPE_CHECKING
+
+from addressing import parse_cidr
+from apply import DesiredConfig, parse_ipmask
+
+if TYPE_CHECKING:
+    from cache import AdapterSnapshot
+
+
+def default_path() -> str:
+    base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    return os.path.join(base, "IPChanger", "profiles.jsonl")
+
+
+class Profile(NamedTuple):
+    """
+    A named configuration, saved for a single adapter.
+    `address` is in the "address[/prefix]" form accepted by the address entry.
+    """
+    name: str
+    setting_id: str
+    address: str = ''
+    gateway: str = ''
+    dns: tuple[str, ...] = ()
+    metric: int | None = None
+    dhcp: bool = False
+
+    def to_json(self) -> dict[str, Any]:
+        return {**self._asdict(), "dns": list(self.dns)}
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> Profile:
+        # fields saved by other versions are ignored
+        fields = {name: data[name] for name in cls._fields if name in data}
+        return cls(**{**fields, "dns": tuple(data.get("dns", ()))})
+
+    @classmethod
+    def capture(cls, name: str, nic: AdapterSnapshot, address: str = '') -> Profile:
+        """
+        A profile with the given address, or with DHCP without one, keeping the gateway,
+        DNS servers and metric the adapter currently has.
+        The gateway is only kept if it's in the address's network, and is otherwise left empty,
+        to be inferred when the profile is applied. The DNS servers are only kept when both
+        the adapter and the profile are static, since DHCP hands them out along with the lease.
+        """
+        gateway = ''
+        if (network := parse_cidr(address)) is not None and network.version == 4:
+            for candidate in nic.DefaultIPGateway:
+                parsed = parse_cidr(candidate, default_prefix=network.prefix)
+                if (
+                    parsed is not None
+                    and parsed.version == 4
+                    and parsed.network_value == network.network_value
+                ):
+                    gateway = parsed.address
+                    break
+        return cls(
+            name,
+            nic.SettingID,
+            address=address,
+            gateway=gateway,
+            dns=nic.DNSServerSearchOrder if address and not nic.DHCPEnabled else (),
+            metric=nic.IPConnectionMetric,
+            dhcp=not address,
+        )
+
+    def desired(self) -> DesiredConfig:
+        """
+        The configuration to apply, to switch the adapter to this profile.
+        Raises `ValueError` if the profile's address isn't valid.
+        """
+        dns = self.dns or None
+        if self.dhcp:
+            return DesiredConfig(dhcp=True, dns=dns, metric=self.metric)
+        if (parsed := parse_ipmask(self.address)) is None:
+            raise ValueError(f"Invalid address in profile {self.name!r}: {self.address!r}")
+        ip, subnetmask = parsed
+        return DesiredConfig(
+            addresses=(ip,),
+            subnets=(subnetmask,),
+            gateways=(self.gateway,) if self.gateway else None,
+            dns=dns,
+            metric=self.metric,
+        )
+
+
+class ProfileStore:
+    """
+    Profiles saved in an append-only JSON lines file.
+
+    Every save or delete appends a single record, so an interrupted write can at most lose
+    the record being written, which is discarded the next time the file is opened.
+    The file is read once on open, to build an index from the adapter's SettingID
+    and the profile name to the offset of its most recent record.
+    Profiles are only read from the file when requested, so switching between them
+    doesn't depend on how many profiles are stored. `compact` drops the superseded records,
+    and happens automatically on open, once they outnumber the current ones.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path: str = path or default_path()
+        # SettingID -> profile name -> offset of the latest record
+        self._index: dict[str, dict[str, int]] = {}
+        self._garbage: int = 0
+        self._load()
+
+    def _load(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if not os.path.exists(self.path):
+            return
+        good_until = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # a record that was interrupted while being written
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._index_record(record, good_until)
+                good_until += len(line)
+        if good_until < os.path.getsize(self.path):
+            # cut off the damaged tail, so that new records don't get appended to it
+            with open(self.path, "r+b") as file:
+                file.truncate(good_until)
+        if self._garbage > max(100, sum(map(len, self._index.values()))):
+            self.compact()
+
+    def _index_record(self, record: dict[str, Any], offset: int) -> None:
+        names = self._index.setdefault(record["setting_id"], {})
+        if record["name"] in names:
+            self._garbage += 1
+        if record.get("deleted"):
+            names.pop(record["name"], None)
+            self._garbage += 1
+        else:
+            names[record["name"]] = offset
+
+    def _append(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(',', ':')).encode("utf8") + b'\n'
+        with open(self.path, "ab") as file:
+            offset = file.tell()
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+        self._index_record(record, offset)
+
+    def _read(self, offset: int) -> Profile:
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return Profile.from_json(json.loads(file.readline()))
+
+    def names(self, setting_id: str) -> list[str]:
+        return sorted(self._index.get(setting_id, ()))
+
+    def get(self, setting_id: str, name: str) -> Profile | None:
+        if (offset := self._index.get(setting_id, {}).get(name)) is None:
+            return None
+        return self._read(offset)
+
+    def profiles(self, setting_id: str) -> list[Profile]:
+        return [self._read(offset) for offset in self._index.get(setting_id, {}).values()]
+
+    def save(self, profile: Profile) -> None:
+        self._append(profile.to_json())
+
+    def delete(self, setting_id: str, name: str) -> bool:
+        if name not in self._index.get(setting_id, {}):
+            return False
+        self._append({"setting_id": setting_id, "name": name, "deleted": True})
+        return True
+
+    def compact(self) -> None:
+        """
+        Rewrite the file with only the current profiles in it.
+        The new file replaces the old one atomically, once it's fully written.
+        """
+        temp_path = f"{self.path}.tmp"
+        index: dict[str, dict[str, int]] = {}
+        with open(self.path, "rb") as source, open(temp_path, "wb") as target:
+            for setting_id, names in self._index.items():
+                for name, offset in names.items():
+                    source.seek(offset)
+                    index.setdefault(setting_id, {})[name] = target.tell()
+                    target.write(source.readline())
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(temp_path, self.path)
+        self._index = index
+        self._garbage = 0
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import statistics
+from itertools import count
+from typing import Sequence, NamedTuple
+
+
+# Query IDs only need to differ between queries in flight at the same time
+_query_ids = count(1)
+
+
+def build_query(name: str, query_id: int) -> bytes:
+    """
+    A minimal DNS query for the A record of the name, with recursion desired.
+    """
+    header = query_id.to_bytes(2, "big") + b"\x01\x00" + b"\x00\x01" + b"\x00" * 6
+    labels = b''.join(
+        len(label).to_bytes(1, "big") + label for label in name.encode("idna").split(b'.')
+    )
+    return header + labels + b"\x00" + b"\x00\x01" + b"\x00\x01"
+
+
+def is_response(packet: bytes, query_id: int) -> bool:
+    """
+    Check that the packet is a response to the query with the given ID.
+    Any response counts, even an error - the server has answered, which is what's measured.
+    """
+    return (
+        len(packet) >= 12
+        and int.from_bytes(packet[:2], "big") == query_id
+        and bool(packet[2] & 0x80)
+    )
+
+
+class Transport:
+    """
+    Base class for sending DNS queries to a server.
+    """
+
+    async def query(self, server: str, packet: bytes, timeout: float) -> bytes | None:
+        """
+        Send the query and return the first response, or `None` if none arrived in time.
+        """
+        raise NotImplementedError
+
+
+class _ResponseProtocol(asyncio.DatagramProtocol):
+    def __init__(self, response: asyncio.Future[bytes]):
+        self._response: asyncio.Future[bytes] = response
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        if not self._response.done():
+            self._response.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        # an ICMP port unreachable, usually
+        if not self._response.done():
+            self._response.set_exception(exc)
+
+
+class UDPTransport(Transport):
+    """
+    Plain DNS over UDP, with a separate socket for every query.
+    """
+
+    def __init__(self, port: int = 53):
+        self.port: int = port
+
+    async def query(self, server: str, packet: bytes, timeout: float) -> bytes | None:
+        loop = asyncio.get_running_loop()
+        response: asyncio.Future[bytes] = loop.create_future()
+        try:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _ResponseProtocol(response), remote_addr=(server, self.port)
+            )
+        except OSError:
+            return None
+        try:
+            transport.sendto(packet)
+            return await asyncio.wait_for(response, timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            transport.close()
+
+
+class FakeTransport(Transport):
+    """
+    Stand-in for the DNS servers, answering after a fixed delay per server.
+    A sequence of delays is cycled through, one per query. Other servers never answer.
+    """
+
+    def __init__(self, servers: dict[str, float | Sequence[float]]):
+        self.servers: dict[str, Sequence[float]] = {
+            server: (delay,) if isinstance(delay, (int, float)) else delay
+            for server, delay in servers.items()
+        }
+        self.queried: list[str] = []
+
+    async def query(self, server: str, packet: bytes, timeout: float) -> bytes | None:
+        delays = self.servers.get(server)
+        delay = None if not delays else delays[self.queried.count(server) % len(delays)]
+        self.queried.append(server)
+        if delay is None or delay > timeout:
+            await asyncio.sleep(timeout)
+            return None
+        await asyncio.sleep(delay)
+        # echo the query back, with the response bit set
+        return packet[:2] + bytes((packet[2] | 0x80,)) + packet[3:]
+
+
+class ServerTimings(NamedTuple):
+    """
+    Round trip times of a single DNS server, in seconds. Lost queries aren't included.
+    """
+    server: str
+    samples: tuple[float, ...]
+    lost: int
+
+    @property
+    def median(self) -> float | None:
+        return statistics.median(self.samples) if self.samples else None
+
+    @property
+    def p95(self) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        # nearest rank, which is the maximum for up to 19 samples
+        return ordered[-(-len(ordered) * 95 // 100) - 1]
+
+    def sort_key(self) -> tuple[int, float, float]:
+        # servers that never answered go last, and lost queries count against the rest
+        if not self.samples:
+            return (1, 0.0, 0.0)
+        return (0, self.lost / (self.lost + len(self.samples)), self.median or 0.0)
+
+
+async def time_server(
+    server: str,
+    transport: Transport,
+    *,
+    samples: int = 5,
+    timeout: float = 1.0,
+    names: Sequence[str] = ("example.com",),
+) -> ServerTimings:
+    """
+    Query the server `samples` times one after another, cycling through the names.
+    """
+    loop = asyncio.get_running_loop()
+    times: list[float] = []
+    lost = 0
+    for sample in range(samples):
+        query_id = next(_query_ids) & 0xffff
+        packet = build_query(names[sample % len(names)], query_id)
+        start = loop.time()
+        response = await transport.query(server, packet, timeout)
+        if response is not None and is_response(response, query_id):
+            times.append(loop.time() - start)
+        else:
+            lost += 1
+    return ServerTimings(server, tuple(times), lost)
+
+
+async def time_servers(
+    servers: Sequence[str],
+    transport: Transport | None = None,
+    *,
+    samples: int = 5,
+    timeout: float = 1.0,
+    names: Sequence[str] = ("example.com",),
+) -> list[ServerTimings]:
+    """
+    Time all servers concurrently, and return their timings fastest first.
+    The total time is that of the slowest server, at most `samples * timeout`.
+    """
+    if transport is None:
+        transport = UDPTransport()
+    timings = await asyncio.gather(
+        *(
+            time_server(server, transport, samples=samples, timeout=timeout, names=names)
+            for server in dict.fromkeys(servers)
+        )
+    )
+    return sorted(timings, key=ServerTimings.sort_key)
+
+
+def rank_servers(
+    servers: Sequence[str],
+    transport: Transport | None = None,
+    *,
+    samples: int = 5,
+    timeout: float = 1.0,
+) -> list[ServerTimings]:
+    """
+    Blocking version of `time_servers`, for use from worker threads and the CLI.
+    """
+    return asyncio.run(time_servers(servers, transport, samples=samples, timeout=timeout))
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Sequence, TYPE_CHECKING
+
+from resolvers import ServerTimings
+from apply import MethodCall, current_config, plan_changes
+from probing import Prober, ProbeTimeout, TCPProber, default_prober
+
+if TYPE_CHECKING:
+    from cache import AdapterSnapshot
+
+
+def default_gateway(nic: AdapterSnapshot) -> tuple[str, int] | None:
+    """
+    The adapter's first IPv4 gateway, along with its cost metric.
+    """
+    for position, gateway in enumerate(nic.DefaultIPGateway):
+        if ':' not in gateway:
+            metrics = nic.GatewayCostMetric
+            return (gateway, metrics[position] if position < len(metrics) else 0)
+    return None
+
+
+def effective_metric(nic: AdapterSnapshot) -> int:
+    """
+    What the default route through the adapter costs - the interface metric,
+    plus the cost of the gateway.
+    """
+    gateway = default_gateway(nic)
+    return (nic.IPConnectionMetric or 0) + (0 if gateway is None else gateway[1])
+
+
+async def time_path(
+    address: str, prober: Prober, *, samples: int = 5, timeout: float = 1.0
+) -> ServerTimings:
+    """
+    Probe the address `samples` times one after another, see `resolvers.time_server`.
+    """
+    times: list[float] = []
+    lost = 0
+    for _ in range(samples):
+        try:
+            rtt = await prober.probe(address, timeout)
+        except ProbeTimeout:
+            rtt = None
+        if rtt is None:
+            lost += 1
+        else:
+            times.append(rtt)
+    return ServerTimings(address, tuple(times), lost)
+
+
+async def time_adapters(
+    nics: Sequence[AdapterSnapshot],
+    prober: Prober | None = None,
+    *,
+    target: str | None = None,
+    samples: int = 5,
+    timeout: float = 1.0,
+) -> list[tuple[AdapterSnapshot, ServerTimings]]:
+    """
+    Time the path through each adapter with an IPv4 gateway, concurrently,
+    and return them fastest first. Adapters without a gateway carry no default route,
+    so they're skipped.
+
+    Without a `target`, the round trip to each adapter's gateway is measured with the prober.
+    With one, the target itself is probed over TCP from each adapter's address instead,
+    which includes whatever lies behind the gateways.
+    """
+    if prober is None:
+        prober = default_prober()
+    jobs: list[tuple[AdapterSnapshot, Prober, str]] = []
+    for nic in nics:
+        if (gateway := default_gateway(nic)) is None:
+            continue
+        if target is None:
+            jobs.append((nic, prober, gateway[0]))
+            continue
+        addresses = [a for a in nic.IPAddress if ':' not in a]
+        if addresses:
+            jobs.append((nic, TCPProber(local_address=addresses[0]), target))
+    timings = await asyncio.gather(
+        *(
+            time_path(address, path_prober, samples=samples, timeout=timeout)
+            for _, path_prober, address in jobs
+        )
+    )
+    return sorted(zip((nic for nic, _, _ in jobs), timings), key=lambda r: r[1].sort_key())
+
+
+def rank_adapters(
+    nics: Sequence[AdapterSnapshot],
+    prober: Prober | None = None,
+    *,
+    target: str | None = None,
+    samples: int = 5,
+    timeout: float = 1.0,
+) -> list[tuple[AdapterSnapshot, ServerTimings]]:
+    """
+    Blocking version of `time_adapters`, for use from worker threads and the CLI.
+    """
+    return asyncio.run(
+        time_adapters(nics, prober, target=target, samples=samples, timeout=timeout)
+    )
+
+
+def _plan_route(nic: AdapterSnapshot, target: int) -> list[MethodCall]:
+    # a single call is enough either way - the gateway cost only affects the default route,
+    # so it's preferred over the interface metric, which also affects the on-link routes
+    metric = nic.IPConnectionMetric or 0
+    gateway = default_gateway(nic)
+    cost = 0 if gateway is None else gateway[1]
+    if metric + cost == target:
+        return []
+    config = current_config(nic)
+    if not nic.DHCPEnabled and gateway is not None and target - metric >= 1:
+        gateways = tuple(g for g in nic.DefaultIPGateway if ':' not in g)
+        costs = tuple(
+            c for g, c in zip(nic.DefaultIPGateway, nic.GatewayCostMetric) if ':' not in g
+        )
+        if len(costs) == len(gateways):
+            costs = (target - metric, *costs[1:])
+            return plan_changes(nic, config._replace(gateways=gateways, gateway_metrics=costs))
+    # DHCP hands out the gateways, so those adapters can only have their interface metric set
+    return plan_changes(nic, config._replace(metric=target - cost))
+
+
+def plan_metrics(
+    ranked: Sequence[AdapterSnapshot], *, step: int = 10
+) -> dict[AdapterSnapshot, list[MethodCall]]:
+    """
+    Plan the calls that make the default routes preferred in the given order, fastest first.
+
+    Adapters whose effective metrics already increase going down the ranking are left alone.
+    Otherwise, the effective metrics are assigned from the ranking, `step` apart starting
+    at `step`, with one call per adapter that isn't there yet - `SetGateways` with a new
+    cost for the default gateway of static adapters, or `SetIPConnectionMetric` for DHCP
+    adapters and where the gateway cost can't make up the difference.
+    The metrics only depend on the ranking, so re-evaluating repeatedly can't make them
+    creep up, even if the ranking keeps flipping between the same adapters.
+    Returns only the adapters that need any calls.
+    """
+    metrics = [effective_metric(nic) for nic in ranked]
+    if all(before < after for before, after in zip(metrics, metrics[1:])):
+        return {}
+    plans: dict[AdapterSnapshot, list[MethodCall]] = {}
+    previous = 0
+    for nic in ranked:
+        gateway = default_gateway(nic)
+        cost = 0 if gateway is None else gateway[1]
+        # the interface metric can't go below 1, so a costly gateway pushes the rest down
+        previous = max(previous + step, cost + 1)
+        if calls := _plan_route(nic, previous):
+            plans[nic] = calls
+    return plans
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import time
+import queue
+import threading
+from typing import Any, Callable, NamedTuple, TYPE_CHECKING
+
+from backend import com_apartment
+from cache import AdapterSnapshot
+
+if TYPE_CHECKING:
+    from cache import AdapterCache
+    from backend import FakeBackend, WMIBackend
+
+
+class AdapterEvent(NamedTuple):
+    """
+    A change to a single adapter. `kind` is one of "creation", "modification" or "deletion",
+    and `nic` is the adapter's state after the change (or before it, for a deletion).
+    """
+    kind: str
+    nic: Any
+
+
+class EventSource:
+    """
+    Base class for the sources of adapter change events.
+    `start` and `next_event` are always called from the same thread.
+    """
+
+    def start(self) -> None:
+        pass
+
+    def next_event(self, timeout: float) -> AdapterEvent | None:
+        """
+        Wait up to `timeout` seconds for the next event, returning `None` if there wasn't any.
+        """
+        raise NotImplementedError
+
+
+class WMIEventSource(EventSource):
+    """
+    Subscribes to __InstanceOperationEvent for the Win32_NetworkAdapterConfiguration class,
+    which covers the creation, modification and deletion events.
+    WMI polls for these internally, every `interval` seconds.
+    """
+
+    def __init__(self, backend: WMIBackend, *, interval: float = 2.0):
+        self._backend: WMIBackend = backend
+        self.interval: float = interval
+        self._watcher: Any = None
+
+    def start(self) -> None:
+        self._watcher = self._backend.connection.watch_for(
+            notification_type="Operation",
+            wmi_class="Win32_NetworkAdapterConfiguration",
+            delay_secs=self.interval,
+        )
+
+    def next_event(self, timeout: float) -> AdapterEvent | None:
+        import wmi
+        try:
+            event = self._watcher(timeout_ms=int(timeout * 1000))
+        except wmi.x_wmi_timed_out:
+            return None
+        return AdapterEvent(event.event_type, event)
+
+
+class FakeEventSource(EventSource):
+    """
+    Event source driven by hand, or by a `FakeBackend` it's attached to,
+    which reports all successful changes to its adapters.
+    """
+
+    def __init__(self, backend: FakeBackend | None = None):
+        self._events: queue.Queue[AdapterEvent] = queue.Queue()
+        if backend is not None:
+            backend.event_sinks.append(self.push)
+
+    def push(self, kind: str, nic: Any) -> None:
+        self._events.put(AdapterEvent(kind, nic))
+
+    def next_event(self, timeout: float) -> AdapterEvent | None:
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AdapterWatcher(threading.Thread):
+    """
+    Daemon thread applying the events from an `EventSource` to the adapter cache.
+
+    Events are coalesced - after the first one arrives, more are collected for `coalesce`
+    seconds, and only the last event of each adapter is applied. This way, a single flapping
+    adapter results in at most one update per window. Afterwards, `on_change` is called
+    with the updated and removed snapshots, if any of them actually changed.
+    `on_change` is called from the watcher's thread.
+    """
+
+    def __init__(
+        self,
+        source: EventSource,
+        cache: AdapterCache,
+        on_change: Callable[[list[AdapterSnapshot], list[AdapterSnapshot]], None],
+        *,
+        coalesce: float = 0.5,
+    ):
+        super().__init__(name="adapter-watcher", daemon=True)
+        self._source: EventSource = source
+        self._cache: AdapterCache = cache
+        self._on_change = on_change
+        self.coalesce: float = coalesce
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        with com_apartment():
+            self._source.start()
+            while not self._stopped.is_set():
+                if (event := self._source.next_event(timeout=0.5)) is None:
+                    continue
+                pending: dict[str, AdapterEvent] = {event.nic.SettingID: event}
+                deadline = time.monotonic() + self.coalesce
+                while (remaining := deadline - time.monotonic()) > 0:
+                    if (event := self._source.next_event(timeout=remaining)) is not None:
+                        pending[event.nic.SettingID] = event
+                self._apply(pending)
+
+    def _apply(self, pending: dict[str, AdapterEvent]) -> None:
+        updated: list[AdapterSnapshot] = []
+        removed: list[AdapterSnapshot] = []
+        for setting_id, event in pending.items():
+            if event.kind == "deletion" or not event.nic.IPEnabled:
+                if (snapshot := self._cache.remove(setting_id)) is not None:
+                    removed.append(snapshot)
+                continue
+            snapshot = AdapterSnapshot.from_interface(event.nic)
+            if self._cache.update(snapshot):
+                updated.append(snapshot)
+        if updated or removed:
+            self._on_change(updated, removed)
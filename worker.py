@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import queue
+import threading
+from itertools import count
+from typing import Any, Callable
+
+from backend import com_apartment
+
+
+class ComWorker(threading.Thread):
+    """
+    Daemon thread that owns a COM apartment for its whole lifetime,
+    and runs the functions submitted to it one after another.
+
+    Results are handed back through `poll`, which is meant to be called periodically
+    from the GUI thread (via `after`), so that callbacks can safely touch the widgets.
+    If the function raises, the callback receives the exception instead of the result.
+    """
+
+    def __init__(self, name: str = "com-worker"):
+        super().__init__(name=name, daemon=True)
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._queued: set[int] = set()
+        # ID, function, callback, and the callback for when it starts
+        self._tasks: queue.Queue[
+            tuple[int, Callable[[], Any], Callable[[Any], None], Callable[[int], None] | None]
+            | None
+        ]
+        self._tasks = queue.Queue()
+        self._results: queue.Queue[tuple[Callable[[Any], None], Any]] = queue.Queue()
+
+    def run(self) -> None:
+        with com_apartment():
+            while (task := self._tasks.get()) is not None:
+                task_id, func, callback, started = task
+                with self._lock:
+                    if task_id not in self._queued:
+                        # cancelled while waiting in the queue
+                        continue
+                    self._queued.discard(task_id)
+                if started is not None:
+                    self._results.put((started, task_id))
+                try:
+                    result = func()
+                except Exception as exc:
+                    result = exc
+                self._results.put((callback, result))
+
+    def submit(
+        self,
+        func: Callable[[], Any],
+        callback: Callable[[Any], None],
+        started: Callable[[int], None] | None = None,
+    ) -> int:
+        """
+        Queue the function to run, returning an ID that can be used to cancel it.
+        If `started` is passed, it's called with the ID through `poll` once the function starts.
+        """
+        task_id = next(self._ids)
+        with self._lock:
+            self._queued.add(task_id)
+        self._tasks.put((task_id, func, callback, started))
+        return task_id
+
+    def cancel(self, task_id: int) -> bool:
+        """
+        Cancel a queued function. Returns `False` if it has already started running.
+        """
+        with self._lock:
+            if task_id not in self._queued:
+                return False
+            self._queued.discard(task_id)
+            return True
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of functions still waiting in the queue.
+        """
+        with self._lock:
+            return len(self._queued)
+
+    def post(self, callback: Callable[[Any], None], value: Any) -> None:
+        """
+        Hand a value over to the GUI thread - lets a running function report its progress.
+        """
+        self._results.put((callback, value))
+
+    def stop(self) -> None:
+        """
+        Finish the already submitted functions, then exit the thread.
+        """
+        self._tasks.put(None)
+
+    def poll(self) -> None:
+        """
+        Run the callbacks of all finished functions. Call this from the GUI thread.
+        """
+        while True:
+            try:
+                callback, result = self._results.get_nowait()
+            except queue.Empty:
+                return
+            callback(result)